@@ -0,0 +1,47 @@
+import argparse
+import os
+import tempfile
+import time
+
+from scraping.records import ScrapedAlbum, ScrapedTrack
+from sql.backends import SQLiteBackend
+from sql.database_manager import DatabaseManager
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the database saving, on SQLite")
+    parser.add_argument("-n", "--albums", type=int, default=5000, help="albums to insert (default: 5000)")
+    parser.add_argument("-t", "--tracks", type=int, default=12, help="tracks per album (default: 12)")
+    parser.add_argument("-b", "--batch-size", type=int, default=50, help="albums per insert_albums call (default: 50)")
+    return parser
+
+
+def make_albums(n_albums: int, n_tracks: int):
+    """Synthetic albums, sharing artists and genres like scraped ones"""
+    return [ScrapedAlbum(f"Album {i}", f"Artist {i % 500}", f"/artist/{i % 500}", f"/master/{i}", f"Genre {i % 15}",
+                         1960 + i % 60, tuple(ScrapedTrack(f"Track {j}", 180 + j) for j in range(n_tracks)))
+            for i in range(n_albums)]
+
+
+def bench(name: str, save, albums: list):
+    with tempfile.TemporaryDirectory() as directory:
+        dbmanager = DatabaseManager(SQLiteBackend(os.path.join(directory, "music.db")))
+        try:
+            start = time.perf_counter()
+            save(dbmanager, albums)
+            elapsed = time.perf_counter() - start
+        finally:
+            dbmanager.close()
+    print(f"{name:<24}{len(albums) / elapsed:>12,.0f} albums/s")
+
+
+def main():
+    args = parse_arguments().parse_args()
+    albums = make_albums(args.albums, args.tracks)
+    bench("insert_data_from_album", lambda db, batch: [db.insert_data_from_album(album) for album in batch], albums)
+    bench("insert_albums", lambda db, batch: [db.insert_albums(batch[i:i + args.batch_size])
+                                              for i in range(0, len(batch), args.batch_size)], albums)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.database import make_albums
+from sql.backends import SQLiteBackend
+from sql.database_manager import DatabaseManager
+from sql.schema import ID_COLUMNS
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Index size and join latency of binary ids against hex ids, on SQLite")
+    parser.add_argument("-n", "--albums", type=int, default=20000, help="albums in the database (default: 20000)")
+    parser.add_argument("-t", "--tracks", type=int, default=12, help="tracks per album (default: 12)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs of each query, the best is kept (default: 5)")
+    return parser
+
+
+def hex_copy(binary_path: str, hex_path: str):
+    """Copy of a database with the 32 characters hex ids and the varchar columns used before binary ids"""
+    connection = sqlite3.connect(hex_path)
+    connection.execute("ATTACH DATABASE ? AS source", (binary_path,))
+    schema = connection.execute("SELECT sql FROM source.sqlite_master WHERE sql IS NOT NULL ORDER BY rowid").fetchall()
+    for (sql,) in schema:
+        connection.execute(sql.replace("blob", "varchar(255)"))
+    hex_columns = set(ID_COLUMNS)
+    for (table,) in connection.execute("SELECT name FROM source.sqlite_master WHERE type = 'table'").fetchall():
+        columns = [column[1] for column in connection.execute(f"PRAGMA source.table_info({table})").fetchall()]
+        selected = [f"lower(hex({column}))" if (table, column) in hex_columns else column for column in columns]
+        connection.execute(f"INSERT INTO main.{table} SELECT {', '.join(selected)} FROM source.{table}")
+    connection.commit()
+    connection.execute("DETACH DATABASE source")
+    connection.close()
+
+
+def index_sizes(path: str):
+    """Bytes of each table and index"""
+    connection = sqlite3.connect(path)
+    sizes = dict(connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    connection.close()
+    return sizes
+
+
+def best_time(run, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(path: str, repeat: int):
+    dbmanager = DatabaseManager(SQLiteBackend(path))
+    try:
+        return {
+            "get_tracks": best_time(lambda: dbmanager.get_tracks(), repeat),
+            "iter_tracks": best_time(lambda: sum(1 for _ in dbmanager.iter_tracks()), repeat),
+            "count_tracks": best_time(lambda: dbmanager.count_tracks(), repeat),
+        }
+    finally:
+        dbmanager.close()
+
+
+def main():
+    args = parse_arguments().parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        binary_path, hex_path = os.path.join(directory, "binary.db"), os.path.join(directory, "hex.db")
+        dbmanager = DatabaseManager(SQLiteBackend(binary_path))
+        dbmanager.insert_albums(make_albums(args.albums, args.tracks))
+        dbmanager.close()
+        sqlite3.connect(binary_path).execute("VACUUM")
+        hex_copy(binary_path, hex_path)
+
+        hex_sizes, binary_sizes = index_sizes(hex_path), index_sizes(binary_path)
+        print(f"{'table or index':<36}{'hex ids':>12}{'binary ids':>12}")
+        for name in sorted(hex_sizes, key=hex_sizes.get, reverse=True):
+            if hex_sizes[name] > 4096:
+                print(f"{name:<36}{hex_sizes[name] / 1024:>10,.0f}kB{binary_sizes.get(name, 0) / 1024:>10,.0f}kB")
+        print(f"{'database file':<36}{os.path.getsize(hex_path) / 1024:>10,.0f}kB"
+              f"{os.path.getsize(binary_path) / 1024:>10,.0f}kB")
+
+        hex_times, binary_times = measure(hex_path, args.repeat), measure(binary_path, args.repeat)
+        print(f"\n{'query':<36}{'hex ids':>12}{'binary ids':>12}")
+        for query in hex_times:
+            print(f"{query:<36}{hex_times[query] * 1000:>10,.1f}ms{binary_times[query] * 1000:>10,.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import os
+import time
+
+from utils import hash_tuple
+from utils import ids
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Throughput of the track id schemes")
+    parser.add_argument("-n", "--albums", type=int, default=20000, help="albums to hash (default: 20000)")
+    parser.add_argument("-t", "--tracks", type=int, default=12, help="tracks per album (default: 12)")
+    return parser
+
+
+def bench(name: str, hash_album, albums: list, n_ids: int):
+    start = time.perf_counter()
+    for album_id, tracks in albums:
+        hash_album(tracks, album_id)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24}{n_ids / elapsed:>14,.0f} ids/s")
+
+
+def main():
+    args = parse_arguments().parse_args()
+    albums = [(ids.id_from_hex(hash_tuple(f"album {i}")), [(f"track {j} of album {i}", 180 + j) for j in range(args.tracks)])
+              for i in range(args.albums)]
+    n_ids = args.albums * args.tracks
+    bench("hash_tuple", lambda tracks, album_id: [hash_tuple((title, duration, album_id.hex()))
+                                                  for title, duration in tracks], albums, n_ids)
+    for scheme in (ids.COMPAT, ids.FAST):
+        os.environ["ID_SCHEME"] = scheme
+        ids.id_scheme.cache_clear()
+        bench(f"track_ids ({scheme})", ids.track_ids, albums, n_ids)
+        bench(f"make_id ({scheme})", lambda tracks, album_id: [ids.make_id((album_id.hex(), title, duration))
+                                                               for title, duration in tracks], albums, n_ids)
+
+
+if __name__ == "__main__":
+    main()
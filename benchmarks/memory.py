@@ -0,0 +1,54 @@
+import argparse
+import pickle
+import tracemalloc
+
+from scraping.records import ScrapedAlbum, ScrapedTrack
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Memory footprint of the scraped albums representations")
+    parser.add_argument("-n", "--albums", type=int, default=100000, help="albums to build (default: 100000)")
+    parser.add_argument("-t", "--tracks", type=int, default=12, help="tracks per album (default: 12)")
+    return parser
+
+
+def make_dict_album(i: int, n_tracks: int):
+    """Album as it was passed around before the record types, nested dicts"""
+    return {
+        "name": f"Album {i}",
+        "artist": {"name": f"Artist {i % 5000}", "url": f"/artist/{i % 5000}"},
+        "url": f"/master/{i}",
+        "genre": "Rock",
+        "year": 1960 + i % 60,
+        "tracks": [{"name": f"Track {j}", "duration": 180 + j} for j in range(n_tracks)],
+    }
+
+
+def make_record_album(i: int, n_tracks: int):
+    return ScrapedAlbum(f"Album {i}", f"Artist {i % 5000}", f"/artist/{i % 5000}", f"/master/{i}", "Rock",
+                        1960 + i % 60, tuple(ScrapedTrack(f"Track {j}", 180 + j) for j in range(n_tracks)))
+
+
+def measure(make_album, n_albums: int, n_tracks: int):
+    """
+    Builds n_albums albums and measures their footprint
+    Returns:
+        dict: traced memory of the albums and size of their pickle, what is sent to and from parsing workers
+    """
+    tracemalloc.start()
+    albums = [make_album(i, n_tracks) for i in range(n_albums)]
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"memory_mb": memory / 1024 ** 2, "pickle_mb": len(pickle.dumps(albums)) / 1024 ** 2}
+
+
+def main():
+    args = parse_arguments().parse_args()
+    print(f"{'':<10}{'memory_mb':>12}{'pickle_mb':>12}")
+    for name, make_album in (("dict", make_dict_album), ("records", make_record_album)):
+        result = measure(make_album, args.albums, args.tracks)
+        print(f"{name:<10}{result['memory_mb']:>12.1f}{result['pickle_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
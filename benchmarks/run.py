@@ -0,0 +1,184 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.server import DiscogsStandInServer, FIXTURES_DIR
+from config import ScraperConfig
+from scraping import Scraper
+from scraping.parsers import Bs4Parser, get_parser, lxml_html
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the discogs scraper")
+    parser.add_argument("-c", "--count", type=int, default=5, help="search pages to scrape (default: 5)")
+    parser.add_argument("-o", "--cores", type=int, nargs="+", default=[1, 2, 4],
+                        help="parsing cores to benchmark (default: 1 2 4)")
+    parser.add_argument("-b", "--chunksizes", type=int, nargs="+", default=[1, 4, 16],
+                        help="parse engine chunk sizes to benchmark (default: 1 4 16)")
+    parser.add_argument("--max-per-host", type=int, default=20, help="concurrent requests (default: 20)")
+    parser.add_argument("--latency", type=float, default=0.05, help="server mean response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="server response time deviation in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of 429 responses")
+    parser.add_argument("--json", help="writes the results to this file")
+    parser.add_argument("--baseline", help="results file to compare with, exits with 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="accepted throughput loss compared to the baseline (default: 0.2)")
+    parser.add_argument("--single", help=argparse.SUPPRESS)  # runs one configuration, used internally
+    return parser
+
+
+def bench_parsers(repeat: int = 50):
+    """
+    Measures the cpu time spent parsing the fixtures with each backend, and checks they give the same results
+    Returns:
+        dict: milliseconds of cpu time per page, by stage and backend
+    """
+    with open(os.path.join(FIXTURES_DIR, "search_page.html"), encoding="utf-8") as f:
+        search_page = f.read()
+    with open(os.path.join(FIXTURES_DIR, "master_page.html"), encoding="utf-8") as f:
+        master_page = f.read()
+    parsers = [Bs4Parser()] + ([get_parser("lxml")] if lxml_html is not None else [])
+    results = {}
+    for parser in parsers:
+        for stage, page, parse in (("search", search_page, parser.parse_albums_page),
+                                   ("master", master_page, parser.parse_album_page)):
+            start = time.process_time()
+            for _ in range(repeat):
+                parse(page)
+            results[f"parse_{stage}_{parser.name}_ms"] = (time.process_time() - start) / repeat * 1000
+    if len(parsers) > 1:
+        assert parsers[0].parse_albums_page(search_page) == parsers[1].parse_albums_page(search_page)
+        assert parsers[0].parse_album_page(master_page) == parsers[1].parse_album_page(master_page)
+    return results
+
+
+def bench_scraper(base_url: str, count: int, cores: int, chunksize: int, max_per_host: int):
+    """
+    Scrapes the stand-in server and measures each stage of the scraper
+    Returns:
+        dict: throughput, fetch latency, parse workers cpu time and memory measures
+    """
+    cfg = ScraperConfig(base_url=base_url, cache_dir=None, parse_chunksize=chunksize, max_per_host=max_per_host)
+    scraper = Scraper(cfg, count=count, cores=cores)
+    latencies = []
+    scraper.fetcher.on_latency = latencies.append
+    workers_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        start = time.perf_counter()
+        albums = scraper.scrape_albums()
+        list_time = time.perf_counter() - start
+        rss_list_pages = _peak_rss_mb()
+
+        start = time.perf_counter()
+        albums_tracks = scraper.scrape_albums_tracks(albums)
+        album_time = time.perf_counter() - start
+        latencies.sort()
+    finally:
+        scraper.close()
+    # The album pages are parsed by the parse engine's workers, their cpu time is counted once they exited
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN)
+    workers_cpu = (workers.ru_utime - workers_start.ru_utime) + (workers.ru_stime - workers_start.ru_stime)
+    return {
+        "cores": cores,
+        "chunksize": chunksize,
+        "list_pages_per_sec": count / list_time,
+        "album_pages_per_sec": len(albums) / album_time,
+        "albums_scraped": len(albums_tracks),
+        "fetch_p50_ms": statistics.median(latencies) * 1000,
+        "fetch_p99_ms": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000,
+        "workers_cpu_s": workers_cpu,
+        "workers_cpu_ms_per_album_page": workers_cpu / max(len(albums), 1) * 1000,
+        "peak_rss_list_pages_mb": rss_list_pages,
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_rss_workers_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def run_single(args):
+    """Benchmarks one configuration against a fresh server, in the current process"""
+    cores, chunksize = map(int, args.single.split(","))
+    with DiscogsStandInServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                              rate_429=args.rate_429) as server:
+        result = bench_scraper(server.url, args.count, cores, chunksize, args.max_per_host)
+    print(json.dumps(result))
+
+
+def run_all(args):
+    """
+    Benchmarks every configuration, each one in its own process so that peak memory measures are not mixed
+    Returns:
+        dict: parsers and scraper results
+    """
+    results = {"parsers": bench_parsers(), "scraper": []}
+    for cores, chunksize in itertools.product(args.cores, args.chunksizes):
+        command = [sys.executable, "-m", "benchmarks.run", "--single", f"{cores},{chunksize}",
+                   "-c", str(args.count), "--max-per-host", str(args.max_per_host), "--latency", str(args.latency),
+                   "--jitter", str(args.jitter), "--error-rate", str(args.error_rate), "--rate-429", str(args.rate_429)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results["scraper"].append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def print_results(results: dict):
+    for name, value in results["parsers"].items():
+        print(f"{name:<28}{value:>10.3f}")
+    columns = list(results["scraper"][0])
+    print(" ".join(f"{column:>{max(len(column), 8)}}" for column in columns))
+    for row in results["scraper"]:
+        print(" ".join(f"{_format(row[column]):>{max(len(column), 8)}}" for column in columns))
+
+
+def compare_with_baseline(results: dict, baseline_path: str, tolerance: float):
+    """
+    Compares the album pages throughput of each configuration with a baseline
+    Returns:
+        bool: whether a configuration regressed by more than the tolerance
+    """
+    with open(baseline_path) as f:
+        baseline = {(row["cores"], row["chunksize"]): row for row in json.load(f)["scraper"]}
+    regression = False
+    for row in results["scraper"]:
+        reference = baseline.get((row["cores"], row["chunksize"]))
+        if reference is None:
+            continue
+        ratio = row["album_pages_per_sec"] / reference["album_pages_per_sec"]
+        if ratio < 1 - tolerance:
+            regression = True
+            logging.error(f"Regression with {row['cores']} cores and chunksize {row['chunksize']}: "
+                          f"{ratio:.0%} of the baseline album pages throughput")
+    return regression
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in KiB on linux
+
+
+def _format(value):
+    return f"{value:.1f}" if isinstance(value, float) else str(value)
+
+
+def main():
+    args = parse_arguments().parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(filename)s-%(asctime)s %(levelname)s:%(message)s')
+    if args.single:
+        run_single(args)
+        return
+    results = run_all(args)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline and compare_with_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import logging
+import os
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class DiscogsStandInServer:
+    def __init__(self, port: int = 0, latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0,
+                 rate_429: float = 0.0, retry_after: float = 1):
+        """
+        Local http server serving recorded discogs pages, used to benchmark the scraper without network access.
+
+        Search pages (/search/...) are served from fixtures/search_page.html, with master urls made unique
+        for each page number. Every other path is served from fixtures/master_page.html.
+        Args:
+            port (int): port to listen on, 0 picks a free port
+            latency (float): mean response time in seconds
+            jitter (float): standard deviation of the response time in seconds
+            error_rate (float): share of requests answered with a 500
+            rate_429 (float): share of requests answered with a 429 and a Retry-After header
+            retry_after (float): Retry-After value of the 429 responses, in seconds
+        """
+        self.logger = logging.getLogger(__name__)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        with open(os.path.join(FIXTURES_DIR, "search_page.html"), encoding="utf-8") as f:
+            self.search_page = f.read()
+        with open(os.path.join(FIXTURES_DIR, "master_page.html"), encoding="utf-8") as f:
+            self.master_page = f.read().encode("utf-8")
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.logger.info(f"Discogs stand-in server listening on {self.url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _search_page(self, path: str):
+        """Search page whose master urls are specific to the requested page number"""
+        page = re.search(r"[?&]page=(\d+)", path)
+        page = page.group(1) if page else "1"
+        return self.search_page.replace('href="/master/', f'href="/master/{page}0').encode("utf-8")
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(max(random.gauss(server.latency, server.jitter), 0))
+                draw = random.random()
+                if draw < server.rate_429:
+                    self._send(429, b"", {"Retry-After": str(server.retry_after)})
+                elif draw < server.rate_429 + server.error_rate:
+                    self._send(500, b"")
+                elif self.path.startswith("/search/"):
+                    self._send(200, server._search_page(self.path))
+                else:
+                    self._send(200, server.master_page)
+
+            def _send(self, status: int, body: bytes, headers: dict = None):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves recorded discogs pages")
+    parser.add_argument("-p", "--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="response time standard deviation in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of 429 responses")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    stand_in = DiscogsStandInServer(args.port, args.latency, args.jitter, args.error_rate, args.rate_429).start()
+    try:
+        stand_in._thread.join()
+    except KeyboardInterrupt:
+        stand_in.stop()
@@ -5,4 +5,30 @@ from dataclasses import dataclass
 class ScraperConfig:
     base_url: str = "https://www.discogs.com"
     base_options: str = "/search/?limit=100&sort=have%2Cdesc&ev=em_rs&type=master&layout=sm"
-    batch_size: int = 100
+    queue_size: int = 500  # max downloaded pages waiting to be parsed
+    max_per_host: int = 20  # concurrent requests to discogs
+    max_retries: int = 5  # retries on 429/5xx responses and connection errors
+    timeout: int = 30  # seconds
+    parse_chunksize: int = 4  # pages sent at once to a parsing worker
+    parser: str = "auto"  # html parser backend: "lxml", "bs4" or "auto"
+    cache_dir: str = ".cache/http"  # on-disk http cache, None to disable it
+    cache_max_size: int = 2 * 1024 ** 3  # bytes
+    cache_max_age: int = 24 * 3600  # seconds before a cached page is revalidated
+    journal_path: str = "crawl_journal.jsonl"  # used to resume an interrupted crawl
+    pipeline_queue_size: int = 200  # max albums waiting between two stages of the scraping pipeline
+    save_batch_size: int = 50  # albums inserted in the database per transaction
+    save_interval: float = 2.0  # max seconds a scraped album waits before being saved
+    # Each database connection has its own id cache of up to 1M ids per table (about 150 MB per table when full),
+    # so memory grows with db_writers
+    db_writers: int = 1  # database connections saving albums in parallel, see sql/writer.py
+    slow_query_time: float = 0.5  # seconds, SQL statements slower than this are logged
+    spotify_workers: int = 8  # concurrent Spotify searches
+    spotify_rate: float = 5.0  # initial Spotify requests per second, adapted to the 429 responses
+    spotify_max_rate: float = 20.0  # Spotify requests per second never exceeded
+    spotify_cache_path: str = ".cache/spotify_search.sqlite"  # Spotify search results, see spotify/search_cache.py
+    spotify_found_ttl: int = 180 * 24 * 3600  # seconds a spotify id found by a search is reused
+    spotify_not_found_ttl: int = 30 * 24 * 3600  # seconds before a search which found nothing is sent again
+    spotify_flush_interval: float = 30.0  # max seconds a found spotify id waits for its batch of 100 features
+    spotify_by_album: bool = True  # find tracks by album then search the unmatched ones, see spotify/album_resolver.py
+    spotify_search_limit: int = 10  # results of a Spotify search scored by spotify/matcher.py to pick the track
+    spotify_min_confidence: float = 0.7  # matcher score under which a track is considered not found
@@ -3,12 +3,18 @@ import logging
 import time
 
 from dotenv import load_dotenv
-from tqdm import tqdm
 
 from config import ScraperConfig
 from scraping import Scraper
+from scraping.journal import CrawlJournal
+from scraping.pipeline import ScrapePipeline
 from spotify import SpotifyDBFiller
+from spotify.pipeline import FeaturesPipeline
 from sql.database_manager import DatabaseManager
+from sql.instrumentation import query_stats
+from sql.snapshot import export_snapshot
+from sql.writer import ParallelWriter
+from utils import SortedHashSet
 
 load_dotenv()
 
@@ -30,70 +36,109 @@ def parse_arguments():
                         help="year of album release to filter")
     parser.add_argument("-o", "--cores", required=False, type=int, default=4,
                         help="amount of CPU cores to use for multiprocessed scraping (default: 4)")
+    parser.add_argument("--offline", required=False, action="store_true", default=False,
+                        help="only use the discogs pages stored in the http cache")
+    parser.add_argument("-r", "--resume", required=False, action="store_true", default=False,
+                        help="resume an interrupted crawl from its journal, skipping the pages already done")
+    parser.add_argument("-i", "--incremental", required=False, action="store_true", default=False,
+                        help="only scrape the albums that are not in the database yet")
     parser.add_argument("-a", "--api", required=False, action="store_true",
                         help="saves additional data from Spotify api")
+    parser.add_argument("-e", "--export", required=False, metavar="SNAPSHOT_DIR",
+                        help="export the database to a columnar snapshot for analytics, or append the new rows to it")
+    parser.add_argument("--query-stats", required=False, metavar="JSON_FILE",
+                        help="write the statistics of the SQL statements of the run to this file")
     return parser
 
 
 def scrape_discogs(args: dict):
     """
-    Scrape discogs webpage and saves it to database if specified
+    Scrape discogs webpage and saves it to database if specified.
+    Albums are saved as they are scraped, by the scraping pipeline.
     Args:
         args: cli arguments
     """
     cfg = ScraperConfig()
-    save = args.pop("save")  # bool that we will use when we implement the storage in db
-    scraper = Scraper(cfg, **args)
-    albums = scraper.scrape_albums()
-    start_albums_scraping = time.time()
-    albums_tracks = scraper.scrape_albums_tracks(albums)
-    logging.info(f"Scraped {len(albums_tracks)} albums containing a total of "
-                 f"{sum(len(album['tracks']) for album in albums_tracks)} tracks.")
-    logging.info(f"Album scraping completed in {time.time() - start_albums_scraping} seconds")
-    scraper.print_errors()  # outputs urls of pages that raised an error during scraping
-    if save:
-        start_db_saving = time.time()
-        logging.info("Saving data into database")
-        dbmanager = DatabaseManager()
-        for album in tqdm(albums_tracks, total=len(albums_tracks)):
-            dbmanager.insert_data_from_album(album)
-        logging.info(f"Database saving completed in {time.time() - start_db_saving} seconds.")
+    save = args.pop("save")
+    incremental = args.pop("incremental")
+    # with several writers, albums are saved on the writers' own connections
+    dbmanager = DatabaseManager() if incremental or (save and cfg.db_writers == 1) else None
+    journal = CrawlJournal(cfg.journal_path, resume=args.pop("resume"))
+    scraper = Scraper(cfg, journal=journal, **args)
+    writer = None
+    try:
+        known_urls = None
+        if incremental:
+            known_urls = SortedHashSet(dbmanager.iter_album_urls())
+            logging.info(f"Incremental mode: skipping the {len(known_urls)} albums already in the database")
+        save_albums = None
+        if save:
+            writer = ParallelWriter(cfg.db_writers) if cfg.db_writers > 1 else None
+            save_albums = writer.insert_albums if writer else dbmanager.insert_albums
+        pipeline = ScrapePipeline(scraper, save_albums, known_urls,
+                                  cfg.pipeline_queue_size, cfg.save_batch_size, cfg.save_interval)
+        start_albums_scraping = time.time()
+        stats = pipeline.run()
+        logging.info(f"Scraped {stats['albums_scraped']} albums containing a total of "
+                     f"{stats['tracks_scraped']} tracks, {stats['albums_skipped']} albums skipped as already in "
+                     f"the database, {stats['albums_saved']} albums saved.")
+        logging.info(f"Album scraping completed in {time.time() - start_albums_scraping} seconds")
+        if save and not writer:
+            logging.info(f"Database id cache hits and misses: {dbmanager.id_cache.stats}")
+        scraper.print_errors()  # outputs urls of pages that raised an error during scraping
+    finally:
+        scraper.close()
+        journal.close()
+        if writer:
+            writer.close()
+        if dbmanager:
+            dbmanager.close()
 
 
 def fill_db_from_spotify(args):
     """
-    Fills the database with additional information from Spotify
+    Fills the database with additional information from Spotify, see spotify/pipeline.py
     Args:
         args: cli arguments
     """
-    spotify = SpotifyDBFiller()
-    tracks = spotify.dbmanager.get_tracks()
-    db_ids, spotify_ids, audio_features = [], [], []
-    count = 0
-    batch_size = 100
-    # Removing tracks where tempo already added
-    tracks = [track for track in tracks if all(item is None for item in track[6:])]
-    with tqdm(total=batch_size) as sub_pbar:
-        for i, track in enumerate(tqdm(tracks)):
-            db_id, name, album, artist = track[:4]
-            spotify_id = spotify.get_track_spotify_id(name, album, artist)
-            if spotify_id:
-                spotify_ids.append(spotify_id)
-                db_ids.append(db_id)
-                sub_pbar.update()
-            # Every BATCH_SIZE ids (spotify's limit), make a batch request
-            if len(spotify_ids) == batch_size or i == len(track):
-                count += batch_size
-                features, feature_names = spotify.get_audio_features(spotify_ids)
-                if features and feature_names:
-                    tracks_values = []
-                    for feature in features:
-                        track_values = [feature[name] if feature else None for name in feature_names]
-                        tracks_values.append(track_values)
-                    spotify.fill_audio_features_in_db(db_ids, tracks_values)
-                    logging.info(f"Added {count}/{len(tracks)} features in database")
-                spotify_ids, db_ids = [], []
-                sub_pbar.reset()
+    cfg = ScraperConfig()
+    spotify = SpotifyDBFiller(cfg=cfg)
+    # Tracks are streamed on their own connection, the features are written on the filler's by another thread
+    reader = DatabaseManager()
+    try:
+        # Only the tracks without features, streamed from the database
+        if cfg.spotify_by_album:
+            n_tracks = reader.count_album_tracks(missing_features=True)
+            tracks = reader.iter_albums_tracks(missing_features=True)
+        else:
+            n_tracks = reader.count_tracks(missing_features=True)
+            tracks = (track[:4] + (track[5],) for track in reader.iter_tracks(missing_features=True))
+        pipeline = FeaturesPipeline(spotify, flush_interval=cfg.spotify_flush_interval)
+        stats = pipeline.run(tracks, n_tracks, by_album=cfg.spotify_by_album)
+        logging.info(f"Searched {stats['tracks_searched']} tracks, found {stats['ids_found']} spotify ids, "
+                     f"saved the features of {stats['features_saved']} tracks")
+        limiter = spotify.wrapper.limiter
+        logging.info(f"Spotify requests: {limiter.requests} sent, {limiter.throttled_requests} throttled, "
+                     f"final rate {limiter.rate:.2f} requests/s; search cache: {spotify.cache.hits} hits, "
+                     f"{spotify.cache.misses} misses")
+        if cfg.spotify_by_album:
+            logging.info(f"Spotify albums: {spotify.resolver.stats}")
+    finally:
+        reader.close()
+        spotify.close()
+
+
+def export_database(directory: str):
+    """
+    Exports the database to a columnar snapshot, see sql/snapshot.py
+    Args:
+        directory: snapshot directory
+    """
+    dbmanager = DatabaseManager()
+    try:
+        export_snapshot(dbmanager, directory)
+    finally:
+        dbmanager.close()
 
 
 def main():
@@ -102,8 +147,14 @@ def main():
     args = vars(parser.parse_args())
     log_level = logging.DEBUG if args.pop("debug") else logging.INFO
     logging.basicConfig(filename="logs.txt", level=log_level, format='%(filename)s-%(asctime)s %(levelname)s:%(message)s')
+    query_stats.slow_threshold = ScraperConfig().slow_query_time
+    query_stats_path = args.pop("query_stats")
 
-    if args['api']:
+    export = args.pop("export")
+    if export:
+        logging.info(f"Exporting the database to {export}")
+        export_database(export)
+    elif args['api']:
         logging.info("Starting Spotify API requests")
         fill_db_from_spotify(args)
     else:
@@ -111,6 +162,9 @@ def main():
         logging.info("Starting Discogs scraping")
         scrape_discogs(args)
 
+    query_stats.log_summary()
+    if query_stats_path:
+        query_stats.write_json(query_stats_path)
     logging.info(f"Total process completed in {time.time() - start} seconds")
 
 
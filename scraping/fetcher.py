@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from queue import Full, Queue
+from threading import Event, Lock, Thread
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from .http_cache import HttpCache
+
+_FETCH_DONE = None  # put in the results queue once every url has been fetched
+
+
+class AsyncFetcher:
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, headers: dict = None, max_per_host: int = 20, max_retries: int = 5, timeout: int = 30,
+                 queue_size: int = 500, cache: HttpCache = None, on_latency=None):
+        """
+        Asynchronous http fetcher running its own event loop in a background thread.
+
+        A single aiohttp session (so a single connection pool) is kept for the fetcher's lifetime,
+        and responses are handed to the caller as soon as they complete.
+        Args:
+            headers (dict): headers sent with every request
+            max_per_host (int): maximum amount of concurrent requests to the same host
+            max_retries (int): retries for a url answering with a 429/5xx status or a connection error
+            timeout (int): total timeout of a request in seconds
+            queue_size (int): maximum amount of fetched pages waiting to be consumed
+            cache (HttpCache): responses cache, revalidated with conditional requests once expired
+            on_latency: function called with the seconds taken by each request, e.g. by the benchmarks.
+                        Called from the event loop thread, it must not block.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.headers = headers or {}
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.queue_size = queue_size
+        self.cache = cache
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = Lock()  # fetch() can be called from several threads, e.g. by the scraping pipeline
+        self._session = None
+        self._host_semaphores = {}
+        self._host_resume_at = {}  # hosts which asked us to wait with a Retry-After header
+        self.on_latency = on_latency
+
+    def fetch(self, urls):
+        """
+        Fetches the given urls concurrently.
+        Args:
+            urls: iterable of urls, it is consumed lazily
+
+        Yields:
+            tuple: (html, url, status_code) in completion order, html and status_code being None
+                   when the request failed
+        """
+        self._start()
+        results = Queue(maxsize=self.queue_size)
+        stop = Event()
+        future = asyncio.run_coroutine_threadsafe(self._fetch_all(iter(urls), results, stop), self._loop)
+        try:
+            while (response := results.get()) is not _FETCH_DONE:
+                yield response
+        except GeneratorExit:
+            # The consumer stopped early: the remaining urls are not fetched and nothing waits for it anymore
+            stop.set()
+            future.cancel()
+            raise
+        future.result()  # raises the exception of the event loop side if any
+
+    def close(self):
+        """Closes the connection pool, the cache and stops the event loop"""
+        if self.cache is not None:
+            self.cache.close()
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = self._thread = self._session = None
+
+    def _start(self):
+        """Starts the event loop thread and the session the first time they are needed"""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            self._thread = Thread(target=loop.run_forever, daemon=True)
+            self._thread.start()
+            self._session = asyncio.run_coroutine_threadsafe(self._create_session(), loop).result()
+            self._loop = loop
+
+    async def _create_session(self):
+        # The connector holds the connection pool shared by every request, limit_per_host caps each host
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.max_per_host)
+        return aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                     timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def _fetch_all(self, urls, results: Queue, stop: Event):
+        """
+        Fetches the urls with a fixed amount of workers and forwards the responses to the results queue,
+        until stop is set by the consumer
+        """
+        pending = asyncio.Queue(maxsize=self.max_per_host)
+        completed = asyncio.Queue(maxsize=self.queue_size)
+
+        async def produce():
+            # The urls may come from a generator blocking on another thread, it must not block the event loop
+            while (url := await asyncio.to_thread(next, urls, _FETCH_DONE)) is not _FETCH_DONE:
+                await pending.put(url)
+            for _ in range(self.max_per_host):
+                await pending.put(_FETCH_DONE)
+
+        async def work():
+            while (url := await pending.get()) is not _FETCH_DONE:
+                await completed.put(await self._fetch(url))
+
+        async def forward():
+            while (response := await completed.get()) is not _FETCH_DONE:
+                # The consumer is in another thread, a full queue must not block the event loop
+                await asyncio.to_thread(self._put, results, response, stop)
+
+        forwarder = asyncio.create_task(forward())
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(self.max_per_host)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await completed.put(_FETCH_DONE)
+            await forwarder
+            await asyncio.to_thread(self._put, results, _FETCH_DONE, stop)
+
+    async def _fetch(self, url: str):
+        """Fetches a single url from the cache or from the server"""
+        if self.cache is None:
+            return (await self._request(url))[:3]
+        cached = await asyncio.to_thread(self.cache.get, url)
+        if cached is not None and self.cache.is_fresh(cached):
+            return cached.body, url, 200
+        if self.cache.offline:
+            self.logger.warning(f"Offline mode: {url} is not cached")
+            return None, url, None
+        html, url, status, headers = await self._request(url, self.cache.conditional_headers(cached))
+        if status == 304 and cached is not None:
+            await asyncio.to_thread(self.cache.revalidated, url)
+            return cached.body, url, 200
+        if status == 200:
+            await asyncio.to_thread(self.cache.store, url, html, headers)
+        return html, url, status
+
+    async def _request(self, url: str, headers: dict = None):
+        """
+        Requests a single url, retrying on 429/5xx statuses and connection errors
+        Returns:
+            tuple: (html, url, status_code, response headers)
+        """
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.setdefault(host, asyncio.Semaphore(self.max_per_host))
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_host(host)
+            try:
+                async with semaphore:
+                    start = time.perf_counter()
+                    async with self._session.get(url, headers=headers) as response:
+                        html = await response.text(errors="replace")  # a mis-encoded page is still parsed
+                        status = response.status
+                        response_headers = response.headers
+                    if self.on_latency is not None:
+                        self.on_latency(time.perf_counter() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.warning(f"Request to {url} failed ({attempt + 1}/{self.max_retries + 1}): {e!r}")
+                await asyncio.sleep(0.2 * 2 ** attempt)
+                continue
+            if status not in self.RETRY_STATUSES or attempt == self.max_retries:
+                return html, url, status, response_headers
+            delay = self._parse_retry_after(response_headers.get("Retry-After"))
+            if delay is not None:
+                # Only this host is paused, requests to the other hosts carry on
+                self.logger.warning(f"{host} answered {status} with Retry-After, pausing it {delay:.1f}s")
+                self._host_resume_at[host] = max(self._host_resume_at.get(host, 0), time.monotonic() + delay)
+            else:
+                await asyncio.sleep(0.2 * 2 ** attempt)
+        return None, url, None, {}
+
+    async def _wait_for_host(self, host: str):
+        """Waits until the host's Retry-After delay is over"""
+        while (delay := self._host_resume_at.get(host, 0) - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _put(queue: Queue, item, stop: Event):
+        """Puts an item in the results queue, unless the consumer stopped reading it"""
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return
+            except Full:
+                continue
+
+    @staticmethod
+    def _parse_retry_after(value: str):
+        """Converts a Retry-After header, in seconds or as an http date, to a delay in seconds"""
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import NamedTuple
+
+
+class CachedResponse(NamedTuple):
+    body: str
+    etag: str
+    last_modified: str
+    fetched_at: float
+
+
+class HttpCache:
+    def __init__(self, directory: str, max_size: int = 2 * 1024 ** 3, max_age: int = 24 * 3600, offline: bool = False):
+        """
+        On-disk cache of http responses, keyed by url.
+
+        Bodies are stored zlib-compressed under the sha256 of their content, so identical pages are stored once.
+        An sqlite index maps each url to its body and its validators (ETag, Last-Modified).
+        Args:
+            directory (str): cache directory, created if needed
+            max_size (int): maximum size of the stored bodies in bytes, least recently used urls are evicted above it
+            max_age (int): seconds during which a response is used without revalidation
+            offline (bool): only serve responses from the cache, whatever their age
+        """
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.offline = offline
+
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        # The cache is used from several threads, the lock serializes access to the index
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self._db.commit()
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def get(self, url: str):
+        """
+        Gets the cached response of an url
+        Returns:
+            CachedResponse: None if the url isn't cached
+        """
+        with self._lock:
+            row = self._db.execute("SELECT digest, etag, last_modified, fetched_at FROM entries WHERE url = ?",
+                                   (url,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+        digest, etag, last_modified, fetched_at = row
+        try:
+            with open(self._object_path(digest), "rb") as f:
+                body = zlib.decompress(f.read()).decode("utf-8")
+        except (OSError, zlib.error) as e:
+            # The body is read without the lock: a concurrent store() of the url may have replaced the entry and
+            # deleted its previous body meanwhile, the new entry is kept
+            self.logger.warning(f"Dropping unreadable cache entry for {url}: {e}")
+            self._delete_entry(url, digest)
+            return None
+        return CachedResponse(body, etag, last_modified, fetched_at)
+
+    def is_fresh(self, response: CachedResponse):
+        """Whether a cached response can be used without revalidation"""
+        return self.offline or time.time() - response.fetched_at < self.max_age
+
+    @staticmethod
+    def conditional_headers(response: CachedResponse):
+        """Headers making the next request conditional, the server answers 304 if the page didn't change"""
+        headers = {}
+        if response is not None:
+            if response.etag:
+                headers["If-None-Match"] = response.etag
+            if response.last_modified:
+                headers["If-Modified-Since"] = response.last_modified
+        return headers
+
+    def store(self, url: str, body: str, headers):
+        """
+        Stores a response
+        Args:
+            url (str): requested url
+            body (str): response text
+            headers: response headers
+        """
+        data = body.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        compressed = zlib.compress(data)
+        now = time.time()
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM objects WHERE digest = ?", (digest,)).fetchone() is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(compressed)
+                os.replace(tmp_path, path)
+                self._db.execute("INSERT INTO objects VALUES (?, ?)", (digest, len(compressed)))
+                self._size += len(compressed)
+            previous = self._db.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                             (url, digest, headers.get("ETag"), headers.get("Last-Modified"), now, now))
+            if previous and previous[0] != digest:
+                self._delete_orphan_object(previous[0])
+            self._evict()
+            self._db.commit()
+
+    def revalidated(self, url: str):
+        """Marks a cached response as fresh again, after the server answered 304 Not Modified"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self):
+        """Deletes the least recently used entries until the cache fits in max_size"""
+        while self._size > self.max_size:
+            rows = self._db.execute("SELECT url, digest FROM entries ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            for url, digest in rows:
+                self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._delete_orphan_object(digest)
+                if self._size <= self.max_size:
+                    break
+        self.logger.debug(f"Http cache size: {self._size} bytes")
+
+    def _delete_entry(self, url: str, digest: str):
+        """Deletes the entry of an url, only if it still refers to the given body"""
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM entries WHERE url = ? AND digest = ?", (url, digest)).rowcount
+            if deleted:
+                self._delete_orphan_object(digest)
+            self._db.commit()
+
+    def _delete_orphan_object(self, digest: str):
+        """Deletes a stored body if no url refers to it anymore"""
+        if self._db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        row = self._db.execute("SELECT size FROM objects WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return
+        self._db.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+        self._size -= row[0]
+        try:
+            os.remove(self._object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _object_path(self, digest: str):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
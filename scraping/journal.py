@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+class CrawlJournal:
+    PENDING = "pending"
+    FETCHED = "fetched"
+    PARSED = "parsed"
+    SAVED = "saved"
+
+    def __init__(self, path: str, resume: bool = False, fsync_every: int = 200, fsync_interval: float = 2.0):
+        """
+        Append-only journal of the crawl frontier, used to resume an interrupted crawl.
+
+        Each line is a json record {"url", "state", "data"}, the last record of an url giving its state.
+        Records are written to disk by batches: the file is fsynced every fsync_every records
+        or fsync_interval seconds, whichever comes first.
+        Args:
+            path (str): journal file
+            resume (bool): loads the existing journal instead of starting a new one
+            fsync_every (int): maximum amount of records between two fsyncs
+            fsync_interval (float): maximum amount of seconds between two fsyncs
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.entries = self._replay(path) if resume else {}
+        if resume:
+            self.logger.info(f"Resuming crawl journal {path} containing {len(self.entries)} urls")
+
+        self._lock = threading.Lock()
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        if resume and self._file.tell() > 0 and not self._ends_with_newline(path):
+            self._file.write("\n")  # isolates the line cut by a crash from the next records
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def record(self, url: str, state: str, data=None):
+        """
+        Records the new state of an url
+        Args:
+            url (str): crawled url
+            state (str): PENDING, FETCHED, PARSED or SAVED
+            data: json serializable data scraped from the url, kept to skip the url on resume
+        """
+        line = json.dumps({"url": url, "state": state, "data": data}, ensure_ascii=False)
+        with self._lock:
+            # Only the data read from a resumed journal is kept in memory
+            self.entries[url] = (state, self.data(url))
+            self._file.write(line + "\n")
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def state(self, url: str):
+        """Last recorded state of an url, None if it isn't in the journal"""
+        entry = self.entries.get(url)
+        return entry[0] if entry else None
+
+    def data(self, url: str):
+        """Data recorded with the last state of an url"""
+        entry = self.entries.get(url)
+        return entry[1] if entry else None
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def _sync(self):
+        """Writes the buffered records to disk"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    @staticmethod
+    def _ends_with_newline(path: str):
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _replay(self, path: str):
+        """Reads the last state of every url of a journal"""
+        entries = {}
+        if not os.path.exists(path):
+            return entries
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:  # last line cut by a crash
+                    self.logger.warning(f"Ignoring truncated journal line: {line!r}")
+                    continue
+                state, data = record["state"], record["data"]
+                # The data of a parsed url is still needed once the url is saved
+                if data is None and record["url"] in entries:
+                    data = entries[record["url"]][1]
+                entries[record["url"]] = (state, data)
+        return entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
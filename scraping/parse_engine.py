@@ -0,0 +1,146 @@
+import itertools
+import logging
+import multiprocessing
+from queue import Empty, Full
+from threading import Event, Thread
+
+
+class ParseEngine:
+    def __init__(self, n_cores: int = 4, chunksize: int = 4):
+        """
+        Long-lived pool of worker processes used to parse downloaded pages.
+
+        The workers are started on first use and kept alive until close() is called, so that
+        process startup is paid once per run instead of once per batch of pages.
+        Tasks go through a bounded multiprocessing queue rather than multiprocessing.Pool,
+        whose imap reads its whole input ahead of the workers.
+        Args:
+            n_cores (int): number of worker processes
+            chunksize (int): number of pages sent to a worker at once
+        """
+        self.logger = logging.getLogger(__name__)
+        self.n_cores = n_cores
+        self.chunksize = chunksize
+        self._workers = []
+        self._tasks = None
+        self._results = None
+        self._calls = itertools.count()  # id of each imap call, tagging its tasks and results
+
+    def imap(self, func, items):
+        """
+        Applies func to every item using the worker processes, like Pool.imap.
+        Items are sent by chunks through a bounded queue, so a slow consumer stops the feeding.
+        An exception raised by items is re-raised once the results of the items before it are yielded.
+        Args:
+            func: module-level function (it has to be picklable) applied to each item
+            items: iterable of items, it may be a generator fed by another thread
+
+        Yields:
+            results in the same order as the items
+        """
+        self._start()
+        call = next(self._calls)
+        n_chunks = []  # filled by the feeder once items are exhausted
+        feed_errors = []  # exception raised by items, e.g. by the fetcher's generator
+        stop = Event()  # set when the consumer stopped early or failed, no more tasks are sent
+
+        def feed():
+            count = 0
+            try:
+                chunks = iter(lambda: list(itertools.islice(items, self.chunksize)), [])
+                for count, chunk in enumerate(chunks, 1):
+                    if not self._put_task((call, count - 1, func, chunk), stop):
+                        return
+            except Exception as e:
+                feed_errors.append(e)
+            finally:
+                n_chunks.append(count)
+                self._results.put(None)  # wakes up the consumer in case every result was already read
+
+        items = iter(items)
+        feeder = Thread(target=feed, daemon=True)
+        feeder.start()
+        pending = {}
+        next_chunk = 0
+        try:
+            while not n_chunks or next_chunk < n_chunks[0]:
+                if next_chunk in pending:
+                    results = pending.pop(next_chunk)
+                    next_chunk += 1
+                    yield from results
+                    continue
+                message = self._results.get()
+                if message is None:
+                    continue
+                message_call, index, results, error = message
+                if message_call != call:
+                    continue  # left by a previous call which was stopped early
+                if error is not None:
+                    raise error
+                pending[index] = results
+        finally:
+            stop.set()
+        feeder.join()
+        if feed_errors:
+            raise feed_errors[0]
+
+    def close(self):
+        """Stops the worker processes"""
+        if not self._workers:
+            return
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            # A worker only exits once the results it sent are read, a stopped call may have left some
+            while worker.is_alive():
+                self._drain_results()
+                worker.join(timeout=0.1)
+        self._workers = []
+
+    def _put_task(self, task: tuple, stop: Event):
+        """
+        Sends a task to the workers, unless the call is stopped
+        Returns:
+            bool: whether the task was sent
+        """
+        while not stop.is_set():
+            try:
+                self._tasks.put(task, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _drain_results(self):
+        try:
+            while True:
+                self._results.get_nowait()
+        except Empty:
+            pass
+
+    def _start(self):
+        """Starts the workers the first time they are needed"""
+        if self._workers:
+            return
+        self.logger.debug(f"Starting parse engine with {self.n_cores} workers")
+        self._tasks = multiprocessing.Queue(maxsize=2 * self.n_cores)
+        self._results = multiprocessing.Queue()
+        for _ in range(self.n_cores):
+            worker = multiprocessing.Process(target=_work, args=(self._tasks, self._results), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _work(tasks, results):
+    """Worker process loop: parses chunks until it receives None"""
+    for call, index, func, chunk in iter(tasks.get, None):
+        try:
+            results.put((call, index, [func(item) for item in chunk], None))
+        except Exception as e:
+            results.put((call, index, None, e))
@@ -0,0 +1,169 @@
+import logging
+import sys
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from utils import minutes_sec_2_sec
+from .records import AlbumDetails, ScrapedAlbum, ScrapedTrack
+
+try:
+    from lxml import html as lxml_html
+except ImportError:  # lxml is optional, the bs4 backend is used instead
+    lxml_html = None
+
+CARDS_LAYOUT_CLASS = "cards cards_layout_text-only"
+
+
+class Bs4Parser:
+    """
+    Discogs pages parser using BeautifulSoup's pure python html.parser.
+    Only the parts of the page that are needed are built, using a SoupStrainer.
+    """
+    name = "bs4"
+
+    def parse_albums_page(self, html_page: str):
+        """
+        Extracts the albums of a discogs search page
+        Args:
+            html_page (str): html of the page
+
+        Returns:
+            list: ScrapedAlbum containing name, artist and url
+        """
+        strainer = SoupStrainer("ul", attrs={"class": CARDS_LAYOUT_CLASS})
+        soup = BeautifulSoup(html_page, features="html.parser", parse_only=strainer)
+        albums_page = []
+        for card in soup.find_all("div", {"class": "card_body"}):
+            title = card.find("a", {"class": "search_result_title"})
+            album_artist = card.find("span", attrs={'title': True}).find("a")
+            albums_page.append(ScrapedAlbum(title.text, album_artist.text, album_artist.attrs['href'],
+                                            title.attrs['href']))
+        return albums_page
+
+    def parse_album_page(self, html_page: str):
+        """
+        Extracts genre, year and tracklist of a discogs album page
+        Args:
+            html_page (str): html of the page
+
+        Returns:
+            AlbumDetails: genre, year and tracks
+        """
+        strainer = SoupStrainer(["tbody", "section"])
+        soup = BeautifulSoup(html_page, features="html.parser", parse_only=strainer)
+        info = soup.find("tbody").find_all("th")
+        genre = info[0].find_next_sibling().text
+        year = info[2].find_next_sibling().text
+
+        tracklist = soup.find("section", {"id": "release-tracklist"}).find_all("tr",
+                                                                               attrs={'data-track-position': True})
+        tracks = []
+        for track in tracklist:
+            track_name = track.select('td[class*="trackTitle"]')[0].text
+            track_duration = track.select('td[class*="duration"]')[0].text
+            tracks.append((track_name, track_duration))
+        return _album_details(genre, year, tracks)
+
+
+class LxmlParser:
+    """Discogs pages parser using lxml's C html parser and XPath"""
+    name = "lxml"
+
+    def parse_albums_page(self, html_page: str):
+        """
+        Extracts the albums of a discogs search page
+        Args:
+            html_page (str): html of the page
+
+        Returns:
+            list: ScrapedAlbum containing name, artist and url
+        """
+        tree = lxml_html.fromstring(html_page)
+        layouts = tree.xpath(f'//ul[normalize-space(@class)="{CARDS_LAYOUT_CLASS}"]')
+        if not layouts:
+            return []
+        albums_page = []
+        for card in layouts[0].xpath('.//div[contains(concat(" ", normalize-space(@class), " "), " card_body ")]'):
+            title = card.xpath('.//a[contains(concat(" ", normalize-space(@class), " "), " search_result_title ")]')[0]
+            album_artist = card.xpath('.//span[@title]')[0].xpath('.//a')[0]
+            albums_page.append(ScrapedAlbum(title.text_content(), album_artist.text_content(),
+                                            album_artist.attrib['href'], title.attrib['href']))
+        return albums_page
+
+    def parse_album_page(self, html_page: str):
+        """
+        Extracts genre, year and tracklist of a discogs album page
+        Args:
+            html_page (str): html of the page
+
+        Returns:
+            AlbumDetails: genre, year and tracks
+        """
+        tree = lxml_html.fromstring(html_page)
+        info = tree.xpath('(//tbody)[1]//th')
+        genre = _next_element(info[0]).text_content()
+        year = _next_element(info[2]).text_content()
+
+        section = tree.xpath('//section[@id="release-tracklist"]')[0]
+        tracks = []
+        for track in section.xpath('.//tr[@data-track-position]'):
+            track_name = track.xpath('.//td[contains(@class, "trackTitle")]')[0].text_content()
+            track_duration = track.xpath('.//td[contains(@class, "duration")]')[0].text_content()
+            tracks.append((track_name, track_duration))
+        return _album_details(genre, year, tracks)
+
+
+def get_parser(backend: str = "auto"):
+    """
+    Returns a parser for discogs pages.
+    Args:
+        backend (str): "lxml", "bs4" or "auto" to use lxml when it is installed
+    """
+    if backend == "auto":
+        backend = "lxml" if lxml_html is not None else "bs4"
+    if backend == "lxml":
+        if lxml_html is None:
+            raise ImportError("The lxml parser backend requires lxml to be installed")
+        return LxmlParser()
+    if backend == "bs4":
+        return Bs4Parser()
+    raise ValueError(f"Unknown parser backend '{backend}'")
+
+
+def _album_details(genre: str, year: str, tracks: list):
+    """
+    Formats the data of an album page
+    Args:
+        genre (str): raw genre cell text
+        year (str): raw year cell text
+        tracks (list): (name, raw duration) tuples
+    """
+    return AlbumDetails(
+        genre=genre.split(',')[0].split('/')[0].strip(' ') if genre else None,
+        year=int(year) if year else None,
+        tracks=tuple(ScrapedTrack(name, minutes_sec_2_sec(duration) if duration else None)
+                     for name, duration in tracks),
+    )
+
+
+def _next_element(element):
+    """Next sibling element, skipping comments like bs4's find_next_sibling()"""
+    for sibling in element.itersiblings():
+        if isinstance(sibling.tag, str):
+            return sibling
+    return None
+
+
+if __name__ == "__main__":
+    # Parity check between backends: python -m scraping.parsers [search_page.html] [master_page.html]
+    logging.basicConfig(level=logging.INFO)
+    search_path, master_path = sys.argv[1:3] if len(sys.argv) > 2 else ("benchmarks/fixtures/search_page.html",
+                                                                        "benchmarks/fixtures/master_page.html")
+    with open(search_path, encoding="utf-8") as f:
+        search_page = f.read()
+    with open(master_path, encoding="utf-8") as f:
+        master_page = f.read()
+    bs4_parser, lxml_parser = Bs4Parser(), get_parser("lxml")
+    assert bs4_parser.parse_albums_page(search_page) == lxml_parser.parse_albums_page(search_page)
+    assert bs4_parser.parse_album_page(master_page) == lxml_parser.parse_album_page(master_page)
+    logging.info("bs4 and lxml backends give identical results")
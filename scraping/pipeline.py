@@ -0,0 +1,166 @@
+import logging
+import time
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+
+from tqdm import tqdm
+
+from .scraper import Scraper
+
+_STAGE_DONE = None  # put in a queue by a stage once it has nothing left to send
+
+
+class ScrapePipeline:
+    def __init__(self, scraper: Scraper, save_albums=None, known_urls=None, queue_size: int = 200,
+                 batch_size: int = 50, flush_interval: float = 2.0):
+        """
+        Streams the albums from the discogs search pages to the database with overlapping stages:
+
+            search pages fetch and parse -> album pages fetch -> album pages parse -> database writer
+
+        Each stage runs in its own thread (the fetches on the fetcher's event loop, the parsing on the parse
+        engine's workers) and stages are connected by bounded queues: a slow stage blocks the previous ones,
+        so memory stays flat whatever the amount of pages scraped.
+        Args:
+            scraper (Scraper): scraper whose fetcher, parse engine and journal are used
+            save_albums: function saving a list of ScrapedAlbum, like DatabaseManager.insert_albums.
+                         None to only scrape
+            known_urls: album urls to skip, e.g. a SortedHashSet of the urls already in the database
+            queue_size (int): max albums waiting between two stages
+            batch_size (int): albums saved at once
+            flush_interval (float): max seconds an album waits for its batch to be full before being saved
+        """
+        self.logger = logging.getLogger(__name__)
+        self.scraper = scraper
+        self.save_albums = save_albums
+        self.known_urls = known_urls if known_urls is not None else ()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._albums = Queue(maxsize=queue_size)  # albums of the search pages, waiting for their page
+        self._scraped = Queue(maxsize=queue_size)  # completed albums, waiting to be saved
+        self._stop = Event()  # set when a stage failed, the others finish what is in progress
+        self._errors = []
+        self._save_failed = False
+        self.stats = {"albums_listed": 0, "albums_skipped": 0, "albums_scraped": 0, "tracks_scraped": 0,
+                      "albums_saved": 0}
+
+    def run(self):
+        """
+        Runs the pipeline until every search page has been scraped and every album saved
+        Returns:
+            dict: amount of albums listed, skipped as known, scraped, saved and of tracks scraped
+        """
+        start = time.perf_counter()
+        stages = [Thread(target=self._run_stage, args=(self._list_albums, self._albums), name="list-albums"),
+                  Thread(target=self._run_stage, args=(self._save_scraped, None), name="save-albums")]
+        for stage in stages:
+            stage.start()
+        # The album pages stage runs in the calling thread, it drives the fetcher and the parse engine
+        self._run_stage(self._scrape_albums, self._scraped)
+        for stage in stages:
+            stage.join()
+        if self._errors:
+            raise self._errors[0]
+        self.logger.info(f"Pipeline completed in {time.perf_counter() - start:.1f} seconds: {self.stats}")
+        return self.stats
+
+    def _run_stage(self, stage, output: Queue = None):
+        """Runs a stage, then tells the next one it is done, even if it failed"""
+        try:
+            stage()
+        except Exception as e:
+            self.logger.error(f"Scraping pipeline stage {stage.__name__} failed: {e!r}")
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            if output is not None:
+                self._put_done(output)
+
+    def _list_albums(self):
+        """Fetches and parses the search pages, sending their new albums to the album pages stage"""
+        for album in self.scraper.iter_albums():
+            if self._stop.is_set():
+                return
+            self.stats["albums_listed"] += 1
+            if album.url in self.known_urls:
+                self.stats["albums_skipped"] += 1
+                continue
+            self._put(self._albums, album)
+
+    def _scrape_albums(self):
+        """Fetches and parses the album pages, sending the completed albums to the database writer"""
+        albums = iter(self._albums.get, _STAGE_DONE)
+        for album in tqdm(self.scraper.iter_albums_tracks(albums), desc="Albums", unit=" albums"):
+            self.stats["albums_scraped"] += 1
+            self.stats["tracks_scraped"] += len(album.tracks)
+            self._scraped.put(album)
+
+    def _save_scraped(self):
+        """
+        Saves the completed albums by batches. A batch is saved once it is full or once its oldest album
+        waited flush_interval seconds, so that albums are in the database seconds after being scraped.
+        """
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                album = self._scraped.get(timeout=timeout)
+            except Empty:
+                pass
+            else:
+                if album is _STAGE_DONE:
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(album)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._save(batch)
+                batch, deadline = [], None
+        self._save(batch)
+
+    def _save(self, batch: list):
+        """
+        Saves a batch of albums and records them as saved in the journal.
+        After a failure the following batches are dropped, but the queue is still drained so that
+        the previous stages can finish.
+        """
+        if not batch or self.save_albums is None or self._save_failed:
+            return
+        try:
+            self.save_albums(batch)
+        except Exception as e:
+            self.logger.error(f"Saving {len(batch)} albums failed, stopping the pipeline: {e!r}")
+            self._errors.append(e)
+            self._save_failed = True
+            self._stop.set()
+            return
+        for album in batch:
+            self.scraper.mark_saved(album)
+        self.stats["albums_saved"] += len(batch)
+        self.logger.debug(f"Saved {len(batch)} albums")
+
+    def _put(self, queue: Queue, item):
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)  # nobody reads the queue anymore if the next stage failed
+                return
+            except Full:
+                continue
+
+    def _put_done(self, queue: Queue):
+        """
+        Sends _STAGE_DONE to the next stage. Once the pipeline is stopped, items waiting in a full queue are
+        dropped to make room for it, the next stage may have failed and stopped reading.
+        """
+        while True:
+            try:
+                queue.put(_STAGE_DONE, timeout=0.5)
+                return
+            except Full:
+                if self._stop.is_set():
+                    try:
+                        queue.get_nowait()
+                    except Empty:
+                        pass
@@ -0,0 +1,43 @@
+from typing import NamedTuple, Optional, Tuple
+
+
+class ScrapedTrack(NamedTuple):
+    name: str
+    duration: Optional[int]  # seconds
+
+
+class AlbumDetails(NamedTuple):
+    """Data scraped from an album page"""
+    genre: Optional[str]
+    year: Optional[int]
+    tracks: Tuple[ScrapedTrack, ...]
+
+
+class ScrapedAlbum(NamedTuple):
+    """
+    Album scraped from discogs. It is created from a search page, completed with its AlbumDetails,
+    then passed as is to the database layer.
+    """
+    name: str
+    artist_name: str
+    artist_url: str
+    url: str
+    genre: Optional[str] = None
+    year: Optional[int] = None
+    tracks: Tuple[ScrapedTrack, ...] = ()
+
+    def with_details(self, details: AlbumDetails):
+        """Album completed with the data of its page"""
+        return self._replace(genre=details.genre, year=details.year, tracks=details.tracks)
+
+
+def album_from_json(data: list):
+    """Converts back an album serialized by json.dumps, which turns tuples into lists"""
+    *fields, tracks = data
+    return ScrapedAlbum(*fields, tracks=tuple(ScrapedTrack(*track) for track in tracks))
+
+
+def details_from_json(data: list):
+    """Converts back album details serialized by json.dumps"""
+    genre, year, tracks = data
+    return AlbumDetails(genre, year, tuple(ScrapedTrack(*track) for track in tracks))
@@ -1,29 +1,33 @@
-import itertools
 import logging
-import time
-from multiprocessing import Pool
-from queue import Queue
-from threading import Thread
+from collections import deque
+from functools import partial
 
-import grequests
-from bs4 import BeautifulSoup
 from tqdm import tqdm
 
-from utils import minutes_sec_2_sec, requests_session
-from utils.requests_session import get_session
 from config import ScraperConfig
+from .fetcher import AsyncFetcher
+from .http_cache import HttpCache
+from .journal import CrawlJournal
+from .parse_engine import ParseEngine
+from .parsers import get_parser
+from .records import ScrapedAlbum, album_from_json, details_from_json
+
+logger = logging.getLogger(__name__)
 
 
 class Scraper:
     HEADERS = {"User-Agent": "Mozilla/5.0"}
 
-    def __init__(self, cfg: ScraperConfig, count: int = 3, year: int = None, cores: int = 4):
+    def __init__(self, cfg: ScraperConfig, count: int = 3, year: int = None, cores: int = 4, offline: bool = False,
+                 journal: CrawlJournal = None):
         """
         Scraping class for Discogs.
         Args:
             count (int): number of pages to request
             year (int): year to filter
             cores (int): cpu cores to use for multiprocessing
+            offline (bool): only use the pages stored in the http cache
+            journal (CrawlJournal): journal recording the crawl progress, pages already done in it are skipped
         """
         self.logger = logging.getLogger(__name__)
         self.errors = []
@@ -32,29 +36,76 @@ class Scraper:
         self.base_url = cfg.base_url
         self.base_options = cfg.base_options
         self.url = self.base_url + self.base_options
-        self.batch_size = cfg.batch_size
 
         # Arguments
         self.count = count
         self.year = year
         self.n_cores = cores
+        self.journal = journal
+
+        self.parser = get_parser(cfg.parser)
+        self.parse_engine = ParseEngine(cores, cfg.parse_chunksize)
+        cache = HttpCache(cfg.cache_dir, cfg.cache_max_size, cfg.cache_max_age, offline) if cfg.cache_dir else None
+        self.fetcher = AsyncFetcher(self.HEADERS, cfg.max_per_host, cfg.max_retries, cfg.timeout, cfg.queue_size,
+                                    cache)
 
     def scrape_albums(self):
         """
         Scrape album pages on Discogs with the options given in the class constructor.
         Returns:
-            list: albums containing name, artist and url
+            list: ScrapedAlbum containing name, artist and url
         """
+        pages = self._list_pages()
+        remaining_pages = [page for page in pages if self._state(page) != CrawlJournal.PARSED]
+        self._record_pending(remaining_pages)
+        responses = {response[1]: response for response in self._request_albums(remaining_pages)}
+
         albums = []
-        responses = self._request_albums()
-        for i, response in tqdm(enumerate(responses), total=len(responses)):
-            html_page, url, status_code = response
-            self.logger.debug(f"Scraping page {i + 1}/{len(responses)}: {url}")
-            albums_page = self._scrape_albums_page(response)
-            for album in albums_page:
-                albums.append(album)
+        for i, url in tqdm(enumerate(pages), total=len(pages)):
+            self.logger.debug(f"Scraping page {i + 1}/{len(pages)}: {url}")
+            albums.extend(self._albums_of_page(url, responses.get(url)))
         return albums
 
+    def iter_albums(self):
+        """
+        Streams the albums of the search pages as soon as each page is downloaded and parsed,
+        instead of waiting for every page like scrape_albums.
+        Yields:
+            ScrapedAlbum: album containing name, artist and url, in pages completion order
+        """
+        pages = self._list_pages()
+        remaining_pages = [page for page in pages if self._state(page) != CrawlJournal.PARSED]
+        self._record_pending(remaining_pages)
+        for url in set(pages).difference(remaining_pages):
+            yield from self._albums_of_page(url)
+        for response in self._fetch(remaining_pages):
+            yield from self._albums_of_page(response[1], response)
+
+    def _list_pages(self):
+        """Urls of the search pages to scrape"""
+        self.logger.info(f"Requesting the first {self.count} pages of albums" +
+                         (f" released in {self.year}" if self.year else ""))
+        year_param = f"&year={self.year}" if self.year else ""
+        return [self.url + year_param + f"&page={page}" for page in range(1, self.count + 1)]
+
+    def _albums_of_page(self, url: str, response: tuple = None):
+        """
+        Albums of a search page, parsed from its response or read from the journal
+        Args:
+            url (str): search page url
+            response (tuple): request response containing (html, url, status_code), None if the page
+                              was parsed in a previous run
+        Returns:
+            list: ScrapedAlbum of the page, empty if an error occurred
+        """
+        if response is None:
+            return [album_from_json(album) for album in self.journal.data(url)]
+        albums_page = self._scrape_albums_page(response)
+        if albums_page is None:
+            return []
+        self._record(url, CrawlJournal.PARSED, albums_page)
+        return albums_page
+
     def _scrape_albums_page(self, response: tuple):
         """
         Scrapes the given discogs page of album list
@@ -65,28 +116,7 @@ class Scraper:
         try:
             if not html_page:
                 raise ValueError(f"HTML page empty, request response code {status_code}")
-            soup = BeautifulSoup(html_page, features="html.parser")
-            cards_layout = soup.find("ul", {"class": "cards cards_layout_text-only"})
-            soup_cards = BeautifulSoup(str(cards_layout), features="html.parser")
-            cards = soup_cards.find_all("div", {"class": "card_body"})
-
-            albums_page = []
-            for card in cards:
-                album_name = card.find("a", {"class": "search_result_title"}).text
-                album_url = card.find("a", {"class": "search_result_title"}).attrs['href']
-                album_artist = card.find("span", attrs={'title': True}).find("a")
-                artist = {
-                    "name": album_artist.text,
-                    "url": album_artist.attrs['href'],
-                }
-                album = {
-                    "name": album_name,
-                    "artist": artist,
-                    "url": album_url,
-                }
-                albums_page.append(album)
-
-            return albums_page
+            return self.parser.parse_albums_page(html_page)
 
         except Exception as e:
             self.logger.error(f"\nAn error occurred when scraping page {url}: {e}")
@@ -96,115 +126,73 @@ class Scraper:
         """
         Scrapes each album's individual page
         Args:
-            albums (list): list containing basic album information and their dedicated discogs url that will be scraped.
+            albums (list): ScrapedAlbum containing basic album information and their dedicated discogs url
+                           that will be scraped.
 
         Returns:
-            list: albums containing name, artist, url, genre, year and tracklist
+            list: ScrapedAlbum completed with genre, year and tracklist, in the order of the given albums
         """
         self.logger.info(f"Scraping {len(albums)} albums")
-        albums_data = []
-        urls = (self.base_url + album["url"] for album in albums)
-        responses_queue = Queue()
-
-        def download_pages(_urls, q):
-            while True:
-                batch = list(itertools.islice(_urls, self.batch_size))
-                if not batch:
-                    break
-                for response in self._request_albums_tracks(batch): q.put(response)
-
-        worker = Thread(target=download_pages, args=(urls, responses_queue))
-        worker.setDaemon(True)
-        worker.start()
-        with tqdm(total=len(albums)) as pbar:
-            while worker.is_alive() or not responses_queue.empty():
-                # Batching processing
-                while worker.is_alive():
-                    # While the queue is filling, waits for the queue to have at least
-                    # n_cores elements before pooling the processing (optimization)
-                    if responses_queue.qsize() >= self.n_cores:
-                        break
-                    time.sleep(0.001)
-                queue_batch = [responses_queue.get(block=True) for i in range(min(self.n_cores, responses_queue.qsize()))]
-                with Pool(self.n_cores) as p:
-                    for album_data in p.imap(self._scrape_albums_tracks_page, queue_batch):
-                        albums_data.append(album_data)
-                        pbar.update()
-
-        # Creating a new album dict with more information:
-        albums_complete = []
-        for album, album_data in zip(albums, albums_data):
-            if album_data is None:  # Happens when an error occurred during a request
-                self.logger.warning(f"\nIgnoring empty album_data for {album.get('url', None)}")
-                continue
-            full_data = {
-                'name': album.get('name', None),
-                'artist': album.get('artist', None),
-                'url': album.get('url', None),
-                'genre': album_data.get('genre', None),
-                'year': album_data.get('year', None),
-                'tracks': album_data.get('tracks', None),
-            }
-            albums_complete.append(full_data)
-        return albums_complete
-
-    def _scrape_albums_tracks_page(self, response: tuple):
-        """
-        Scrapes the given discogs page of an album
+        # Completed albums are keyed by url so that they can't be misaligned with the albums list
+        albums_complete = {album.url: album for album in tqdm(self.iter_albums_tracks(albums), total=len(albums))}
+        return [albums_complete[album.url] for album in albums if album.url in albums_complete]
+
+    def iter_albums_tracks(self, albums):
+        """
+        Scrapes each album's individual page, streaming the completed albums as soon as they are parsed.
+        Albums saved in a previous run are skipped, the ones parsed in a previous run are completed
+        from the journal.
         Args:
-            response (tuple): request response containing (html, url, status_code)
+            albums: iterable of ScrapedAlbum, it is consumed lazily and may be fed by another thread
+
+        Yields:
+            ScrapedAlbum: album completed with genre, year and tracklist, in completion order
         """
-        html_page, url, status_code = response
-        try:
-            self.logger.debug(f"Scraping album : {url}")
-            if not html_page:
-                raise ValueError(f"HTML page empty, request response code {status_code}")
-            soup = BeautifulSoup(html_page, features="html.parser")
-            info = soup.find("tbody").find_all("th")
-            genre = info[0].find_next_sibling().text
-            year = info[2].find_next_sibling().text
-
-            tracklist = soup.find("section", {"id": "release-tracklist"}).find_all("tr",
-                                                                                   attrs={'data-track-position': True})
-            tracks = []
-            for track in tracklist:
-                track_name = track.select('td[class*="trackTitle"]')[0].text
-                track_duration = track.select('td[class*="duration"]')[0].text
-                track_info = {
-                    "name": track_name,
-                    "duration": minutes_sec_2_sec(track_duration) if track_duration else None
-                }
-                tracks.append(track_info)
-
-            album_data = {
-                "genre": genre.split(',')[0].split('/')[0].strip(' ') if genre else None,
-                "year": int(year) if year else None,
-                "tracks": tracks,
-            }
-            return album_data
+        waiting = {}  # albums whose page is being downloaded or parsed, by url
+        resumed = deque()  # albums completed from the journal, filled by the fetcher's thread
+        seen = set()  # an album can appear on two search pages when the ranking changes during the crawl
 
-        except Exception as e:
-            print("\n")
-            self.logger.error(f"\nAn error occurred when scraping page {url}: {e}")
-            self.errors.append((url, e.__traceback__))
+        def urls():
+            for album in albums:
+                url = self.base_url + album.url
+                if url in seen:
+                    continue
+                seen.add(url)
+                state = self._state(url)
+                if state == CrawlJournal.PARSED:
+                    resumed.append(album.with_details(details_from_json(self.journal.data(url))))
+                elif state != CrawlJournal.SAVED:
+                    self._record_pending([url])
+                    waiting[url] = album
+                    yield url
 
-    def _request_albums(self):
+        parse_page = partial(_scrape_albums_tracks_page, parser=self.parser)
+        # Pages are parsed while the following ones are still being downloaded
+        for url, album_data, error in self.parse_engine.imap(parse_page, self._request_albums_tracks(urls())):
+            album = waiting.pop(url)
+            while resumed:
+                yield resumed.popleft()
+            if error:
+                self.logger.error(f"\nAn error occurred when scraping page {url}: {error}")
+                self.errors.append((url, error))
+                continue
+            self._record(url, CrawlJournal.PARSED, album_data)
+            yield album.with_details(album_data)
+        while resumed:
+            yield resumed.popleft()
+
+    def _request_albums(self, pages: list):
         """
         Requests albums pages on discogs.
+        Args:
+            pages: url of pages to request
         Returns:
             list: htmls of pages to scrape
         """
-        self.logger.info(f"Requesting the first {self.count} pages of albums" +
-                         (f" released in {self.year}" if self.year else ""))
-        year_param = f"&year={self.year}" if self.year else ""
-        pages = [self.url + year_param + f"&page={page}" for page in range(1, self.count + 1)]
-        session = get_session()
-        rs = (grequests.get(page, stream=False, session=session, headers=self.HEADERS) for page in pages)
-        responses = grequests.map(rs)
-        for response in responses: response.close()
-        return [(response.text, response.url, response.status_code) for response in responses]
+        responses = {response[1]: response for response in self._fetch(pages)}
+        return [responses[page] for page in pages]  # keeps the ranking order of the pages
 
-    def _request_albums_tracks(self, urls: list):
+    def _request_albums_tracks(self, urls):
         """
         Requests album track pages on discogs.
 
@@ -212,17 +200,36 @@ class Scraper:
          request_albums requests the page containing a list of albums
          request_album_tracks requests specific album pages containing their list of tracks.
         Args:
-            urls: url of pages to request
+            urls: iterable of urls of pages to request
         Returns:
-            list: htmls of pages to scrape
+            iterator: (html, url, status_code) of the pages to scrape, as soon as they are downloaded
         """
-        self.logger.debug(f"Requesting {len(urls)} album pages")
-        session = requests_session.get_session()
-        rs = (grequests.get(url, stream=False, session=session, headers=self.HEADERS) for url in urls)
-        responses = grequests.map(rs)
-        for response in responses: response.close()
-        print(response)
-        return [(response.text, response.url, response.status_code) for response in responses]
+        return self._fetch(urls)
+
+    def _fetch(self, urls):
+        """Fetches urls, recording the successful downloads in the journal"""
+        for response in self.fetcher.fetch(urls):
+            if response[0] is not None:
+                self._record(response[1], CrawlJournal.FETCHED)
+            yield response
+
+    def mark_saved(self, album: ScrapedAlbum):
+        """Records in the journal that a scraped album has been saved in the database"""
+        self._record(self.base_url + album.url, CrawlJournal.SAVED)
+
+    def _state(self, url: str):
+        """State of an url in the journal, None without journal"""
+        return self.journal.state(url) if self.journal else None
+
+    def _record(self, url: str, state: str, data=None):
+        if self.journal:
+            self.journal.record(url, state, data)
+
+    def _record_pending(self, urls: list):
+        """Adds the urls that are not in the journal yet to the crawl frontier"""
+        for url in urls:
+            if self._state(url) is None:
+                self._record(url, CrawlJournal.PENDING)
 
     def print_errors(self):
         if self.errors:
@@ -230,24 +237,42 @@ class Scraper:
             for url in self.errors:
                 self.logger.warning(url)
 
+    def close(self):
+        """Releases the parsing workers and the connection pool"""
+        self.parse_engine.close()
+        self.fetcher.close()
+
+
+def _scrape_albums_tracks_page(response: tuple, parser):
+    """
+    Scrapes the given discogs page of an album.
+    Defined at module level so that the parse engine workers don't need to unpickle the scraper.
+    Args:
+        response (tuple): request response containing (html, url, status_code)
+        parser: parser backend, see scraping.parsers
+
+    Returns:
+        tuple: (url, album_data, error), album_data being None when an error occurred
+    """
+    html_page, url, status_code = response
+    try:
+        logger.debug(f"Scraping album : {url}")
+        if not html_page:
+            raise ValueError(f"HTML page empty, request response code {status_code}")
+        return url, parser.parse_album_page(html_page), None
+
+    except Exception as e:
+        return url, None, e
+
 
 if __name__ == "__main__":
     test_albums = [
-        {
-            'name': 'The Dark Side Of The Moon',
-            'artist': {'name': 'Pink Floyd', 'url': '/artist/45467-Pink-Floyd'},
-            'url': '/master/10362-Pink-Floyd-The-Dark-Side-Of-The-Moon'
-        },
-        {
-            'name': "Sgt. Pepper's Lonely Hearts Club Band",
-            'artist': {'name': 'The Beatles', 'url': '/artist/82730-The-Beatles'},
-            'url': '/master/23934-The-Beatles-Sgt-Peppers-Lonely-Hearts-Club-Band'
-        },
-        {
-            'name': 'Abbey Road',
-            'artist': {'name': 'The Beatles', 'url': '/artist/82730-The-Beatles'},
-            'url': '/master/24047-The-Beatles-Abbey-Road'
-        }
+        ScrapedAlbum('The Dark Side Of The Moon', 'Pink Floyd', '/artist/45467-Pink-Floyd',
+                     '/master/10362-Pink-Floyd-The-Dark-Side-Of-The-Moon'),
+        ScrapedAlbum("Sgt. Pepper's Lonely Hearts Club Band", 'The Beatles', '/artist/82730-The-Beatles',
+                     '/master/23934-The-Beatles-Sgt-Peppers-Lonely-Hearts-Club-Band'),
+        ScrapedAlbum('Abbey Road', 'The Beatles', '/artist/82730-The-Beatles', '/master/24047-The-Beatles-Abbey-Road'),
     ]
-    scraper = Scraper()
+    scraper = Scraper(ScraperConfig())
     scraper.scrape_albums_tracks(test_albums)
+    scraper.close()
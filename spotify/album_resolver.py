@@ -0,0 +1,105 @@
+import logging
+from threading import Lock
+
+from spotify.matcher import TrackMatcher, normalize_title, track_query
+from spotify.search_cache import SearchCache
+from spotify.wrapper import SpotifyWrapper
+
+
+class AlbumResolver:
+    def __init__(self, wrapper: SpotifyWrapper, search_track, cache: SearchCache = None,
+                 matcher: TrackMatcher = None):
+        """
+        Finds the spotify ids of the tracks of an album with a few requests: the album is searched once, its
+        tracklist is read in one or two pages and matched with our tracks locally. Only the tracks left unmatched
+        are searched one by one. It is safe to use from several threads.
+        Args:
+            wrapper (SpotifyWrapper): Spotify client
+            search_track: function searching the spotify id of a (title, album, artist, duration) track,
+                          for the unmatched tracks, e.g. SearchExecutor.search_one
+            cache (SearchCache): results of the previous searches. Tracks already searched are not resolved again,
+                                 and the Spotify album found for an album is cached too.
+            matcher (TrackMatcher): scores our tracks against the tracklist, each Spotify track is matched once
+        """
+        self.logger = logging.getLogger(__name__)
+        self.wrapper = wrapper
+        self.search_track = search_track
+        self.cache = cache
+        self.matcher = matcher or TrackMatcher()
+        self.stats = {"albums_searched": 0, "albums_found": 0, "tracks_cached": 0, "tracks_matched": 0,
+                      "tracks_searched": 0}
+        self._stats_lock = Lock()
+
+    def resolve(self, album: tuple):
+        """
+        Finds the spotify ids of the tracks of an album
+        Args:
+            album (tuple): (album id, name, year, artist names, tracks) as yielded by
+                           DatabaseManager.iter_albums_tracks
+
+        Returns:
+            list: (track id, spotify id) tuples, spotify id being None for the tracks not found
+        """
+        _, name, _, artists, tracks = album
+        artist = artists[0] if artists else ""
+        results, remaining = [], []
+        for track in tracks:
+            cached = self.cache.get(track_query(track[1], name, artist)) if self.cache is not None else None
+            if cached is not None:
+                results.append((track[0], cached.spotify_id))
+            else:
+                remaining.append(track)
+        self._count("tracks_cached", len(results))
+        if not remaining:
+            return results
+
+        tracks = [(title, name, artist, duration) for _, title, duration in remaining]
+        matches = [(None, 0.0)] * len(tracks)
+        spotify_album_id = self._find_album(name, artist)
+        if spotify_album_id is not None:
+            try:
+                spotify_tracks = self.wrapper.get_album_tracks(spotify_album_id)
+                matches = [(spotify_tracks[index]['id'] if index is not None else None, confidence)
+                           for index, confidence in self.matcher.match(tracks, spotify_tracks, unique=True)]
+            except ConnectionError as e:
+                self.logger.error(f"Spotify album tracks request failed with error: {e}")
+        matched = sum(spotify_id is not None for spotify_id, _ in matches)
+        self._count("tracks_matched", matched)
+        self._count("tracks_searched", len(remaining) - matched)
+        for (track_id, _, _), track, (spotify_id, _) in zip(remaining, tracks, matches):
+            if spotify_id is not None:
+                if self.cache is not None:
+                    self.cache.put(track_query(*track[:3]), spotify_id)
+            else:
+                spotify_id = self.search_track(track)
+            results.append((track_id, spotify_id))
+        return results
+
+    def _find_album(self, name: str, artist: str):
+        """
+        Spotify id of an album: the first result with the same normalized name, else the first result
+        Returns:
+            str: None if Spotify found nothing or the search failed
+        """
+        key = f"album:{name} artist:{artist}"
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            return cached.spotify_id
+        self._count("albums_searched", 1)
+        try:
+            spotify_albums = self.wrapper.search_albums(name, artist)
+        except ConnectionError as e:
+            self.logger.error(f"Spotify album search failed with error: {e}")
+            return None
+        same_name = [spotify_album for spotify_album in spotify_albums
+                     if normalize_title(spotify_album['name']) == normalize_title(name)]
+        spotify_album = (same_name or spotify_albums or [None])[0]
+        spotify_album_id = spotify_album['id'] if spotify_album else None
+        self._count("albums_found", spotify_album_id is not None)
+        if self.cache is not None:
+            self.cache.put(key, spotify_album_id)
+        return spotify_album_id
+
+    def _count(self, stat: str, amount: int):
+        with self._stats_lock:
+            self.stats[stat] += amount
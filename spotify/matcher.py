@@ -0,0 +1,164 @@
+import re
+import unicodedata
+
+import numpy as np
+
+# Version details Spotify adds to titles: "(Remastered 2011)", "[Live]", " - Radio Edit", "feat. ..."
+_TITLE_DETAILS = re.compile(r"\([^)]*\)|\[[^\]]*\]|\s-\s.*$|\b(?:feat|ft)\.?\s.*$")
+_NON_WORD = re.compile(r"\W+")
+
+
+def track_query(title: str, album: str, artist: str):
+    """Spotify search query of a track"""
+    return f"{title} {album} {artist}"
+
+
+def normalize_text(text: str):
+    """Text without case, unicode variants and punctuation, as space separated tokens"""
+    return _NON_WORD.sub(" ", unicodedata.normalize("NFKC", text or "").casefold()).strip()
+
+
+def normalize_title(title: str):
+    """Normalized title without the version details, which differ between discogs and Spotify"""
+    title = unicodedata.normalize("NFKC", title or "").casefold()
+    stripped = normalize_text(_TITLE_DETAILS.sub(" ", title))
+    return stripped or normalize_text(title)  # a title only made of details, e.g. "(Untitled)", is kept whole
+
+
+class TrackMatcher:
+    def __init__(self, min_confidence: float = 0.7, weights: tuple = (0.5, 0.2, 0.15, 0.15),
+                 duration_scale: float = 30.0, ngram: int = 3, n_features: int = 4096):
+        """
+        Scores our tracks against Spotify candidates, all pairs at once with array operations.
+
+        A pair's score is the weighted mean of 4 similarities between 0 and 1: title, artist and album, as the
+        cosine of the hashed character n-grams counts of their normalized tokens, and duration, decreasing
+        linearly with the gap. A similarity is left out of the mean when a side lacks the value, e.g. the
+        duration of a track or the album of the tracks of an album tracklist.
+        Args:
+            min_confidence (float): score below which a track is left unmatched
+            weights (tuple): weights of the title, artist, album and duration similarities
+            duration_scale (float): seconds of gap for which the duration similarity is 0
+            ngram (int): characters per n-gram
+            n_features (int): size of the hashed n-grams vectors
+        """
+        self.min_confidence = min_confidence
+        self.weights = np.array(weights, dtype=np.float32)
+        self.duration_scale = duration_scale
+        self.ngram = ngram
+        self.n_features = n_features
+
+    def match(self, tracks: list, candidates: list, groups=None, unique: bool = False):
+        """
+        Finds the best candidate of each track
+        Args:
+            tracks (list): (title, album, artist, duration in seconds or None) tuples
+            candidates (list): Spotify tracks, as returned by a search or an album tracklist
+            groups: index of the track each candidate was found for, by default every candidate is a candidate
+                    of every track
+            unique (bool): each candidate matched at most once, e.g. for the tracks of the same album
+
+        Returns:
+            list: (candidate index, confidence) tuple of each track, index being None when no candidate
+                  reached min_confidence
+        """
+        if not tracks or not candidates:
+            return [(None, 0.0)] * len(tracks)
+        scores = self.scores(tracks, candidates)
+        if groups is not None:
+            scores[np.arange(len(tracks))[:, None] != np.asarray(groups)[None, :]] = 0.0
+        if unique:
+            return self._unique_matches(scores)
+        best = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(tracks)), best]
+        return [(int(index), float(confidence)) if confidence >= self.min_confidence else (None, float(confidence))
+                for index, confidence in zip(best, confidences)]
+
+    def scores(self, tracks: list, candidates: list):
+        """
+        Returns:
+            np.ndarray: score of each pair, shape (tracks, candidates)
+        """
+        titles = self._similarities([normalize_title(track[0]) for track in tracks],
+                                    [normalize_title(candidate.get('name')) for candidate in candidates])
+        candidate_artists = [" ".join(artist['name'] for artist in candidate.get('artists', ()))
+                             for candidate in candidates]
+        artists = self._similarities([normalize_text(track[2]) for track in tracks],
+                                     [normalize_text(artist) for artist in candidate_artists])
+        albums = self._similarities([normalize_text(track[1]) for track in tracks],
+                                    [normalize_text((candidate.get('album') or {}).get('name'))
+                                     for candidate in candidates])
+        durations = np.array([np.nan if track[3] is None else track[3] for track in tracks], dtype=np.float32)
+        candidate_durations = np.array([candidate.get('duration_ms') or np.nan for candidate in candidates],
+                                       dtype=np.float32) / 1000
+        gaps = np.abs(durations[:, None] - candidate_durations[None, :])
+        duration_scores = np.clip(1 - gaps / self.duration_scale, 0, 1)  # NaN when a duration is unknown
+
+        similarities = np.stack([titles, artists, albums, duration_scores])
+        known = ~np.isnan(similarities)
+        weights = self.weights[:, None, None]
+        with np.errstate(invalid="ignore"):  # pairs without any known similarity score 0
+            scores = (np.where(known, similarities, 0) * weights).sum(axis=0) / (known * weights).sum(axis=0)
+        return np.nan_to_num(scores)
+
+    def _similarities(self, texts: list, candidate_texts: list):
+        """Cosine similarities of the n-grams of two lists of normalized texts, NaN when a text is empty"""
+        similarities = self._vectors(texts) @ self._vectors(candidate_texts).T
+        missing = np.array([not text for text in texts])[:, None] | np.array([not text for text in candidate_texts])
+        similarities[missing] = np.nan
+        return np.minimum(similarities, 1.0)
+
+    def _vectors(self, texts: list):
+        """
+        L2-normalized counts of the hashed n-grams of each token, padded with spaces, one row per text.
+        The n-grams of every text are hashed at once: the characters of the padded tokens are laid out in one
+        array of code points, and each n-gram is hashed from the n slices of that array starting at its characters.
+        A token shorter than an n-gram gives a single n-gram, its characters followed by zeros.
+        """
+        tokens = [text.split() for text in texts]
+        padded = [f" {token} " for text_tokens in tokens for token in text_tokens]
+        if not padded:
+            return np.zeros((len(texts), self.n_features), dtype=np.float32)
+        lengths = np.array([len(token) for token in padded])
+        ends = np.cumsum(lengths)
+        # Code points of all the padded tokens, followed by zeros so that every n-gram can be sliced
+        codes = np.frombuffer("".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        codes = np.concatenate([codes, np.zeros(self.ngram, dtype=np.uint64)])
+
+        # Start of each n-gram, and the text and token it belongs to
+        n_grams = np.maximum(lengths - self.ngram + 1, 1)
+        token_index = np.repeat(np.arange(len(padded)), n_grams)
+        starts = np.arange(n_grams.sum()) + np.repeat(ends - lengths - (np.cumsum(n_grams) - n_grams), n_grams)
+        rows = np.repeat(np.arange(len(texts)), [len(text_tokens) for text_tokens in tokens])[token_index]
+
+        # FNV-1a of the code points of each n-gram, the characters past the end of a short token count as zeros
+        hashes = np.full(len(starts), 14695981039346656037, dtype=np.uint64)
+        for offset in range(self.ngram):
+            positions = starts + offset
+            hashes ^= np.where(positions < ends[token_index], codes[positions], 0)
+            hashes *= np.uint64(1099511628211)
+        columns = (hashes ^ (hashes >> np.uint64(32))) % np.uint64(self.n_features)
+
+        # Counts and norms are computed on the n-grams found only, the dense vectors are just filled with them
+        cells, counts = np.unique(rows * self.n_features + columns.astype(np.int64), return_counts=True)
+        cell_rows = cells // self.n_features
+        norms = np.sqrt(np.bincount(cell_rows, weights=counts.astype(np.float64) ** 2, minlength=len(texts)))
+        vectors = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        vectors.reshape(-1)[cells] = counts / norms[cell_rows]
+        return vectors
+
+    def _unique_matches(self, scores: np.ndarray):
+        """Greedy one to one assignment, best scores first"""
+        matches = [(None, float(confidence)) for confidence in scores.max(axis=1)]
+        matched_tracks, matched_candidates = set(), set()
+        for flat_index in np.argsort(-scores, axis=None, kind="stable"):
+            track, candidate = divmod(int(flat_index), scores.shape[1])
+            if scores[track, candidate] < self.min_confidence:
+                break
+            if track not in matched_tracks and candidate not in matched_candidates:
+                matches[track] = (candidate, float(scores[track, candidate]))
+                matched_tracks.add(track)
+                matched_candidates.add(candidate)
+                if len(matched_tracks) == len(matches):
+                    break
+        return matches
@@ -0,0 +1,175 @@
+import logging
+import time
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+
+from tqdm import tqdm
+
+from spotify.spotify_db import SpotifyDBFiller
+
+FEATURES_BATCH_SIZE = 100  # max ids of an audio features request, Spotify's limit
+_STAGE_DONE = None  # put in a queue by a stage once it has nothing left to send
+
+
+class FeaturesPipeline:
+    def __init__(self, filler: SpotifyDBFiller, queue_size: int = 1000, flush_interval: float = 30.0):
+        """
+        Backfills the audio features of tracks with overlapping stages:
+
+            concurrent searches -> batches of 100 spotify ids -> audio features requests -> database writer
+
+        Tracks are searched one by one, or by album (see spotify/album_resolver.py) which takes far fewer requests.
+
+        Each stage runs in its own thread and stages are connected by bounded queues, so the searches carry on
+        while a features request or a database write is in progress. Features are only requested by full
+        batches of 100 ids, except for the last batch and for a batch whose oldest id waited flush_interval
+        seconds, e.g. while Spotify paused the searches with a Retry-After.
+        Args:
+            filler (SpotifyDBFiller): Spotify client and database connection the features are written with
+            queue_size (int): max items waiting between two stages
+            flush_interval (float): max seconds a found id waits for its batch to be full
+        """
+        self.logger = logging.getLogger(__name__)
+        self.filler = filler
+        self.flush_interval = flush_interval
+
+        self._found = Queue(maxsize=queue_size)  # (db id, spotify id) waiting for their batch
+        self._fetched = Queue(maxsize=max(queue_size // FEATURES_BATCH_SIZE, 2))  # features waiting to be saved
+        self._stop = Event()  # set when a stage failed, the others finish what is in progress
+        self._errors = []
+        self.stats = {"tracks_searched": 0, "ids_found": 0, "full_batches": 0, "partial_batches": 0,
+                      "failed_batches": 0, "features_saved": 0}
+
+    def run(self, tracks, n_tracks: int = None, by_album: bool = False):
+        """
+        Runs the pipeline until every track has been searched and every feature saved
+        Args:
+            tracks: iterable of (db_id, track_name, album, artist, duration), or of albums as yielded by
+                    DatabaseManager.iter_albums_tracks when by_album is set. Consumed lazily.
+            n_tracks (int): amount of tracks, for the progress bar
+            by_album (bool): find the tracks by album instead of searching them one by one
+
+        Returns:
+            dict: amount of tracks searched, of spotify ids found, of features requests and of features saved
+        """
+        start = time.perf_counter()
+        stages = [Thread(target=self._run_stage, args=(self._fetch_features, self._fetched), name="fetch-features"),
+                  Thread(target=self._run_stage, args=(self._save_features, None), name="save-features")]
+        for stage in stages:
+            stage.start()
+        # The search stage runs in the calling thread, it drives the search executor
+        resolved = (self.filler.resolve_albums_spotify_ids(tracks) if by_album
+                    else self.filler.search_track_spotify_ids(tracks))
+        self._run_stage(self._search, self._found, resolved, n_tracks)
+        for stage in stages:
+            stage.join()
+        if self._errors:
+            raise self._errors[0]
+        self.logger.info(f"Spotify pipeline completed in {time.perf_counter() - start:.1f} seconds: {self.stats}")
+        return self.stats
+
+    def _run_stage(self, stage, output: Queue = None, *args):
+        """Runs a stage, then tells the next one it is done, even if it failed"""
+        try:
+            stage(*args)
+        except Exception as e:
+            self.logger.error(f"Spotify pipeline stage {stage.__name__} failed: {e!r}")
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            if output is not None:
+                self._put_done(output)
+
+    def _search(self, resolved, n_tracks: int):
+        """Searches the spotify ids of the tracks, sending the ids found to the batching stage"""
+        for db_id, spotify_id in tqdm(resolved, total=n_tracks, desc="Tracks", unit=" tracks"):
+            if self._stop.is_set():
+                return
+            self.stats["tracks_searched"] += 1
+            if spotify_id:
+                self.stats["ids_found"] += 1
+                self._put(self._found, (db_id, spotify_id))
+
+    def _fetch_features(self):
+        """
+        Requests the features of the ids found by batches of FEATURES_BATCH_SIZE. A batch is sent once it is full,
+        once its oldest id waited flush_interval seconds, or once the searches are done.
+        """
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                found = self._found.get(timeout=timeout)
+            except Empty:
+                pass
+            else:
+                if found is _STAGE_DONE:
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(found)
+            if len(batch) >= FEATURES_BATCH_SIZE or (batch and time.monotonic() >= deadline):
+                self._request_features(batch)
+                batch, deadline = [], None
+        self._request_features(batch)
+
+    def _request_features(self, batch: list):
+        """Requests the features of a batch and sends them to the database writer"""
+        if not batch or self._stop.is_set():
+            return
+        self.stats["full_batches" if len(batch) == FEATURES_BATCH_SIZE else "partial_batches"] += 1
+        db_ids, spotify_ids = zip(*batch)
+        try:
+            features, feature_names = self.filler.get_audio_features(list(spotify_ids))
+        except Exception as e:
+            self.logger.error(f"Audio features request of {len(batch)} tracks failed: {e!r}")
+            features = feature_names = None
+        if not features or not feature_names:
+            # The tracks still miss their features, the next run requests them again without searching them
+            self.stats["failed_batches"] += 1
+            return
+        tracks_values = [[feature[name] if feature else None for name in feature_names] for feature in features]
+        self._put(self._fetched, (list(db_ids), tracks_values))
+
+    def _save_features(self):
+        """
+        Saves the features. After a failure the following batches are dropped, but the queue is still drained
+        so that the previous stages can finish.
+        """
+        for db_ids, tracks_values in iter(self._fetched.get, _STAGE_DONE):
+            if self._stop.is_set():
+                continue
+            try:
+                self.filler.fill_audio_features_in_db(db_ids, tracks_values)
+            except Exception as e:
+                self.logger.error(f"Saving the features of {len(db_ids)} tracks failed, stopping the pipeline: {e!r}")
+                self._errors.append(e)
+                self._stop.set()
+                continue
+            self.stats["features_saved"] += len(db_ids)
+            self.logger.debug(f"Saved the features of {len(db_ids)} tracks")
+
+    def _put(self, queue: Queue, item):
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)  # nobody reads the queue anymore if the next stage failed
+                return
+            except Full:
+                continue
+
+    def _put_done(self, queue: Queue):
+        """
+        Sends _STAGE_DONE to the next stage. Once the pipeline is stopped, items waiting in a full queue are
+        dropped to make room for it, the next stage may have failed and stopped reading.
+        """
+        while True:
+            try:
+                queue.put(_STAGE_DONE, timeout=0.5)
+                return
+            except Full:
+                if self._stop.is_set():
+                    try:
+                        queue.get_nowait()
+                    except Empty:
+                        pass
@@ -0,0 +1,99 @@
+import logging
+import time
+from threading import Condition
+
+
+class RateLimiter:
+    def __init__(self, rate: float = 5.0, min_rate: float = 0.5, max_rate: float = 20.0, burst: int = 5,
+                 increase: float = 0.2, decrease: float = 0.5):
+        """
+        Token bucket shared by every thread sending requests to the same api, adapting its rate to the server (AIMD).
+
+        The rate grows by `increase` requests per second every second of successful requests, and is multiplied by
+        `decrease` on a 429. A Retry-After delay pauses every thread for exactly that delay.
+        Only one decrease is made per throttling episode: the other requests already in flight when the first 429
+        came back were sent at the old rate, their 429 don't decrease it again.
+        Args:
+            rate (float): initial requests per second
+            min_rate (float): lowest rate the limiter decreases to
+            max_rate (float): highest rate the limiter increases to
+            burst (int): tokens the bucket holds, requests that can be sent at once after an idle time
+            increase (float): requests per second added per second of successful requests
+            decrease (float): factor applied to the rate on a 429
+        """
+        self.logger = logging.getLogger(__name__)
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.requests = self.throttled_requests = 0
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._resume_at = 0.0  # end of the Retry-After pause
+        self._decreased_at = 0.0
+        self._condition = Condition()
+
+    def acquire(self):
+        """
+        Blocks until a request can be sent
+        Returns:
+            float: time the request was allowed, to give to throttled()
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._resume_at:
+                    wait = self._resume_at - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    self.requests += 1
+                    return now
+                else:
+                    wait = (1 - self._tokens) / self.rate
+                # throttled() wakes the waiting threads up, so that they take the pause into account
+                self._condition.wait(wait)
+
+    def succeeded(self):
+        """Additive increase, one success being worth 1/rate seconds of successful requests"""
+        with self._condition:
+            self.rate = min(self.rate + self.increase / self.rate, self.max_rate)
+
+    def throttled(self, sent_at: float, retry_after: float = None):
+        """
+        Multiplicative decrease after a 429
+        Args:
+            sent_at (float): value returned by acquire() for the throttled request
+            retry_after (float): seconds the server asked to wait, if it did
+        """
+        with self._condition:
+            self.throttled_requests += 1
+            now = time.monotonic()
+            if sent_at >= self._decreased_at:
+                self.rate = max(self.rate * self.decrease, self.min_rate)
+                self._decreased_at = now
+                self.logger.warning(f"Throttled by the server, rate decreased to {self.rate:.2f} requests/s")
+            if retry_after:
+                self._resume_at = max(self._resume_at, now + retry_after)
+                self.logger.warning(f"Pausing the requests {retry_after:.1f}s as asked by Retry-After")
+            # No burst after the pause or the decrease
+            self._tokens = min(self._tokens, 0.0)
+            self._condition.notify_all()
+
+    def _refill(self, now: float):
+        start = max(self._updated_at, self._resume_at)
+        if now > start:
+            self._tokens = min(self._tokens + (now - start) * self.rate, self.burst)
+        self._updated_at = now
+
+
+def parse_retry_after(value: str):
+    """Converts a Retry-After header in seconds, as sent by Spotify, to a delay. None if missing or invalid."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
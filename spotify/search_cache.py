@@ -0,0 +1,167 @@
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import NamedTuple
+
+_SPACES = re.compile(r"\s+")
+
+
+class CachedSearch(NamedTuple):
+    spotify_id: str  # None when Spotify found nothing
+    searched_at: float
+
+
+class SearchCache:
+    def __init__(self, path: str, found_ttl: int = 180 * 24 * 3600, not_found_ttl: int = 30 * 24 * 3600):
+        """
+        On-disk cache of the Spotify searches, keyed by normalized query, so that a query is only sent once.
+
+        Queries which found a track are stored with its spotify id, queries which found nothing with a NULL id.
+        Both expire, the latter sooner as Spotify's catalog grows. The cache is an sqlite database in WAL mode,
+        it can be shared by several threads and processes.
+        Args:
+            path (str): sqlite file, its directory is created if needed
+            found_ttl (int): seconds during which a found spotify id is used
+            not_found_ttl (int): seconds during which a query which found nothing isn't sent again
+        """
+        self.logger = logging.getLogger(__name__)
+        self.found_ttl = found_ttl
+        self.not_found_ttl = not_found_ttl
+        self.hits = self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The cache is used from several threads, the lock serializes access to the connection.
+        # Other processes are waited for up to the timeout when they hold the write lock.
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS searches (
+                query TEXT PRIMARY KEY,
+                spotify_id TEXT,
+                searched_at REAL NOT NULL
+            )""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY, imported_at REAL NOT NULL)")
+        self._db.commit()
+
+    def get(self, query: str):
+        """
+        Gets the cached result of a query
+        Returns:
+            CachedSearch: None if the query isn't cached or its result expired
+        """
+        with self._lock:
+            row = self._db.execute("SELECT spotify_id, searched_at FROM searches WHERE query = ?",
+                                   (normalize_query(query),)).fetchone()
+        result = CachedSearch(*row) if row is not None else None
+        if result is not None and self._expired(result):
+            result = None
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, query: str, spotify_id: str):
+        """
+        Stores the result of a search
+        Args:
+            query (str): query sent to Spotify
+            spotify_id (str): id of the track found, None if nothing was found
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?)",
+                             (normalize_query(query), spotify_id, time.time()))
+            self._db.commit()
+
+    def import_ignore_file(self, path: str):
+        """
+        Imports the queries of an ignore file, one query per line, as queries which found nothing.
+        The queries are imported once, later calls do nothing. Results already cached are kept.
+        Returns:
+            int: amount of queries imported
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as f:
+            queries = {normalize_query(line) for line in f if line.strip()}
+        now = time.time()
+        with self._lock:
+            # The file is claimed and imported in the same write transaction, so that when several processes
+            # start together only the first one imports it
+            claimed = self._db.execute("INSERT OR IGNORE INTO imports VALUES (?, ?)", (os.path.abspath(path), now))
+            if not claimed.rowcount:
+                self._db.rollback()
+                return 0
+            cursor = self._db.executemany("INSERT OR IGNORE INTO searches VALUES (?, NULL, ?)",
+                                          [(query, now) for query in queries])
+            self._db.commit()
+        self.logger.info(f"Imported {cursor.rowcount} queries which found nothing from {path}")
+        return cursor.rowcount
+
+    def purge(self):
+        """
+        Deletes the expired results
+        Returns:
+            int: amount of results deleted
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM searches WHERE searched_at < CASE WHEN spotify_id IS NULL "
+                                      "THEN ? ELSE ? END", (now - self.not_found_ttl, now - self.found_ttl))
+            self._db.commit()
+        return cursor.rowcount
+
+    def counts(self):
+        """
+        Returns:
+            dict: amount of cached queries which found a track and which found nothing
+        """
+        with self._lock:
+            found, not_found = self._db.execute("SELECT COUNT(spotify_id), COUNT(*) - COUNT(spotify_id) "
+                                                "FROM searches").fetchone()
+        return {"found": found, "not_found": not_found}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _expired(self, result: CachedSearch):
+        ttl = self.found_ttl if result.spotify_id is not None else self.not_found_ttl
+        return time.time() - result.searched_at >= ttl
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def normalize_query(query: str):
+    """Cache key of a query: unicode-normalized, case-folded and with single spaces"""
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", query).casefold()).strip()
+
+
+if __name__ == "__main__":
+    from config import ScraperConfig
+
+    parser = argparse.ArgumentParser(description="Maintenance of the Spotify search cache")
+    parser.add_argument("--import-file", metavar="IGNORE_FILE",
+                        help="import the queries of an ignore file (one per line) as queries which found nothing")
+    parser.add_argument("--purge", action="store_true", help="delete the expired results")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    cfg = ScraperConfig()
+    with SearchCache(cfg.spotify_cache_path, cfg.spotify_found_ttl, cfg.spotify_not_found_ttl) as cache:
+        if args.import_file:
+            cache.import_ignore_file(args.import_file)
+        if args.purge:
+            print(f"Deleted {cache.purge()} expired results")
+        print(cache.counts())
@@ -0,0 +1,100 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from spotify.matcher import TrackMatcher, track_query
+from spotify.search_cache import SearchCache
+from spotify.wrapper import SpotifyWrapper
+
+
+class SearchExecutor:
+    def __init__(self, wrapper: SpotifyWrapper, workers: int = 8, cache: SearchCache = None,
+                 matcher: TrackMatcher = None, search_limit: int = 10):
+        """
+        Sends Spotify searches from several threads. The pace is set by the rate limiter of the wrapper,
+        the threads only hide the latency of the requests so that the limiter's rate can actually be reached.
+        Args:
+            wrapper (SpotifyWrapper): client whose rate limiter and connection pool are shared by the threads
+            workers (int): concurrent requests
+            cache (SearchCache): results of the previous searches, only the queries it misses are sent
+            matcher (TrackMatcher): picks the track among the results of a search
+            search_limit (int): results of a search given to the matcher
+        """
+        self.logger = logging.getLogger(__name__)
+        self.wrapper = wrapper
+        self.cache = cache
+        self.matcher = matcher or TrackMatcher()
+        self.search_limit = search_limit
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="spotify-search")
+
+    def search(self, tracks):
+        """
+        Searches the spotify ids of the given tracks concurrently
+        Args:
+            tracks: iterable of (key, (title, album, artist, duration)) tuples, consumed lazily
+
+        Yields:
+            tuple: (key, spotify_id) in completion order, spotify_id being None if nothing was found
+                   or the search failed
+        """
+        return self.map(self.search_one, tracks)
+
+    def map(self, function, items):
+        """
+        Calls a function concurrently on the given items, e.g. a function sending several Spotify requests
+        Args:
+            function: function taking an argument, called from the threads
+            items: iterable of (key, argument) tuples, consumed lazily: at most 2 * workers calls are pending
+
+        Yields:
+            tuple: (key, result) in completion order
+        """
+        items = iter(items)
+        pending = {}
+        while True:
+            for key, argument in items:
+                pending[self._executor.submit(function, argument)] = key
+                if len(pending) >= 2 * self.workers:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+    def search_one(self, track: tuple):
+        """
+        Searches the spotify id of a track, answered by the cache if it was searched before.
+        A single search returns several candidates, the matcher picks the track among them.
+        Results are cached, failed searches are not so that they are retried.
+        Args:
+            track (tuple): (title, album, artist, duration in seconds or None)
+
+        Returns:
+            str: spotify id of the track, None if no candidate matched or the search failed
+        """
+        query = track_query(*track[:3])
+        cached = self.cache.get(query) if self.cache is not None else None
+        if cached is not None:
+            return cached.spotify_id
+        try:
+            candidates = self.wrapper.search_tracks(query, self.search_limit)
+        except Exception as e:
+            self.logger.error(f"Spotify search '{query}' failed with error: {e!r}")
+            return None
+        [(index, confidence)] = self.matcher.match([track], candidates)
+        spotify_id = candidates[index]['id'] if index is not None else None
+        if spotify_id is None and candidates:
+            self.logger.debug(f"No match for '{query}' among {len(candidates)} results, best score {confidence:.2f}")
+        if self.cache is not None:
+            self.cache.put(query, spotify_id)
+        return spotify_id
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
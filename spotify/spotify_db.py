@@ -1,27 +1,62 @@
 import logging
 
+from config import ScraperConfig
 from sql import DatabaseManager
 from spotify import SpotifyWrapper
+from spotify.album_resolver import AlbumResolver
+from spotify.matcher import TrackMatcher
+from spotify.rate_limiter import RateLimiter
+from spotify.search_cache import SearchCache
+from spotify.search_executor import SearchExecutor
+
+IGNORE_FILE = "spotify/ignore_search.txt"  # queries which found nothing, from before the search cache
 
 
 class SpotifyDBFiller:
-    def __init__(self):
-        self.dbmanager = DatabaseManager()
-        self.wrapper = SpotifyWrapper()
+    def __init__(self, dbmanager: DatabaseManager = None, cfg: ScraperConfig = None):
+        """
+        Args:
+            dbmanager (DatabaseManager): connection to use, a new one is opened by default
+            cfg (ScraperConfig): concurrency and rate of the Spotify requests, search cache
+        """
+        cfg = cfg or ScraperConfig()
+        self.dbmanager = dbmanager or DatabaseManager()
+        limiter = RateLimiter(cfg.spotify_rate, max_rate=cfg.spotify_max_rate)
+        self.wrapper = SpotifyWrapper(limiter, pool_size=cfg.spotify_workers)
+        self.cache = SearchCache(cfg.spotify_cache_path, cfg.spotify_found_ttl, cfg.spotify_not_found_ttl)
+        self.cache.import_ignore_file(IGNORE_FILE)
+        matcher = TrackMatcher(cfg.spotify_min_confidence)
+        self.executor = SearchExecutor(self.wrapper, cfg.spotify_workers, self.cache, matcher, cfg.spotify_search_limit)
+        self.resolver = AlbumResolver(self.wrapper, self.executor.search_one, self.cache, matcher)
         self.logger = logging.getLogger(__name__)
 
-    def get_track_spotify_id(self, track_name: str, album: str, artist: str):
+    def get_track_spotify_id(self, track_name: str, album: str, artist: str, duration: int = None):
         """Search spotify to get the spotify's id of a given song"""
-        try:
-            track_data = self.wrapper.search(f"{track_name} {album} {artist}")
-            if track_data:
-                track_id = track_data['id']
-                return track_id
-            else:
-                return None
-        except ConnectionError as e:
-            self.logger.error("Spotify search failed with error:", e)
-            return None
+        return self.executor.search_one((track_name, album, artist, duration))
+
+    def search_track_spotify_ids(self, tracks):
+        """
+        Searches the spotify ids of tracks concurrently, the tracks searched before are answered by the cache
+        Args:
+            tracks: iterable of (db_id, track_name, album, artist, duration)
+
+        Yields:
+            tuple: (db_id, spotify_id) in completion order, spotify_id being None when nothing was found
+        """
+        yield from self.executor.search((track[0], track[1:]) for track in tracks)
+
+    def resolve_albums_spotify_ids(self, albums):
+        """
+        Finds the spotify ids of the tracks of albums, several albums at once: each album is searched once and its
+        tracks matched with its Spotify tracklist, see spotify/album_resolver.py
+        Args:
+            albums: iterable of albums, as yielded by DatabaseManager.iter_albums_tracks
+
+        Yields:
+            tuple: (db_id, spotify_id) by album in completion order, spotify_id being None when nothing was found
+        """
+        for _, tracks in self.executor.map(self.resolver.resolve, ((album[0], album) for album in albums)):
+            yield from tracks
 
     def get_audio_features(self, ids: list):
         """Gets the audio features of a list of songs from spotify's api"""
@@ -30,7 +65,7 @@ class SpotifyDBFiller:
         try:
             return self.wrapper.get_audio_features(ids), feature_names
         except ConnectionError as e:
-            self.logger.error("Spotify audio feature request failed with error:", e)
+            self.logger.error(f"Spotify audio feature request failed with error: {e}")
             return None, None
 
     def fill_audio_features_in_db(self, db_ids: list, features: list):
@@ -38,6 +73,11 @@ class SpotifyDBFiller:
         args = [tuple(feature + [db_id]) for feature, db_id in zip(features, db_ids)]
         self.dbmanager.insert_features_from_spotify(args)
 
+    def close(self):
+        self.executor.close()
+        self.cache.close()
+        self.dbmanager.close()
+
 
 if __name__ == "__main__":
     spotify = SpotifyDBFiller()
@@ -1,4 +1,3 @@
-import json
 import logging
 import os
 import threading
@@ -6,74 +5,161 @@ import time
 
 import dotenv
 import requests
+from requests.adapters import HTTPAdapter
 
 from spotify import SpotifyAuth
+from spotify.rate_limiter import RateLimiter, parse_retry_after
 
 dotenv.load_dotenv()
 
 
 class SpotifyWrapper:
     BASE_URL = 'https://api.spotify.com/v1/'
+    RETRY_STATUSES = {401, 429, 500, 502, 503, 504}
 
-    def __init__(self):
+    def __init__(self, limiter: RateLimiter = None, max_retries: int = 5, timeout: int = 30, pool_size: int = 10):
+        """
+        Spotify api client, safe to use from several threads: the requests of every thread go through the same
+        rate limiter and connection pool.
+        Args:
+            limiter (RateLimiter): rate limiter shared by the requests, a new one by default
+            max_retries (int): retries of a request answering with a 401, 429 or 5xx status or a connection error
+            timeout (int): timeout of a request in seconds
+            pool_size (int): connections kept open to the api, at least the amount of threads using the wrapper
+        """
         self.logger = logging.getLogger(__name__)
         self.auth = SpotifyAuth(os.environ['CLIENT_ID'], os.environ['CLIENT_SECRET'])
         self.headers = self.auth.get_headers()
-        self.ignore = self._get_ignore_set()
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._auth_lock = threading.Lock()
         self._start_auth_token_refresh()
 
     def search(self, query: str):
-        """Searches spotify with the given query"""
-        if query in self.ignore:
-            self.logger.info(f"Ignoring query: '{query}'")
-            return None
-        params = {'q': query, 'limit': 1, 'type': 'track'}
-        response = requests.get(self.BASE_URL + 'search', headers=self.headers, params=params)
-        if 'Retry-After' in response.headers:
-            self.logger.warning('Retry-After cue received from Spotify')
-            try:
-                waiting_time = int(response.headers['Retry-After'])
-                self.logger.warning(f'Waiting {waiting_time}s before next request.')
-                time.sleep(waiting_time)
-            except Exception as e:
-                self.logger.error(f"Couldn't convert Retry-After value '{response.headers['Retry-After']}' to int. "
-                                  f"Waiting for 1 min by default. Error : {e}")
-                time.sleep(60)
-        try:
-            data = json.loads(response.text)
-            if 'error' in data:
-                status = data['error']['status']
-                self.logger.warning(f"Error {status} for query {query}")
-                if status == 401:  # 401: token expired
-                    # Request new access tokens
-                    self.headers = self.auth.get_headers()
-                    self.logger.info('Refreshing access token.')
-                    return self.search(query)
-                elif status == 404:
-                    self._add_to_ignore_search(query)
-                elif status == 429:  # 429: too many requests
-                    self.logger.error('Error 429: too many requests. Waiting for 1 hour.')
-                    time.sleep(3600)
-                return None
-            else:  # this is when things go right
-                if len(data['tracks']['items']) > 0:
-                    track = data['tracks']['items'][0]
-                    time.sleep(1)  # Trying not to reach Spotify's query threshold
-                    return track
-                else:
-                    self._add_to_ignore_search(query)
-                    return None
-        except json.decoder.JSONDecodeError as e:
-            self.logger.error('Error occured when opening spotify search query result:', e)
-            return None
+        """
+        Searches spotify with the given query
+        Returns:
+            dict: first track found, None if Spotify found nothing
+        Raises:
+            ConnectionError: the request failed, even after retries
+        """
+        tracks = self.search_tracks(query, limit=1)
+        return tracks[0] if tracks else None
+
+    def search_tracks(self, query: str, limit: int = 10):
+        """
+        Searches the tracks matching a query, to pick the right one locally, see spotify/matcher.py
+        Returns:
+            list: tracks found, best results first
+        Raises:
+            ConnectionError: the request failed, even after retries
+        """
+        params = {'q': query, 'limit': limit, 'type': 'track'}
+        status, data = self._get('search', params)
+        if status == 404:
+            return []
+        if data is None:
+            raise ConnectionError(f"Spotify search failed for '{query}' (status {status})")
+        return data['tracks']['items']
+
+    def search_albums(self, album: str, artist: str, limit: int = 5):
+        """
+        Searches the albums of an artist on spotify
+        Returns:
+            list: albums found, best results first
+        Raises:
+            ConnectionError: the request failed, even after retries
+        """
+        params = {'q': f'album:{album} artist:{artist}', 'limit': limit, 'type': 'album'}
+        status, data = self._get('search', params)
+        if status == 404:
+            return []
+        if data is None:
+            raise ConnectionError(f"Spotify album search failed for '{album}' by '{artist}' (status {status})")
+        return data['albums']['items']
+
+    def get_album_tracks(self, album_id: str):
+        """
+        Gets the whole tracklist of an album, by pages of 50 tracks (Spotify's limit)
+        Returns:
+            list: tracks of the album, with their id, name and duration_ms
+        Raises:
+            ConnectionError: a request failed, even after retries
+        """
+        tracks = []
+        while True:
+            params = {'limit': 50, 'offset': len(tracks)}
+            status, data = self._get(f'albums/{album_id}/tracks', params)
+            if data is None:
+                raise ConnectionError(f"Spotify album tracks request failed for {album_id} (status {status})")
+            tracks += data['items']
+            if not data.get('next') or not data['items']:
+                return tracks
 
     def get_audio_features(self, track_ids: list):
-        """Gets the audio features of a list of songs from spotify's api"""
+        """
+        Gets the audio features of a list of songs from spotify's api
+        Raises:
+            ConnectionError: the request failed, even after retries
+        """
         params = {'ids': ','.join(track_ids)}
-        result = requests.get(self.BASE_URL + 'audio-features', headers=self.headers, params=params)
-        data = json.loads(result.text)
+        status, data = self._get('audio-features', params)
+        if data is None:
+            raise ConnectionError(f"Spotify audio features request failed (status {status})")
         return data['audio_features']
 
+    def _get(self, endpoint: str, params: dict):
+        """
+        Sends a GET request through the rate limiter, retrying on 401, 429 and 5xx statuses and connection errors.
+        A 429 only pauses for the Retry-After delay given by Spotify, and lowers the rate of the limiter.
+        Returns:
+            tuple: (status code, json data), data being None when the request failed
+        """
+        status = None
+        for attempt in range(self.max_retries + 1):
+            sent_at = self.limiter.acquire()
+            headers = self.headers
+            try:
+                response = self.session.get(self.BASE_URL + endpoint, headers=headers, params=params,
+                                            timeout=self.timeout)
+            except requests.RequestException as e:
+                self.logger.warning(f"Request to {endpoint} failed ({attempt + 1}/{self.max_retries + 1}): {e!r}")
+                time.sleep(0.2 * 2 ** attempt)
+                continue
+            status = response.status_code
+            if status == 429:
+                self.limiter.throttled(sent_at, parse_retry_after(response.headers.get('Retry-After')))
+                continue
+            if status == 401:  # 401: token expired
+                self._refresh_auth_token(headers)
+                continue
+            if status in self.RETRY_STATUSES:
+                self.logger.warning(f"Error {status} from {endpoint} ({attempt + 1}/{self.max_retries + 1})")
+                time.sleep(0.2 * 2 ** attempt)
+                continue
+            self.limiter.succeeded()
+            try:
+                data = response.json()
+            except ValueError as e:
+                self.logger.error(f"Error occured when reading the result of {endpoint}: {e}")
+                return status, None
+            if 'error' in data:
+                self.logger.warning(f"Error {data['error']['status']} from {endpoint} for {params}")
+                return status, None
+            return status, data
+        self.logger.error(f"Request to {endpoint} failed after {self.max_retries + 1} attempts (status {status})")
+        return status, None
+
+    def _refresh_auth_token(self, expired_headers: dict = None):
+        """Requests a new access token, unless another thread already replaced the expired one"""
+        with self._auth_lock:
+            if expired_headers is None or self.headers is expired_headers:
+                self.logger.info('Refreshing access token.')
+                self.headers = self.auth.get_headers()
+
     def _start_auth_token_refresh(self):
         """Starts a thread to periodically refresh tokens"""
         refresh_token_thread = threading.Thread(target=self._refresh_auth_token_periodically)
@@ -84,23 +170,7 @@ class SpotifyWrapper:
         """Queries for a new access token to prevent expiration"""
         while True:
             time.sleep(3500)
-            self.logger.debug('Refreshing access token.')
-            self.headers = self.auth.get_headers()
-
-    def _add_to_ignore_search(self, query: str):
-        """Adds a query to the list of queries that provide no result"""
-        self.logger.info(f'Adding {query} to ignore list')
-        with open('spotify/ignore_search.txt', 'a') as f:
-            f.write(f'{query}\n')
-
-    @staticmethod
-    def _get_ignore_set():
-        """Returns a set of queries to ignore. Sets are faster than lists to search."""
-        ignore = []
-        with open('spotify/ignore_search.txt', 'r') as f:
-            for line in f.readlines():
-                ignore.append(line.strip('\n'))
-        return set(ignore)
+            self._refresh_auth_token()
 
 
 if __name__ == '__main__':
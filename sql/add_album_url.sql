@@ -0,0 +1,5 @@
+-- Adds the discogs url of the albums to a database created before it was stored.
+-- Albums saved earlier get their url the next time they are scraped.
+USE arno_shai;
+
+ALTER TABLE `Album` ADD COLUMN `url` varchar(255);
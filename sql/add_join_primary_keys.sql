@@ -0,0 +1,16 @@
+-- Adds primary keys to the join tables of a database created before they existed.
+-- Bulk inserts rely on them to ignore the join rows that are already stored.
+-- Duplicated rows are removed first, the primary keys could not be created otherwise.
+USE arno_shai;
+
+CREATE TABLE `AlbumArtist_dedup` AS SELECT DISTINCT `album_id`, `artist_id` FROM `AlbumArtist`;
+DELETE FROM `AlbumArtist`;
+INSERT INTO `AlbumArtist` SELECT `album_id`, `artist_id` FROM `AlbumArtist_dedup`;
+DROP TABLE `AlbumArtist_dedup`;
+ALTER TABLE `AlbumArtist` ADD PRIMARY KEY (`album_id`, `artist_id`);
+
+CREATE TABLE `GenreAlbum_dedup` AS SELECT DISTINCT `genre_id`, `album_id` FROM `GenreAlbum`;
+DELETE FROM `GenreAlbum`;
+INSERT INTO `GenreAlbum` SELECT `genre_id`, `album_id` FROM `GenreAlbum_dedup`;
+DROP TABLE `GenreAlbum_dedup`;
+ALTER TABLE `GenreAlbum` ADD PRIMARY KEY (`genre_id`, `album_id`);
@@ -0,0 +1,163 @@
+import argparse
+import logging
+from collections import defaultdict
+
+# Stats tables and the columns of their groups
+STATS_TABLES = {
+    "GenreYearStats": ("genre_id", "year"),
+    "ArtistStats": ("artist_id",),
+}
+# Track columns aggregated, each one is a row of its group holding count, sum and sum of squares of the non NULL values
+STATS_COLUMNS = ("duration", "danceability", "energy", "loudness", "speechiness", "acousticness", "instrumentalness",
+                 "valence", "tempo")
+# Group of a track in each stats table: selected columns, and joins from the Track table "t".
+# Albums without a year are grouped under year 0.
+GROUPS = {
+    "GenreYearStats": ("ga.genre_id, COALESCE(a.year, 0)",
+                       "JOIN Album a ON a.id = t.album_id JOIN GenreAlbum ga ON ga.album_id = a.id"),
+    "ArtistStats": ("aa.artist_id", "JOIN AlbumArtist aa ON aa.album_id = t.album_id"),
+}
+IDS_PER_QUERY = 500
+
+
+class StatsDelta:
+    def __init__(self):
+        """
+        Changes of the stats tables made by a transaction, applied at its end with one upsert per changed row.
+        Tracks are counted out before the transaction writes them and counted in after,
+        so new tracks, updated features and new join rows are all accounted for.
+        """
+        self.changes = {table: defaultdict(lambda: [0, 0.0, 0.0]) for table in STATS_TABLES}
+
+    def add(self, table: str, group: tuple, values, sign: int = 1):
+        """
+        Counts a track in (sign=1) or out (sign=-1) of a group
+        Args:
+            table (str): stats table
+            group (tuple): values of the group columns
+            values: values of STATS_COLUMNS, None being ignored
+            sign (int): 1 or -1
+        """
+        for column, value in zip(STATS_COLUMNS, values):
+            if value is not None:
+                value = float(value)
+                change = self.changes[table][group + (column,)]
+                change[0] += sign
+                change[1] += sign * value
+                change[2] += sign * value * value
+
+    def add_tracks(self, cursor, track_ids: list, sign: int = 1):
+        """Counts tracks in or out of all their groups, as they currently are in the database"""
+        for start in range(0, len(track_ids), IDS_PER_QUERY):
+            ids = track_ids[start:start + IDS_PER_QUERY]
+            for table in GROUPS:
+                cursor.execute(tracks_groups_query(table, len(ids)), ids)
+                size = len(STATS_TABLES[table])
+                for row in cursor.fetchall():
+                    self.add(table, tuple(row[:size]), row[size:], sign)
+
+    def apply(self, cursor, backend):
+        """
+        Adds the changes to the stats tables.
+        Rows are written in key order, so that concurrent transactions lock them in the same order.
+        """
+        for table, changes in self.changes.items():
+            rows = [key + tuple(change) for key, change in sorted(changes.items()) if any(change)]
+            if rows:
+                columns = STATS_TABLES[table] + ("feature", "n", "total", "total_sq")
+                cursor.executemany(backend.insert_or_add(table, columns, columns[:-3], columns[-3:]), rows)
+
+
+def tracks_groups_query(table: str, n_tracks: int):
+    """Query reading the groups of a stats table and the aggregated values of n tracks, given their ids"""
+    group_columns, joins = GROUPS[table]
+    return (f"SELECT {group_columns}, {', '.join('t.' + column for column in STATS_COLUMNS)} "
+            f"FROM Track t {joins} WHERE t.id IN ({', '.join(['%s'] * n_tracks)})")
+
+
+def compute_stats(cursor):
+    """
+    Aggregates the stats of every group from the music tables
+    Returns:
+        dict: stats table -> {(group..., feature): (n, total, total_sq)}
+    """
+    stats = {}
+    for table, (group_columns, joins) in GROUPS.items():
+        stats[table] = {}
+        size = len(STATS_TABLES[table])
+        for column in STATS_COLUMNS:
+            cursor.execute(f"SELECT {group_columns}, COUNT(t.{column}), SUM(t.{column}), "
+                           f"SUM(t.{column} * t.{column}) FROM Track t {joins} "
+                           f"GROUP BY {group_columns} HAVING COUNT(t.{column}) > 0")
+            for row in cursor.fetchall():
+                stats[table][tuple(row[:size]) + (column,)] = (row[size], float(row[size + 1]), float(row[size + 2]))
+    return stats
+
+
+def read_stats(cursor):
+    """
+    Reads the stats tables
+    Returns:
+        dict: same as compute_stats
+    """
+    stats = {}
+    for table, group in STATS_TABLES.items():
+        cursor.execute(f"SELECT {', '.join(group)}, feature, n, total, total_sq FROM {table}")
+        size = len(group) + 1
+        stats[table] = {tuple(row[:size]): (row[size], row[size + 1], row[size + 2]) for row in cursor.fetchall()}
+    return stats
+
+
+def rebuild_stats(dbmanager, check_only: bool = False):
+    """
+    Recomputes the stats tables from the music tables, and reports the rows the incremental updates got wrong.
+    Nothing should write to the database meanwhile: changes made between the aggregation and the replacement
+    of the tables would be lost.
+    Args:
+        dbmanager (DatabaseManager): database to rebuild
+        check_only (bool): only compare, the stats tables are left as they are
+
+    Returns:
+        int: amount of rows that differed
+    """
+    logger = logging.getLogger(__name__)
+    cursor = dbmanager.cursor
+    expected, current = compute_stats(cursor), read_stats(cursor)
+    differences = 0
+    for table in STATS_TABLES:
+        table_differences = 0
+        for key in expected[table].keys() | current[table].keys():
+            if not _same_stats(expected[table].get(key, (0, 0, 0)), current[table].get(key, (0, 0, 0))):
+                table_differences += 1
+                logger.debug(f"{table} {key}: expected {expected[table].get(key)}, found {current[table].get(key)}")
+        logger.info(f"{table}: {len(expected[table])} rows expected, {table_differences} differ")
+        differences += table_differences
+    if not check_only:
+        for table, group in STATS_TABLES.items():
+            cursor.execute(f"DELETE FROM {table}")
+            columns = group + ("feature", "n", "total", "total_sq")
+            query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+            cursor.executemany(query, [key + values for key, values in sorted(expected[table].items())])
+        dbmanager.connection.commit()
+        logger.info("Rebuilt the stats tables")
+    return differences
+
+
+def _same_stats(expected: tuple, current: tuple):
+    """Stats are equal up to the rounding errors of the incremental sums"""
+    return expected[0] == current[0] and all(abs(a - b) <= 1e-6 * max(1.0, abs(a))
+                                             for a, b in zip(expected[1:], current[1:]))
+
+
+if __name__ == "__main__":
+    from .database_manager import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Rebuilds the stats tables from the music tables")
+    parser.add_argument("--check", action="store_true", help="only report the rows that differ")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    db = DatabaseManager()
+    try:
+        rebuild_stats(db, check_only=args.check)
+    finally:
+        db.close()
@@ -0,0 +1,192 @@
+import logging
+import os
+import sqlite3
+
+import pymysql
+from dotenv import load_dotenv
+
+from .schema import migrate
+
+load_dotenv()
+
+
+class MySQLBackend:
+    name = "mysql"
+    OperationalError = pymysql.err.OperationalError
+
+    def __init__(self):
+        """MySQL server storage, configured by the MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST and MYSQL_DATABASE variables"""
+        self.connection = pymysql.connect(user=os.environ["MYSQL_USER"],
+                                          password=os.environ["MYSQL_PASSWORD"],
+                                          host=os.environ["MYSQL_HOST"],
+                                          db=os.environ["MYSQL_DATABASE"])
+
+    def cursor(self):
+        return self.connection.cursor()
+
+    def stream_cursor(self):
+        """Server-side cursor, rows are read as they are iterated instead of being loaded at once"""
+        return self.connection.cursor(pymysql.cursors.SSCursor)
+
+    def ping(self):
+        """Health check, reconnects if the connection was lost"""
+        self.connection.ping(reconnect=True)
+
+    @staticmethod
+    def table_columns(cursor, table: str):
+        cursor.execute(f"DESCRIBE {table}")
+        return [column[0] for column in cursor.fetchall()]
+
+    @staticmethod
+    def has_table(cursor, table: str):
+        cursor.execute("SHOW TABLES LIKE %s", (table,))
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def has_index(cursor, table: str, index: str):
+        cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (index,))
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def insert_ignore(table: str, columns: tuple):
+        """Insert statement skipping the rows whose primary key already exists"""
+        return f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+    @staticmethod
+    def insert_or_fill(table: str, columns: tuple, key: str, column: str):
+        """Insert statement setting the given column of the rows that already exist, if it is NULL"""
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON DUPLICATE KEY UPDATE {column} = COALESCE({column}, VALUES({column}))")
+
+    @staticmethod
+    def insert_or_add(table: str, columns: tuple, key: tuple, added: tuple):
+        """Insert statement adding the values of the given columns to the rows that already exist"""
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON DUPLICATE KEY UPDATE {', '.join(f'{column} = {column} + VALUES({column})' for column in added)}")
+
+    def close(self):
+        self.connection.close()
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    OperationalError = sqlite3.OperationalError
+    PRAGMAS = {
+        "journal_mode": "WAL",  # readers don't block the writer
+        "synchronous": "NORMAL",  # no fsync per commit, WAL mode stays consistent on a crash
+        "foreign_keys": "ON",
+        "temp_store": "MEMORY",
+        "cache_size": -64 * 1024,  # KiB
+        "mmap_size": 256 * 1024 ** 2,  # bytes
+        "busy_timeout": 5000,  # ms
+    }
+
+    def __init__(self, path: str = "music.db"):
+        """
+        Embedded storage in a local SQLite file, whose schema is created or upgraded by sql.schema when opened.
+        Queries are written for MySQL with %s placeholders, its cursors convert them.
+        Args:
+            path (str): database file
+        """
+        self.logger = logging.getLogger(__name__)
+        # The connection is created by the main thread and used by the scraping pipeline's writer thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        for pragma, value in self.PRAGMAS.items():
+            self.connection.execute(f"PRAGMA {pragma} = {value}")
+        migrate(self)
+
+    def cursor(self):
+        return _SQLiteCursor(self.connection.cursor())
+
+    def stream_cursor(self):
+        """SQLite cursors already read rows as they are iterated"""
+        return self.cursor()
+
+    def ping(self):
+        """An embedded database can't be disconnected"""
+
+    @staticmethod
+    def table_columns(cursor, table: str):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return [column[1] for column in cursor.fetchall()]
+
+    @staticmethod
+    def has_table(cursor, table: str):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def has_index(cursor, table: str, index: str):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+                       (table, index))
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def insert_ignore(table: str, columns: tuple):
+        """Insert statement skipping the rows whose primary key already exists"""
+        return f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+    @staticmethod
+    def insert_or_fill(table: str, columns: tuple, key: str, column: str):
+        """Insert statement setting the given column of the rows that already exist, if it is NULL"""
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON CONFLICT ({key}) DO UPDATE SET {column} = COALESCE({column}, excluded.{column})")
+
+    @staticmethod
+    def insert_or_add(table: str, columns: tuple, key: tuple, added: tuple):
+        """Insert statement adding the values of the given columns to the rows that already exist"""
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET "
+                f"{', '.join(f'{column} = {column} + excluded.{column}' for column in added)}")
+
+    def close(self):
+        self.connection.close()
+
+
+class _SQLiteCursor:
+    """sqlite3 cursor accepting the %s placeholders of pymysql"""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, query: str, args=()):
+        return self._cursor.execute(query.replace("%s", "?"), args or ())
+
+    def executemany(self, query: str, args):
+        return self._cursor.executemany(query.replace("%s", "?"), args)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size: int):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+def get_backend():
+    """
+    Storage backend chosen by the DB_BACKEND environment variable: "mysql" (default) or "sqlite",
+    whose file is given by SQLITE_PATH (default: music.db)
+    """
+    backend = os.environ.get("DB_BACKEND", "mysql")
+    if backend == "mysql":
+        return MySQLBackend()
+    if backend == "sqlite":
+        return SQLiteBackend(os.environ.get("SQLITE_PATH", "music.db"))
+    raise ValueError(f"Unknown DB_BACKEND '{backend}', expected 'mysql' or 'sqlite'")
@@ -0,0 +1,92 @@
+import logging
+from contextlib import contextmanager
+from queue import LifoQueue
+from threading import Lock
+
+from .database_manager import DatabaseManager
+
+
+class ConnectionPool:
+    def __init__(self, size: int = 4, factory=DatabaseManager):
+        """
+        Small pool of database connections shared by threads.
+
+        Connections (DatabaseManager instances, each with its own connection and id cache) are opened on demand
+        up to size, checked before being handed out and reconnected if the server dropped them.
+        Args:
+            size (int): maximum amount of open connections
+            factory: callable opening a connection
+        """
+        self.logger = logging.getLogger(__name__)
+        self.size = size
+        self.factory = factory
+        self._idle = LifoQueue()  # the last used connection is the most likely to still be alive
+        self._opened = 0
+        self._lock = Lock()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection, blocking while all of them are in use. It is always given back: rolled back
+        after an error, or closed if it may be unusable, so that a failure never leaks a slot of the pool.
+        Yields:
+            DatabaseManager: connection checked with a ping
+        """
+        dbmanager = self._take()
+        try:
+            dbmanager.ping()
+        except Exception:
+            self._discard(dbmanager)
+            raise
+        try:
+            yield dbmanager
+        except dbmanager.backend.OperationalError:
+            # _transaction already retried, the connection is unusable
+            self._discard(dbmanager)
+            raise
+        except Exception:
+            # e.g. an IntegrityError or a bad row, the connection itself is fine
+            dbmanager.rollback()
+            self._idle.put(dbmanager)
+            raise
+        except BaseException:
+            # e.g. a KeyboardInterrupt in the middle of a statement, the connection state is unknown
+            self._discard(dbmanager)
+            raise
+        else:
+            self._idle.put(dbmanager)
+
+    def close(self):
+        """Closes the idle connections, borrowed ones have to be given back first"""
+        while not self._idle.empty():
+            self._discard(self._idle.get())
+
+    def _take(self):
+        with self._lock:
+            if self._idle.empty() and self._opened < self.size:
+                self._opened += 1
+                open_new = True
+            else:
+                open_new = False
+        if not open_new:
+            return self._idle.get()
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _discard(self, dbmanager: DatabaseManager):
+        with self._lock:
+            self._opened -= 1
+        try:
+            dbmanager.close()
+        except Exception as e:
+            self.logger.debug(f"Closing a database connection failed: {e!r}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
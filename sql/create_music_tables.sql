@@ -1,11 +1,12 @@
+-- Tables of schema version 6 of sql/schema.py, which creates and upgrades them: python -m sql.schema
 DROP DATABASE IF EXISTS arno_shai;
 CREATE DATABASE IF NOT EXISTS arno_shai;
 
 USE arno_shai;
 
 CREATE TABLE `Track` (
-  `id` varchar(255) PRIMARY KEY,
-  `album_id` varchar(255),
+  `id` binary(16) PRIMARY KEY,
+  `album_id` binary(16),
   `title` varchar(255),
   `duration` int,
   `danceability` float,
@@ -19,29 +20,51 @@ CREATE TABLE `Track` (
 );
 
 CREATE TABLE `Album` (
-  `id` varchar(255) PRIMARY KEY,
+  `id` binary(16) PRIMARY KEY,
   `year` int,
-  `name` varchar(255)
+  `name` varchar(255),
+  `url` varchar(255)
 );
 
 CREATE TABLE `Artist` (
-  `id` varchar(255) PRIMARY KEY,
+  `id` binary(16) PRIMARY KEY,
   `name` varchar(255)
 );
 
 CREATE TABLE `AlbumArtist` (
-  `album_id` varchar(255),
-  `artist_id` varchar(255)
+  `album_id` binary(16),
+  `artist_id` binary(16),
+  PRIMARY KEY (`album_id`, `artist_id`)
 );
 
 CREATE TABLE `Genre` (
-  `id` varchar(255) PRIMARY KEY,
+  `id` binary(16) PRIMARY KEY,
   `name` varchar(255)
 );
 
 CREATE TABLE `GenreAlbum` (
-  `genre_id` varchar(255),
-  `album_id` varchar(255)
+  `genre_id` binary(16),
+  `album_id` binary(16),
+  PRIMARY KEY (`genre_id`, `album_id`)
+);
+
+CREATE TABLE `GenreYearStats` (
+  `genre_id` binary(16),
+  `year` int,
+  `feature` varchar(32),
+  `n` bigint,
+  `total` double,
+  `total_sq` double,
+  PRIMARY KEY (`genre_id`, `year`, `feature`)
+);
+
+CREATE TABLE `ArtistStats` (
+  `artist_id` binary(16),
+  `feature` varchar(32),
+  `n` bigint,
+  `total` double,
+  `total_sq` double,
+  PRIMARY KEY (`artist_id`, `feature`)
 );
 
 ALTER TABLE `GenreAlbum` ADD FOREIGN KEY (`album_id`) REFERENCES `Album` (`id`);
@@ -53,3 +76,11 @@ ALTER TABLE `Track` ADD FOREIGN KEY (`album_id`) REFERENCES `Album` (`id`);
 ALTER TABLE `AlbumArtist` ADD FOREIGN KEY (`artist_id`) REFERENCES `Artist` (`id`);
 
 ALTER TABLE `AlbumArtist` ADD FOREIGN KEY (`album_id`) REFERENCES `Album` (`id`);
+
+CREATE INDEX `idx_track_album` ON `Track` (`album_id`);
+
+CREATE INDEX `idx_album_artist_artist` ON `AlbumArtist` (`artist_id`);
+
+CREATE INDEX `idx_genre_album_album` ON `GenreAlbum` (`album_id`, `genre_id`);
+
+CREATE INDEX `idx_track_missing_features` ON `Track` (`danceability`, `id`);
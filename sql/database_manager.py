@@ -1,103 +1,457 @@
+import itertools
 import logging
-import os
-
-import pymysql
-from dotenv import load_dotenv
+import time
+from collections import defaultdict
 
+from .aggregates import STATS_TABLES, StatsDelta, tracks_groups_query
+from .backends import get_backend
 from .db_objects import DbAlbum, DbArtist, DbTrack, DbGenre, DbAlbumArtist, DbGenreAlbum
-
-load_dotenv()
+from .id_cache import IdCache
+from .instrumentation import InstrumentedCursor, QueryStats, query_stats as default_query_stats
+from .schema import FEATURE_COLUMNS
 
 
 class DatabaseManager:
-    MAX_RETRIES = 10
-
-    def __init__(self):
-        self.connection = pymysql.connect(user=os.environ["MYSQL_USER"],
-                                          password=os.environ["MYSQL_PASSWORD"],
-                                          host=os.environ["MYSQL_HOST"],
-                                          db=os.environ["MYSQL_DATABASE"])
-        self.cursor = self.connection.cursor()
+    MAX_RETRIES = 5  # retries of a transaction failing with an OperationalError
+    # Columns written by insert_albums, in foreign keys order.
+    # Existing rows are ignored, which requires the join tables primary keys of sql/add_join_primary_keys.sql
+    BULK_COLUMNS = {
+        "Album": ("id", "year", "name", "url"),
+        "Artist": ("id", "name"),
+        "Genre": ("id", "name"),
+        "Track": ("id", "album_id", "title", "duration"),
+        "AlbumArtist": ("album_id", "artist_id"),
+        "GenreAlbum": ("genre_id", "album_id"),
+    }
+    # Primary key of each table, a tuple of ids is used as key for the join tables
+    KEY_COLUMNS = {
+        "Album": ("id",),
+        "Artist": ("id",),
+        "Genre": ("id",),
+        "Track": ("id",),
+        "AlbumArtist": ("album_id", "artist_id"),
+        "GenreAlbum": ("genre_id", "album_id"),
+    }
+
+    def __init__(self, backend=None, id_cache_size: int = 1_000_000, query_stats: QueryStats = None):
+        """
+        Args:
+            backend: storage backend of sql.backends, chosen by the DB_BACKEND environment variable by default
+            id_cache_size (int): maximum amount of ids per table kept in memory to avoid existence queries
+            query_stats (QueryStats): collector timing the statements, the process-wide one by default
+        """
+        self.backend = backend or get_backend()
+        self.connection = self.backend.connection
+        self.query_stats = query_stats or default_query_stats
+        self.cursor = InstrumentedCursor(self.backend.cursor(), self.query_stats)
         self.logger = logging.getLogger(__name__)
+        # Multi-row statements of insert_albums, executemany sends each one as a single multi-row INSERT on MySQL
+        self.bulk_inserts = {table: self.backend.insert_ignore(table, columns)
+                             for table, columns in self.BULK_COLUMNS.items()}
+        # albums saved before urls were stored get theirs
+        self.bulk_inserts["Album"] = self.backend.insert_or_fill("Album", self.BULK_COLUMNS["Album"], "id", "url")
+        self._stats_enabled = None
+        self.id_cache = IdCache(id_cache_size)
 
-    def insert_data_from_album(self, album_dict: dict):
+    def insert_data_from_album(self, album):
         """
         Inserts an album in the database
         Args:
-            album_dict (dict): dictionary containing the album data
+            album (scraping.records.ScrapedAlbum): scraped album data
         """
-        db_data = self._extract_album_data(album_dict)
-        self._insert_album(db_data["album"])
-        self._insert_artist(db_data["artist"])
-        self._insert_genre(db_data["genre"])
-        self._insert_tracks(db_data["tracks"])
-        self._insert_album_artist(db_data["album_artist"])
-        self._insert_genre_album(db_data["genre_album"])
-        self.connection.commit()
+        db_data = self._extract_album_data(album)
+        track_ids = [db_track.id for db_track in db_data["tracks"]]
 
-    def get_tracks(self, size=None):
+        def write():
+            stats = self._stats_before(track_ids)
+            self._insert_album(db_data["album"])
+            self._insert_artist(db_data["artist"])
+            self._insert_genre(db_data["genre"])
+            self._insert_tracks(db_data["tracks"])
+            self._insert_album_artist(db_data["album_artist"])
+            self._insert_genre_album(db_data["genre_album"])
+            self._stats_after(stats, track_ids)
+
+        self._transaction(write)
+        self.query_stats.add_albums(1)
+
+    def insert_albums(self, albums, batch_size: int = 500):
         """
-        Gets tracks from the database
+        Inserts albums by batches: the rows of a batch are grouped per table and written with one
+        multi-row statement per table, existing rows being ignored, then the batch is committed.
         Args:
-            size: Applies a limit to the result. Returns all the database if none.
+            albums: iterable of scraping.records.ScrapedAlbum, it can be a generator
+            batch_size (int): albums inserted per transaction
+        """
+        albums = iter(albums)
+        while batch := list(itertools.islice(albums, batch_size)):
+            start = time.perf_counter()
+            rows = self._group_rows(batch)
+            track_ids = list(rows["Track"])
+
+            def write():
+                stats = self._stats_before(track_ids)
+                inserted = self._insert_rows(rows)
+                self._stats_after(stats, track_ids)
+                return inserted
 
+            count = self._transaction(write)
+            self.query_stats.add_albums(len(batch))
+            for table, table_rows in rows.items():
+                for key in table_rows:
+                    self.id_cache.add(table, key)
+            elapsed = time.perf_counter() - start
+            self.logger.info(f"Inserted {len(batch)} albums ({count} rows) in {elapsed:.2f}s, "
+                             f"{count / elapsed:.0f} rows/s")
+
+    def ping(self):
+        """Checks the connection, reconnecting if it was lost"""
+        self.backend.ping()
+
+    def close(self):
+        self.cursor.close()
+        self.backend.close()
+
+    def stream_cursor(self):
+        """Server-side cursor of the backend, timed like self.cursor"""
+        return InstrumentedCursor(self.backend.stream_cursor(), self.query_stats)
+
+    def _transaction(self, write):
+        """
+        Runs write() then commits, after checking the connection.
+        On an OperationalError (connection lost, deadlock, locked database) the transaction is rolled back
+        and retried, up to MAX_RETRIES times with an exponential backoff.
         Returns:
-            tuple(tuple): Tracks information including artist and album
+            what write() returns
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                self.ping()
+                result = write()
+                start = time.perf_counter()
+                self.connection.commit()
+                self.query_stats.record("COMMIT", time.perf_counter() - start, 0, 1)
+                return result
+            except self.backend.OperationalError as e:
+                self.rollback()
+                if attempt == self.MAX_RETRIES:
+                    self.logger.error(f"Max retries to SQL server reached: {e}")
+                    raise
+                self.logger.warning(f"SQL OperationalError '{e}' - Retry {attempt + 1}/{self.MAX_RETRIES}")
+                time.sleep(min(0.1 * 2 ** attempt, 10))
+            except Exception:
+                self.rollback()
+                raise
+
+    def _group_rows(self, albums: list):
+        """
+        Groups the rows of the albums per table, rows repeated across albums (same artist or genre) being kept once
+        Returns:
+            dict: table name -> {primary key: row values}
+        """
+        rows = {table: {} for table in self.BULK_COLUMNS}
+        for album in albums:
+            db_data = self._extract_album_data(album)
+            db_album, db_artist, db_genre = db_data["album"], db_data["artist"], db_data["genre"]
+            rows["Album"][db_album.id] = (db_album.id, db_album.year, db_album.name, db_album.url)
+            rows["Artist"][db_artist.id] = (db_artist.id, db_artist.name)
+            rows["Genre"][db_genre.id] = (db_genre.id, db_genre.name)
+            for db_track in db_data["tracks"]:
+                rows["Track"][db_track.id] = (db_track.id, db_track.album_id, db_track.title[:255], db_track.duration)
+            album_artist, genre_album = db_data["album_artist"], db_data["genre_album"]
+            rows["AlbumArtist"][album_artist.album_id, album_artist.artist_id] = (album_artist.album_id,
+                                                                                   album_artist.artist_id)
+            rows["GenreAlbum"][genre_album.genre_id, genre_album.album_id] = (genre_album.genre_id,
+                                                                               genre_album.album_id)
+        return rows
 
+    def _insert_rows(self, rows: dict):
         """
-        query = """
-        SELECT t.id, t.title, a.name, a2.name, t.tempo, t.duration,
+        Writes grouped rows, parents first to satisfy the foreign keys.
+        Rows known to exist are not sent, except albums which may need their url.
+        Rows are sorted by key so that concurrent transactions lock shared rows (artists, genres) in the same order
+        and can't deadlock.
+        Returns:
+            int: amount of rows sent
+        """
+        count = 0
+        for table, query in self.bulk_inserts.items():
+            values = [row for key, row in sorted(rows[table].items())
+                      if table == "Album" or self._cached_contains(table, key) is not True]
+            if values:
+                self.cursor.executemany(query, values)
+                count += len(values)
+        return count
+
+    def rollback(self):
+        """Rolls back the current transaction, forgetting the ids it inserted"""
+        try:
+            self.connection.rollback()
+        except Exception as e:  # the connection is lost, and its transaction with it
+            self.logger.debug(f"Rollback failed: {e!r}")
+        self.id_cache.clear()
+
+    # Track rows of get_tracks and iter_tracks: id, title, album, artist, tempo, duration, then the audio features
+    TRACKS_COLUMNS = """t.id, t.title, a.name, a2.name, t.tempo, t.duration,
                 t.danceability, t.energy, t.loudness, t.speechiness, 
-                t.acousticness, t.instrumentalness, t.valence, t.tempo
+                t.acousticness, t.instrumentalness, t.valence, t.tempo"""
+    TRACKS_JOINS = """
         FROM Track t
             JOIN Album a ON a.id = t.album_id
             JOIN AlbumArtist aa on aa.album_id = a.id 
             JOIN Artist a2 on a2.id = aa.artist_id 
         """
+    FEATURE_COLUMNS = FEATURE_COLUMNS
+    FEATURES_UPDATE = f"UPDATE Track SET {', '.join(f'{column} = %s' for column in FEATURE_COLUMNS)} WHERE id = %s"
+
+    def get_tracks(self, size=None):
+        """
+        Gets tracks from the database
+        Args:
+            size: Applies a limit to the result. Returns all the database if none.
+
+        Returns:
+            tuple(tuple): Tracks information including artist and album
+
+        """
+        query = f"SELECT {self.TRACKS_COLUMNS} {self.TRACKS_JOINS}"
         if size:
-            query += f" LIMIT {size}"
-        self.cursor.execute(query)
+            self.cursor.execute(query + " LIMIT %s", (size,))
+        else:
+            self.cursor.execute(query)
         result = self.cursor.fetchall()
         return result
 
-    def insert_tempo_from_spotify(self, track_id, tempo):
-        """Fill the tempo column of given tracks in the database"""
-        query = f"UPDATE Track SET tempo = {tempo} WHERE id = '{track_id}'"
-        self.cursor.execute(query)
+    def iter_tracks(self, missing_features: bool = False, page_size: int = 1000):
+        """
+        Streams the tracks of the database by pages, in constant memory whatever the size of the Track table.
 
-    def insert_features_from_spotify(self, args):
-        """Fill the tempo column of given tracks in the database"""
-        query = """
-            UPDATE Track 
-            SET danceability = %s, 
-            energy = %s,
-            loudness = %s,
-            speechiness = %s,
-            acousticness = %s,
-            instrumentalness = %s,
-            valence = %s,
-            tempo = %s
-            WHERE id = %s
-        """
-        i = 0
-        while i < self.MAX_RETRIES:
+        Pages are read with keyset pagination on (track id, artist id): each page starts after the last row of the
+        previous one instead of using an OFFSET, so reading a page costs the same at the end of the table as at
+        its start, and rows updated while iterating (e.g. getting their features) don't shift the pages.
+        Args:
+            missing_features (bool): only the tracks that have none of the Spotify audio features yet
+            page_size (int): rows read per query
+
+        Yields:
+            tuple: track row, with the same columns as get_tracks
+        """
+        first_page, next_page = self._tracks_pages_queries(missing_features)
+        last = None
+        while True:
+            cursor = self.stream_cursor()
             try:
-                self.cursor.executemany(query, args)
-            except pymysql.err.OperationalError as e:
-                i += 1
-                self.logger.warning(f"SQL OperationalError '{e}' - Retry {i}/{self.MAX_RETRIES}")
+                if last is None:
+                    cursor.execute(first_page, (page_size,))
+                else:
+                    track_id, artist_id = last
+                    cursor.execute(next_page, (track_id, track_id, artist_id, page_size))
+                # The page is read entirely before being yielded: the caller may use the connection in between,
+                # which a server-side cursor still being read doesn't allow
+                page = list(cursor)
+            finally:
+                cursor.close()
+            for row in page:
+                yield row[:-1]
+            if len(page) < page_size:
+                return
+            last = page[-1][0], page[-1][-1]
+
+    def _tracks_pages_queries(self, missing_features: bool):
+        """
+        Queries of iter_tracks
+        Returns:
+            tuple: first page query, next pages query
+        """
+        conditions = self._tracks_conditions(missing_features)
+        # the artist id is read as an extra last column, to know where the next page starts
+        query = f"SELECT {self.TRACKS_COLUMNS}, a2.id {self.TRACKS_JOINS}"
+        first_page = query + f" WHERE {' AND '.join(conditions) or '1 = 1'} ORDER BY t.id, a2.id LIMIT %s"
+        next_page = query + (f" WHERE {' AND '.join(['t.id >= %s', '(t.id > %s OR a2.id > %s)'] + conditions)}"
+                             " ORDER BY t.id, a2.id LIMIT %s")
+        return first_page, next_page
+
+    def count_tracks(self, missing_features: bool = False):
+        """Amount of track rows iter_tracks yields with the same filters"""
+        self.cursor.execute(self._count_tracks_query(missing_features))
+        return self.cursor.fetchone()[0]
+
+    def _count_tracks_query(self, missing_features: bool):
+        conditions = self._tracks_conditions(missing_features)
+        return f"SELECT COUNT(*) {self.TRACKS_JOINS} WHERE {' AND '.join(conditions) or '1 = 1'}"
+
+    def iter_albums_tracks(self, missing_features: bool = False, page_size: int = 200):
+        """
+        Streams the albums of the database with their tracks, by pages of albums read with keyset pagination
+        on the album id, like iter_tracks.
+        Args:
+            missing_features (bool): only the tracks that have none of the Spotify audio features yet,
+                                     and the albums having such tracks
+            page_size (int): albums read per page
+
+        Yields:
+            tuple: (album id, album name, year, artist names, tracks), tracks being (track id, title, duration)
+                   tuples. Artists are sorted by name.
+        """
+        first_page, next_page = self._albums_pages_queries(missing_features)
+        last = None
+        while True:
+            if last is None:
+                self.cursor.execute(first_page, (page_size,))
             else:
-                self.connection.commit()
+                self.cursor.execute(next_page, (last, page_size))
+            albums = self.cursor.fetchall()
+            if not albums:
+                return
+            album_ids = [album[0] for album in albums]
+            tracks, artists = defaultdict(list), defaultdict(list)
+            self.cursor.execute(self._albums_tracks_query(missing_features, len(album_ids)), album_ids)
+            for album_id, track_id, title, duration in self.cursor.fetchall():
+                tracks[album_id].append((track_id, title, duration))
+            self.cursor.execute(self._albums_artists_query(len(album_ids)), album_ids)
+            for album_id, name in self.cursor.fetchall():
+                artists[album_id].append(name)
+            for album_id, name, year in albums:
+                yield album_id, name, year, artists[album_id], tracks[album_id]
+            if len(albums) < page_size:
                 return
-        self.logger.error(f"Max retries to SQL server reached: terminating process")
-        raise Exception('Max retries to SQL server reached')
+            last = album_ids[-1]
+
+    def count_album_tracks(self, missing_features: bool = False):
+        """Amount of tracks iter_albums_tracks yields with the same filters, each track once whatever its artists"""
+        conditions = self._tracks_conditions(missing_features)
+        self.cursor.execute(f"SELECT COUNT(*) FROM Track t WHERE {' AND '.join(conditions) or '1 = 1'}")
+        return self.cursor.fetchone()[0]
+
+    def _albums_pages_queries(self, missing_features: bool):
+        """
+        Album queries of iter_albums_tracks
+        Returns:
+            tuple: first page query, next pages query
+        """
+        conditions = ["EXISTS (SELECT 1 FROM Track t WHERE t.album_id = a.id AND "
+                      f"{' AND '.join(self._tracks_conditions(missing_features))})"] if missing_features else []
+        query = "SELECT a.id, a.name, a.year FROM Album a"
+        first_page = query + f" WHERE {' AND '.join(conditions) or '1 = 1'} ORDER BY a.id LIMIT %s"
+        next_page = query + f" WHERE {' AND '.join(['a.id > %s'] + conditions)} ORDER BY a.id LIMIT %s"
+        return first_page, next_page
+
+    def _albums_tracks_query(self, missing_features: bool, n_albums: int):
+        conditions = [f"t.album_id IN ({', '.join(['%s'] * n_albums)})"] + self._tracks_conditions(missing_features)
+        return (f"SELECT t.album_id, t.id, t.title, t.duration FROM Track t WHERE {' AND '.join(conditions)} "
+                "ORDER BY t.id")
+
+    @staticmethod
+    def _albums_artists_query(n_albums: int):
+        return ("SELECT aa.album_id, ar.name FROM AlbumArtist aa JOIN Artist ar ON ar.id = aa.artist_id "
+                f"WHERE aa.album_id IN ({', '.join(['%s'] * n_albums)}) ORDER BY ar.name")
+
+    def _tracks_conditions(self, missing_features: bool):
+        """WHERE conditions of the track filters"""
+        conditions = []
+        if missing_features:
+            conditions += [f"t.{column} IS NULL" for column in self.FEATURE_COLUMNS]
+        return conditions
+
+    def iter_album_urls(self):
+        """
+        Streams the discogs urls of the albums in the database, without loading the whole result in memory
+        Yields:
+            str: album url
+        """
+        cursor = self.stream_cursor()
+        try:
+            cursor.execute("SELECT url FROM Album WHERE url IS NOT NULL")
+            for (url,) in cursor:
+                yield url
+        finally:
+            cursor.close()
+
+    def sample_queries(self):
+        """
+        Read queries issued by this class, with sample arguments, for the EXPLAIN report of sql.schema
+        Returns:
+            dict: name -> (query, arguments)
+        """
+        track_id, artist_id = bytes(16), b"\xff" * 16
+        queries = {"get_tracks": (f"SELECT {self.TRACKS_COLUMNS} {self.TRACKS_JOINS} LIMIT %s", (1000,))}
+        for missing_features in (False, True):
+            suffix = " missing_features" if missing_features else ""
+            first_page, next_page = self._tracks_pages_queries(missing_features)
+            queries[f"iter_tracks{suffix} first page"] = (first_page, (1000,))
+            queries[f"iter_tracks{suffix} next page"] = (next_page, (track_id, track_id, artist_id, 1000))
+            queries[f"count_tracks{suffix}"] = (self._count_tracks_query(missing_features), ())
+            first_page, next_page = self._albums_pages_queries(missing_features)
+            queries[f"iter_albums_tracks{suffix} first page"] = (first_page, (200,))
+            queries[f"iter_albums_tracks{suffix} next page"] = (next_page, (track_id, 200))
+            queries[f"iter_albums_tracks{suffix} tracks"] = (self._albums_tracks_query(missing_features, 2),
+                                                             (track_id, artist_id))
+        queries["iter_albums_tracks artists"] = (self._albums_artists_query(2), (track_id, artist_id))
+        queries["iter_album_urls"] = ("SELECT url FROM Album WHERE url IS NOT NULL", ())
+        for table, columns in self.KEY_COLUMNS.items():
+            queries[f"exists {table}"] = (self._exists_query(table), (track_id,) * len(columns))
+        for table in STATS_TABLES:
+            queries[f"stats groups {table}"] = (tracks_groups_query(table, 2), (track_id, artist_id))
+        queries["insert_features_from_spotify"] = (self.FEATURES_UPDATE, (0.5,) * len(self.FEATURE_COLUMNS) + (track_id,))
+        return queries
+
+    def insert_tempo_from_spotify(self, track_id, tempo):
+        """Fill the tempo column of given tracks in the database"""
+        self.cursor.execute("UPDATE Track SET tempo = %s WHERE id = %s", (tempo, track_id))
+
+    def insert_features_from_spotify(self, args):
+        """
+        Fills the audio features of tracks
+        Args:
+            args: tuples of the values of FEATURE_COLUMNS followed by the track id
+        """
+        track_ids = [row[-1] for row in args]
+
+        def write():
+            stats = self._stats_before(track_ids)
+            self.cursor.executemany(self.FEATURES_UPDATE, args)
+            self._stats_after(stats, track_ids)
+
+        self._transaction(write)
+
+    @property
+    def stats_enabled(self):
+        """Whether the database has the stats tables of sql/aggregates.py, checked once"""
+        if self._stats_enabled is None:
+            self._stats_enabled = all(self.backend.has_table(self.cursor, table) for table in STATS_TABLES)
+            if not self._stats_enabled:
+                self.logger.warning("The stats tables are missing, they won't be updated. "
+                                    "Upgrade the schema with python -m sql.schema")
+        return self._stats_enabled
+
+    def _stats_before(self, track_ids: list):
+        """
+        Counts tracks out of the stats before a transaction writes them, see sql.aggregates.StatsDelta
+        Returns:
+            StatsDelta: to give to _stats_after once the tracks are written, None without stats tables
+        """
+        if not self.stats_enabled:
+            return None
+        stats = StatsDelta()
+        # the database is read even for tracks the id cache doesn't know: another connection may have written them
+        stats.add_tracks(self.cursor, track_ids, -1)
+        return stats
+
+    def _stats_after(self, stats: StatsDelta, track_ids: list):
+        """Counts the written tracks back in the stats, updating the stats tables by the difference"""
+        if stats is not None:
+            stats.add_tracks(self.cursor, track_ids, 1)
+            stats.apply(self.cursor, self.backend)
 
     def _insert_album(self, album: DbAlbum):
         """Inserts an album into the database"""
         if not self._already_exists("Album", album.id):
-            query = "INSERT INTO Album VALUES (%s, %s, %s)"
-            values = (album.id, album.year, album.name)
+            query = "INSERT INTO Album (id, year, name, url) VALUES (%s, %s, %s, %s)"
+            values = (album.id, album.year, album.name, album.url)
             self.cursor.execute(query, values)
+            self.id_cache.add("Album", album.id)
+        elif album.url:  # albums saved before urls were stored
+            self.cursor.execute("UPDATE Album SET url = %s WHERE id = %s AND url IS NULL", (album.url, album.id))
 
     def _insert_artist(self, artist:  DbArtist):
         """Insert an artist into the database"""
@@ -105,6 +459,7 @@ class DatabaseManager:
             query = "INSERT INTO Artist VALUES (%s, %s)"
             values = (artist.id, artist.name)
             self.cursor.execute(query, values)
+            self.id_cache.add("Artist", artist.id)
 
     def _insert_genre(self, genre: DbGenre):
         """Insert a genre into the database"""
@@ -112,89 +467,103 @@ class DatabaseManager:
             query = "INSERT INTO Genre VALUES (%s, %s)"
             values = (genre.id, genre.name)
             self.cursor.execute(query, values)
+            self.id_cache.add("Genre", genre.id)
 
     def _insert_tracks(self, tracks: list[DbTrack]):
         """Insert a track list into the database"""
-        self.cursor.execute("DESCRIBE Track")
-        cols = self.cursor.fetchall()
-        query = "INSERT INTO Track VALUES (" + "%s, " * (len(cols) - 1) + "%s)"
+        query = "INSERT INTO Track (id, album_id, title, duration) VALUES (%s, %s, %s, %s)"
         for db_track in tracks:
             if not self._already_exists("Track", db_track.id):
-                value = [db_track.id, db_track.album_id, db_track.title[:255], db_track.duration]
-                value += [None] * (len(cols) - len(value))
+                value = (db_track.id, db_track.album_id, db_track.title[:255], db_track.duration)
                 self.cursor.execute(query, value)
+                self.id_cache.add("Track", db_track.id)
 
     def _insert_album_artist(self, album_artist: DbAlbumArtist):
         """Insert an album-artist join row into the database"""
-        if not self._already_exists_join("AlbumArtist", "album_id", "artist_id",
-                                         album_artist.album_id, album_artist.artist_id):
+        values = (album_artist.album_id, album_artist.artist_id)
+        if not self._already_exists("AlbumArtist", values):
             query = "INSERT INTO AlbumArtist VALUES (%s, %s)"
-            values = (album_artist.album_id, album_artist.artist_id)
             self.cursor.execute(query, values)
+            self.id_cache.add("AlbumArtist", values)
 
     def _insert_genre_album(self, genre_album: DbGenreAlbum):
         """Insert a genre-album join row into the database"""
-        if not self._already_exists_join("GenreAlbum", "genre_id", "album_id",
-                                         genre_album.genre_id, genre_album.album_id):
+        values = (genre_album.genre_id, genre_album.album_id)
+        if not self._already_exists("GenreAlbum", values):
             query = "INSERT INTO GenreAlbum VALUES (%s, %s)"
-            values = (genre_album.genre_id, genre_album.album_id)
             self.cursor.execute(query, values)
+            self.id_cache.add("GenreAlbum", values)
 
-    def _already_exists(self, table_name: str, checked_id: str):
+    def _already_exists(self, table_name: str, key):
         """
-        Checks if a row already exists
+        Checks if a row already exists, in the id cache first, then in the database if the cache can't tell
         Args:
             table_name: table to search
-            checked_id: id to check
+            key: id to check, or tuple of the two ids of a join table row
 
         Returns:
             bool: Whether the row exists or not
 
         """
-        query = f"SELECT id FROM {table_name} WHERE id = '{checked_id}'"
-        self.cursor.execute(query)
-        return len(self.cursor.fetchall()) > 0
+        exists = self._cached_contains(table_name, key)
+        if exists is None:
+            self.cursor.execute(self._exists_query(table_name), key if isinstance(key, tuple) else (key,))
+            exists = self.cursor.fetchone() is not None
+            if exists:
+                self.id_cache.add(table_name, key)
+        return exists
 
-    def _already_exists_join(self, table_name: str, col1: str, col2: str, id1: str, id2: str):
-        """
-        Checks if a row already exists in a join table between two elements
-        Args:
-            table_name: table to search
-            col1: name of first column
-            col2: name of second column
-            id1: id of first element
-            id2: id of second element
+    def _exists_query(self, table_name: str):
+        condition = " AND ".join(f"{column} = %s" for column in self.KEY_COLUMNS[table_name])
+        return f"SELECT 1 FROM {table_name} WHERE {condition} LIMIT 1"
 
+    def _cached_contains(self, table_name: str, key):
+        """
+        Looks a row up in the id cache, loading the table's ids with a single query the first time
         Returns:
-            bool: Whether the row exists or not
+            bool: True if the row exists, False if it doesn't, None if the cache can't tell
         """
-        query = f"SELECT {col1}, {col2} FROM {table_name} WHERE {col1} = '{id1}' and {col2} = '{id2}'"
-        self.cursor.execute(query)
-        return len(self.cursor.fetchall()) > 0
+        if not self.id_cache.is_loaded(table_name):
+            self._load_ids(table_name)
+        return self.id_cache.contains(table_name, key)
+
+    def _load_ids(self, table_name: str):
+        """Loads the keys of a table in the id cache, streaming at most the size of the cache"""
+        columns = self.KEY_COLUMNS[table_name]
+        cursor = self.stream_cursor()
+        try:
+            # one more row than the cache can hold tells whether the table fits in it
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table_name} LIMIT %s", (self.id_cache.max_size + 1,))
+            self.id_cache.load(table_name, (row if len(columns) > 1 else row[0] for row in cursor))
+        finally:
+            cursor.close()
+        self.logger.debug(f"Loaded the ids of {table_name} in the id cache")
 
     @staticmethod
-    def _extract_album_data(album_dict: dict):
+    def _extract_album_data(album):
         """
         Creates instances of database objects that will make the db _insertion easier
         Args:
-            album_dict (dict): dictionary containing the following data:
-                'name': str
-                'artist': str
-                'url': str
-                'genre': str
-                'year': int
-                'tracks': list of dict {name (str), duration (int)}
+            album (scraping.records.ScrapedAlbum): album with the following attributes:
+                name: str
+                artist_name: str
+                artist_url: str
+                url: str
+                genre: str
+                year: int
+                tracks: tuple of ScrapedTrack (name (str), duration (int))
         Return:
             dict: Dictionary containing objects convenient for db formatting
         """
 
-        db_album = DbAlbum(album_dict["name"],
-                           album_dict["year"],
-                           album_dict["artist"]["name"],
-                           len(album_dict["tracks"]))
-        db_artist = DbArtist(album_dict["artist"]["name"])
-        db_tracks = [DbTrack(track["name"], track["duration"], db_album.id) for track in album_dict["tracks"]]
-        db_genre = DbGenre(album_dict["genre"])
+        db_album = DbAlbum(album.name,
+                           album.year,
+                           album.artist_name,
+                           len(album.tracks),
+                           album.url)
+        db_artist = DbArtist(album.artist_name)
+        db_tracks = DbTrack.for_album(album.tracks, db_album.id)
+        db_genre = DbGenre(album.genre)
         db_album_artist = DbAlbumArtist(db_album.id, db_artist.id)
         db_genre_album = DbGenreAlbum(db_genre.id, db_album.id)
 
@@ -1,41 +1,66 @@
-from utils import hash_tuple
+from utils import make_id, track_ids
 
 
 class DbAlbum:
-    def __init__(self, name: str, year: int, artist_name: str, n_tracks: int):
+    __slots__ = ("name", "year", "url", "id")
+
+    def __init__(self, name: str, year: int, artist_name: str, n_tracks: int, url: str = None):
         self.name = name
         self.year = year
-        self.id = hash_tuple((name.lower(), year, artist_name.lower(), n_tracks))
+        self.url = url  # discogs master url, not part of the id
+        self.id = make_id((name.lower(), year, artist_name.lower(), n_tracks))
 
 
 class DbArtist:
+    __slots__ = ("name", "id")
+
     def __init__(self, name: str):
         self.name = name
-        self.id = hash_tuple((name.lower()))
+        self.id = make_id((name.lower()))
 
 
 class DbGenre:
+    __slots__ = ("name", "id")
+
     def __init__(self, name: str):
         self.name = name
-        self.id = hash_tuple((name.lower()))
+        self.id = make_id((name.lower()))
 
 
 class DbTrack:
-    def __init__(self, title: str, duration: int, album_id: str):
+    __slots__ = ("title", "duration", "album_id", "id")
+
+    def __init__(self, title: str, duration: int, album_id: bytes, track_id: bytes = None):
         self.title = title
         self.duration = duration
         self.album_id = album_id
-        self.id = hash_tuple((title.lower(), duration, album_id))
+        self.id = track_id or track_ids([(title.lower(), duration)], album_id)[0]
+
+    @classmethod
+    def for_album(cls, tracks, album_id: bytes):
+        """
+        Tracks of an album, their ids being computed in one batch
+        Args:
+            tracks: (title, duration) tuples, e.g. scraping.records.ScrapedTrack
+            album_id (bytes): id of the album
+        """
+        tracks = list(tracks)
+        ids = track_ids([(title.lower(), duration) for title, duration in tracks], album_id)
+        return [cls(title, duration, album_id, track_id) for (title, duration), track_id in zip(tracks, ids)]
 
 
 # Join tables
 class DbAlbumArtist:
+    __slots__ = ("album_id", "artist_id")
+
     def __init__(self, album_id, artist_id):
         self.album_id = album_id
         self.artist_id = artist_id
 
 
 class DbGenreAlbum:
+    __slots__ = ("genre_id", "album_id")
+
     def __init__(self, genre_id, album_id):
         self.genre_id = genre_id
         self.album_id = album_id
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+
+
+class IdCache:
+    def __init__(self, max_size: int = 1_000_000):
+        """
+        Per-table cache of the primary keys known to be in the database, used to skip existence queries.
+
+        Each table is loaded once with a single query (see DatabaseManager), then kept up to date on insert.
+        When a table could be loaded entirely and nothing was evicted since, a miss means the row doesn't exist
+        and no query is needed. Otherwise only hits are certain and a miss has to be checked in the database.
+        Args:
+            max_size (int): maximum amount of keys kept per table, the least recently used being evicted.
+                            A 16 bytes id takes about 150 bytes in the cache
+        """
+        self.max_size = max_size
+        self._keys = {}  # table -> OrderedDict of keys, in least recently used order
+        self._complete = set()  # tables whose every key is in the cache
+        self.hits = {}
+        self.misses = {}
+
+    def is_loaded(self, table: str):
+        return table in self._keys
+
+    def load(self, table: str, keys):
+        """
+        Fills the cache of a table
+        Args:
+            table (str): table name
+            keys: keys of the table, at most max_size + 1 of them are read to know whether the table fits
+        """
+        cached = self._keys[table] = OrderedDict()
+        for key in keys:
+            if len(cached) == self.max_size:
+                break
+            cached[key] = None
+        else:
+            self._complete.add(table)
+
+    def contains(self, table: str, key):
+        """
+        Looks a key up
+        Returns:
+            bool: True if the key is in the table, False if it isn't, None if it has to be checked in the database
+        """
+        cached = self._keys[table]
+        if key in cached:
+            cached.move_to_end(key)
+            self.hits[table] = self.hits.get(table, 0) + 1
+            return True
+        self.misses[table] = self.misses.get(table, 0) + 1
+        return False if table in self._complete else None
+
+    def add(self, table: str, key):
+        """Records a key inserted in or found in the table"""
+        cached = self._keys.setdefault(table, OrderedDict())
+        cached[key] = None
+        cached.move_to_end(key)
+        if len(cached) > self.max_size:
+            cached.popitem(last=False)
+            self._complete.discard(table)
+
+    def clear(self):
+        """Forgets every key, e.g. after a rolled back transaction whose inserts were recorded"""
+        self._keys.clear()
+        self._complete.clear()
+
+    @property
+    def stats(self):
+        """Hits and misses per table"""
+        return {table: {"hits": self.hits.get(table, 0), "misses": self.misses.get(table, 0)}
+                for table in sorted(set(self.hits) | set(self.misses))}
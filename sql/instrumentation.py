@@ -0,0 +1,172 @@
+import json
+import logging
+import re
+import time
+from array import array
+from functools import lru_cache
+from threading import Lock
+
+import numpy as np
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"%s(?:\s*,\s*%s)+")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def statement_template(query: str):
+    """
+    Template of a statement: literals replaced by %s, placeholder lists collapsed and spaces normalized,
+    so that the executions of a statement with different values or amounts of values are counted together
+    """
+    query = _STRING_LITERAL.sub("%s", query)
+    query = _NUMBER_LITERAL.sub("%s", query)
+    query = _PLACEHOLDER_LIST.sub("%s, ...", query)
+    return _SPACES.sub(" ", query).strip()
+
+
+class QueryStats:
+    def __init__(self, slow_threshold: float = 0.5):
+        """
+        Execution statistics of the SQL statements, per statement template.
+        One instance is shared by all the connections of the process, it is thread-safe.
+        Args:
+            slow_threshold (float): seconds above which a statement is logged, None to disable the slow query log
+        """
+        self.logger = logging.getLogger(__name__)
+        self.slow_threshold = slow_threshold
+        self.albums = 0  # albums saved, to compute round trips per album
+        self._templates = {}
+        self._lock = Lock()
+
+    def record(self, query: str, elapsed: float, rows: int, round_trips: int, args=None):
+        """
+        Records an execution
+        Args:
+            query (str): executed statement
+            elapsed (float): seconds
+            rows (int): rows affected or returned as reported by the cursor, -1 if unknown
+            round_trips (int): requests sent to the database server
+            args: statement arguments, shown in the slow query log
+        """
+        template = statement_template(query)
+        with self._lock:
+            stats = self._templates.get(template)
+            if stats is None:
+                stats = self._templates[template] = {"count": 0, "round_trips": 0, "rows": 0, "latencies": array("d")}
+            stats["count"] += 1
+            stats["round_trips"] += round_trips
+            stats["rows"] += max(rows, 0)
+            stats["latencies"].append(elapsed)
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            shown_args = repr(args)
+            if len(shown_args) > 200:
+                shown_args = shown_args[:200] + "..."
+            self.logger.warning(f"Slow statement ({elapsed:.3f}s): {template} with {shown_args}")
+
+    def add_albums(self, count: int):
+        with self._lock:
+            self.albums += count
+
+    def summary(self):
+        """
+        Returns:
+            dict: totals, and statistics of each statement template sorted by total time
+        """
+        with self._lock:
+            templates = {template: dict(stats, latencies=np.array(stats["latencies"]))
+                         for template, stats in self._templates.items()}
+            albums = self.albums
+        statements = []
+        for template, stats in templates.items():
+            latencies = stats["latencies"]
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            statements.append({
+                "template": template,
+                "count": stats["count"],
+                "round_trips": stats["round_trips"],
+                "rows": stats["rows"],
+                "total_s": float(latencies.sum()),
+                "mean_ms": float(latencies.mean() * 1000),
+                "p50_ms": float(p50 * 1000),
+                "p95_ms": float(p95 * 1000),
+                "p99_ms": float(p99 * 1000),
+                "max_ms": float(latencies.max() * 1000),
+            })
+        statements.sort(key=lambda statement: statement["total_s"], reverse=True)
+        round_trips = sum(statement["round_trips"] for statement in statements)
+        return {
+            "statements": sum(statement["count"] for statement in statements),
+            "round_trips": round_trips,
+            "total_s": sum(statement["total_s"] for statement in statements),
+            "albums": albums,
+            "round_trips_per_album": round_trips / albums if albums else None,
+            "templates": statements,
+        }
+
+    def log_summary(self, top: int = 15):
+        """Logs the totals and a table of the statement templates taking the most time"""
+        summary = self.summary()
+        if not summary["statements"]:
+            return
+        per_album = (f", {summary['round_trips_per_album']:.1f} per album" if summary["round_trips_per_album"]
+                     else "")
+        lines = [f"SQL: {summary['statements']} statements, {summary['round_trips']} round trips{per_album}, "
+                 f"{summary['total_s']:.2f}s",
+                 f"{'count':>8} {'trips':>8} {'rows':>9} {'total s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  "
+                 f"statement"]
+        for statement in summary["templates"][:top]:
+            lines.append(f"{statement['count']:>8} {statement['round_trips']:>8} {statement['rows']:>9} "
+                         f"{statement['total_s']:>8.2f} {statement['p50_ms']:>8.2f} {statement['p95_ms']:>8.2f} "
+                         f"{statement['p99_ms']:>8.2f}  {statement['template'][:100]}")
+        self.logger.info("\n".join(lines))
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._templates.clear()
+            self.albums = 0
+
+
+# Statistics of all the connections of the process
+query_stats = QueryStats()
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, stats: QueryStats = None):
+        """
+        Cursor wrapper timing every statement in a QueryStats.
+        Only execute and executemany are timed: rows fetched later by a streaming cursor are not.
+        Args:
+            cursor: pymysql cursor, or cursor of sql.backends
+            stats (QueryStats): collector, the process-wide query_stats by default
+        """
+        self._cursor = cursor
+        self.stats = stats or query_stats
+
+    def execute(self, query: str, args=None):
+        start = time.perf_counter()
+        result = self._cursor.execute(query, args) if args is not None else self._cursor.execute(query)
+        self.stats.record(query, time.perf_counter() - start, self._cursor.rowcount, 1, args)
+        return result
+
+    def executemany(self, query: str, args):
+        args = args if isinstance(args, (list, tuple)) else list(args)
+        start = time.perf_counter()
+        result = self._cursor.executemany(query, args)
+        # pymysql sends an INSERT ... VALUES as one multi-row statement, and anything else row by row
+        round_trips = 1 if query.lstrip().upper().startswith("INSERT") else len(args)
+        self.stats.record(query, time.perf_counter() - start, self._cursor.rowcount, round_trips,
+                          args[:3] if args else args)
+        return result
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        # fetchone, fetchmany, fetchall, close, rowcount...
+        return getattr(self._cursor, name)
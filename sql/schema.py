@@ -0,0 +1,280 @@
+import argparse
+import logging
+import re
+from datetime import datetime
+
+from .aggregates import STATS_TABLES, compute_stats
+
+# SQLite plan step reading a whole table: "SCAN Track" or "SCAN Track AS t", but not "SCAN t USING INDEX ...",
+# "SCAN t USING COVERING INDEX ..." or "SCAN CONSTANT ROW"
+_SQLITE_FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)\S+(?: AS \S+)?$")
+
+FEATURE_COLUMNS = ("danceability", "energy", "loudness", "speechiness", "acousticness", "instrumentalness",
+                   "valence", "tempo")
+
+# Table definitions, valid for MySQL and SQLite
+TABLES = {
+    "Album": """
+        id binary(16) PRIMARY KEY,
+        year int,
+        name varchar(255),
+        url varchar(255)""",
+    "Artist": """
+        id binary(16) PRIMARY KEY,
+        name varchar(255)""",
+    "Genre": """
+        id binary(16) PRIMARY KEY,
+        name varchar(255)""",
+    "Track": f"""
+        id binary(16) PRIMARY KEY,
+        album_id binary(16),
+        title varchar(255),
+        duration int,
+        {', '.join(f'{column} float' for column in FEATURE_COLUMNS[:-1])},
+        tempo int,
+        FOREIGN KEY (album_id) REFERENCES Album (id)""",
+    "AlbumArtist": """
+        album_id binary(16),
+        artist_id binary(16),
+        PRIMARY KEY (album_id, artist_id),
+        FOREIGN KEY (album_id) REFERENCES Album (id),
+        FOREIGN KEY (artist_id) REFERENCES Artist (id)""",
+    "GenreAlbum": """
+        genre_id binary(16),
+        album_id binary(16),
+        PRIMARY KEY (genre_id, album_id),
+        FOREIGN KEY (genre_id) REFERENCES Genre (id),
+        FOREIGN KEY (album_id) REFERENCES Album (id)""",
+    "GenreYearStats": """
+        genre_id binary(16),
+        year int,
+        feature varchar(32),
+        n bigint,
+        total double,
+        total_sq double,
+        PRIMARY KEY (genre_id, year, feature)""",
+    "ArtistStats": """
+        artist_id binary(16),
+        feature varchar(32),
+        n bigint,
+        total double,
+        total_sq double,
+        PRIMARY KEY (artist_id, feature)""",
+}
+# Id columns, 16 bytes digests (see utils/ids.py)
+ID_COLUMNS = [("Album", "id"), ("Artist", "id"), ("Genre", "id"), ("Track", "id"), ("Track", "album_id"),
+              ("AlbumArtist", "album_id"), ("AlbumArtist", "artist_id"), ("GenreAlbum", "genre_id"),
+              ("GenreAlbum", "album_id"), ("GenreYearStats", "genre_id"), ("ArtistStats", "artist_id")]
+# (table, column, referenced table)
+FOREIGN_KEYS = [("Track", "album_id", "Album"), ("AlbumArtist", "album_id", "Album"),
+                ("AlbumArtist", "artist_id", "Artist"), ("GenreAlbum", "genre_id", "Genre"),
+                ("GenreAlbum", "album_id", "Album")]
+# Secondary indexes: name -> (table, columns)
+INDEXES = {
+    "idx_track_album": ("Track", "album_id"),  # tracks of an album, and the Track -> Album join of get_tracks
+    "idx_album_artist_artist": ("AlbumArtist", "artist_id"),  # albums of an artist, the primary key starts by album
+    "idx_genre_album_album": ("GenreAlbum", "album_id, genre_id"),  # genres of an album, for the stats joins
+}
+# Index of the tracks without audio features, read by iter_tracks(missing_features=True).
+# SQLite indexes only these rows. MySQL has no partial indexes: the features are written all at once, so the
+# tracks without danceability are looked up and read in id order from an index on (danceability, id).
+MISSING_FEATURES_INDEX = "idx_track_missing_features"
+
+
+def _table_definition(backend, table: str):
+    """Definition of a table for a backend: SQLite would give binary(16) columns a numeric affinity, they are blobs"""
+    return TABLES[table].replace("binary(16)", "blob") if backend.name == "sqlite" else TABLES[table]
+
+
+def _create_music_tables(backend, cursor):
+    for table in ("Album", "Artist", "Genre", "Track", "AlbumArtist", "GenreAlbum"):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({_table_definition(backend, table)})")
+
+
+def _add_album_url(backend, cursor):
+    if "url" not in backend.table_columns(cursor, "Album"):
+        cursor.execute("ALTER TABLE Album ADD COLUMN url varchar(255)")
+
+
+def _add_join_primary_keys(backend, cursor):
+    """Same as add_join_primary_keys.sql. SQLite databases always had them, and can't add a primary key."""
+    if backend.name != "mysql":
+        return
+    for table, columns in (("AlbumArtist", "album_id, artist_id"), ("GenreAlbum", "genre_id, album_id")):
+        if backend.has_index(cursor, table, "PRIMARY"):
+            continue
+        cursor.execute(f"CREATE TABLE {table}_dedup AS SELECT DISTINCT {columns} FROM {table}")
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"INSERT INTO {table} SELECT {columns} FROM {table}_dedup")
+        cursor.execute(f"DROP TABLE {table}_dedup")
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({columns})")
+
+
+def _create_stats_tables(backend, cursor):
+    """Stats tables of sql/aggregates.py, filled from the existing tracks"""
+    # ids still in hex are converted with the others by _binary_ids
+    hex_ids = backend.name == "mysql" and _mysql_column_type(cursor, "Album", "id") != "binary"
+    for table, group in STATS_TABLES.items():
+        definition = _table_definition(backend, table)
+        if hex_ids:
+            definition = definition.replace("binary(16)", "varchar(255)")
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition})")
+    cursor.execute(f"SELECT 1 FROM {next(iter(STATS_TABLES))} LIMIT 1")
+    if cursor.fetchone() is None:  # not filled by python -m sql.aggregates already
+        for table, rows in compute_stats(cursor).items():
+            columns = STATS_TABLES[table] + ("feature", "n", "total", "total_sq")
+            cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) "
+                               f"VALUES ({', '.join(['%s'] * len(columns))})",
+                               [key + values for key, values in sorted(rows.items())])
+
+
+def _create_indexes(backend, cursor):
+    indexes = dict(INDEXES)
+    if backend.name == "mysql":
+        indexes[MISSING_FEATURES_INDEX] = ("Track", "danceability, id")
+    for name, (table, columns) in indexes.items():
+        if not backend.has_index(cursor, table, name):
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    if backend.name == "sqlite" and not backend.has_index(cursor, "Track", MISSING_FEATURES_INDEX):
+        condition = " AND ".join(f"{column} IS NULL" for column in FEATURE_COLUMNS)
+        cursor.execute(f"CREATE INDEX {MISSING_FEATURES_INDEX} ON Track (id) WHERE {condition}")
+
+
+def _binary_ids(backend, cursor):
+    """
+    Converts the 32 characters hex ids of the databases created before to their 16 bytes, in place.
+    Ids are half as long in every index, and the joins compare 16 bytes instead of 32 characters strings.
+    """
+    if backend.name == "mysql":
+        hex_columns = [(table, column) for table, column in ID_COLUMNS
+                       if _mysql_column_type(cursor, table, column) != "binary"]
+        if not hex_columns:
+            return
+        # Foreign keys can't span columns of different types, they are created again once every column is converted
+        cursor.execute("SELECT DISTINCT TABLE_NAME, CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL")
+        for table, constraint in cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {constraint}")
+        for table, column in hex_columns:
+            # varbinary keeps the characters of the hex ids as bytes, that UNHEX can then decode
+            cursor.execute(f"ALTER TABLE {table} MODIFY {column} varbinary(255)")
+            cursor.execute(f"UPDATE {table} SET {column} = UNHEX({column}) WHERE LENGTH({column}) = 32")
+            cursor.execute(f"ALTER TABLE {table} MODIFY {column} binary(16)")
+        for table, column, referenced in FOREIGN_KEYS:
+            cursor.execute(f"ALTER TABLE {table} ADD FOREIGN KEY ({column}) REFERENCES {referenced} (id)")
+    else:
+        # SQLite columns take any type: the ids are converted and the declared types stay as they were.
+        # Foreign keys are only checked at commit, once every column is converted.
+        backend.connection.create_function("unhex", 1, bytes.fromhex, deterministic=True)
+        cursor.execute("PRAGMA defer_foreign_keys = ON")
+        for table, column in ID_COLUMNS:
+            cursor.execute(f"UPDATE {table} SET {column} = unhex({column}) WHERE typeof({column}) = 'text'")
+
+
+def _mysql_column_type(cursor, table: str, column: str):
+    cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+    return cursor.fetchone()[0]
+
+
+# Schema versions, in order. Each migration checks what already exists, so that databases created by the .sql files
+# before the schema was versioned are brought up to date from version 0.
+MIGRATIONS = [
+    (1, "music tables", _create_music_tables),
+    (2, "album urls", _add_album_url),
+    (3, "join tables primary keys", _add_join_primary_keys),
+    (4, "stats tables", _create_stats_tables),
+    (5, "secondary indexes", _create_indexes),
+    (6, "binary ids", _binary_ids),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(backend, cursor):
+    """Version of the schema of a database, 0 if it isn't versioned yet"""
+    if not backend.has_table(cursor, "SchemaVersion"):
+        return 0
+    cursor.execute("SELECT MAX(version) FROM SchemaVersion")
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(backend, target: int = LATEST_VERSION):
+    """
+    Creates or upgrades the tables of a database, one committed migration at a time
+    Args:
+        backend: storage backend of sql.backends
+        target (int): version to upgrade to
+
+    Returns:
+        int: version of the schema
+    """
+    logger = logging.getLogger(__name__)
+    cursor = backend.cursor()
+    try:
+        cursor.execute("CREATE TABLE IF NOT EXISTS SchemaVersion "
+                       "(version int PRIMARY KEY, description varchar(255), applied_at varchar(32))")
+        version = current_version(backend, cursor)
+        for migration_version, description, upgrade in MIGRATIONS:
+            if version < migration_version <= target:
+                logger.info(f"Migrating the {backend.name} schema to version {migration_version}: {description}")
+                upgrade(backend, cursor)
+                cursor.execute("INSERT INTO SchemaVersion VALUES (%s, %s, %s)",
+                               (migration_version, description, datetime.now().isoformat(timespec="seconds")))
+                backend.connection.commit()
+                version = migration_version
+        return version
+    finally:
+        cursor.close()
+
+
+def explain_report(dbmanager):
+    """
+    Query plans of the queries DatabaseManager issues, with EXPLAIN on MySQL and EXPLAIN QUERY PLAN on SQLite
+    Args:
+        dbmanager (DatabaseManager): database to inspect
+
+    Returns:
+        list: (query name, plan rows as dicts, whether a table is fully scanned) tuples
+    """
+    explain = "EXPLAIN QUERY PLAN" if dbmanager.backend.name == "sqlite" else "EXPLAIN"
+    cursor = dbmanager.cursor
+    report = []
+    for name, (query, args) in dbmanager.sample_queries().items():
+        cursor.execute(f"{explain} {query}", args)
+        columns = [column[0] for column in cursor.description]
+        plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        if dbmanager.backend.name == "sqlite":
+            full_scan = any(_SQLITE_FULL_SCAN.match(step["detail"]) for step in plan)
+        else:  # whole table, or whole index
+            full_scan = any(step["type"] in ("ALL", "index") for step in plan)
+        report.append((name, plan, full_scan))
+    return report
+
+
+def _print_report(report: list):
+    for name, plan, full_scan in report:
+        print(f"{name}{'  [FULL SCAN]' if full_scan else ''}")
+        for step in plan:
+            if "detail" in step:
+                print(f"    {step['detail']}")
+            else:
+                print(f"    {step['table']}: {step['type']} key={step['key']} rows={step['rows']} {step['Extra'] or ''}")
+    print(f"{sum(full_scan for _, _, full_scan in report)}/{len(report)} queries scan a whole table")
+
+
+if __name__ == "__main__":
+    from .database_manager import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Creates or upgrades the music database schema")
+    parser.add_argument("--explain", action="store_true",
+                        help="report the query plans of the queries of DatabaseManager instead")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    db = DatabaseManager()
+    try:
+        if args.explain:
+            _print_report(explain_report(db))
+        else:
+            print(f"Schema version {migrate(db.backend)}")
+    finally:
+        db.close()
@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import shutil
+from array import array
+
+import numpy as np
+
+from utils import id_to_hex
+from .database_manager import DatabaseManager
+
+FORMAT_VERSION = 1
+NULL_CODE = -1
+# Kind of each exported column. "float" columns are stored as float64, NULL being NaN. Other columns are
+# dictionary-encoded as int32 codes, NULL being -1: id columns of the same entity ("album", "artist", ...) share
+# a dictionary, so that their codes can be joined directly, and each text column has its own.
+SNAPSHOT_TABLES = {
+    "Album": {"id": "album", "year": "float", "name": "text", "url": "text"},
+    "Artist": {"id": "artist", "name": "text"},
+    "Genre": {"id": "genre", "name": "text"},
+    "Track": {"id": "track", "album_id": "album", "title": "text", "duration": "float",
+              **{feature: "float" for feature in DatabaseManager.FEATURE_COLUMNS}},
+    "AlbumArtist": {"album_id": "album", "artist_id": "artist"},
+    "GenreAlbum": {"genre_id": "genre", "album_id": "album"},
+}
+
+
+def export_snapshot(dbmanager: DatabaseManager, directory: str, part_rows: int = 1_000_000):
+    """
+    Exports the music tables to a columnar snapshot of .npy files, or adds the changes since the last export.
+
+    Each table is a list of parts, each part a directory holding one .npy file per column. An export adds
+    the new rows of each table as new parts. A previous part with rows updated since (e.g. tracks which got
+    their Spotify features) is copied to a new part with the updates, the previous one is left untouched.
+    Dictionaries only grow. The manifest is written last and switches to the new parts at once, so an
+    interrupted export leaves the previous snapshot readable. The replaced parts are deleted afterwards.
+
+    An export is not incremental on the database side: every table is read entirely to find the new and the
+    updated rows, and the key codes of all the exported rows of a table are kept in memory meanwhile.
+    Args:
+        dbmanager (DatabaseManager): database to export, each table is read once with a streaming cursor
+        directory (str): snapshot directory, created if needed
+        part_rows (int): maximum rows per part, bounds the memory used by the export
+    """
+    logger = logging.getLogger(__name__)
+    os.makedirs(directory, exist_ok=True)
+    manifest = _read_manifest(directory) or {"version": FORMAT_VERSION, "tables": {}}
+    dictionaries = {}
+    replaced = []
+    for table, kinds in SNAPSHOT_TABLES.items():
+        exporter = _TableExporter(directory, table, kinds, manifest["tables"].setdefault(table, {"parts": []}),
+                                  dictionaries, part_rows)
+        cursor = dbmanager.stream_cursor()
+        try:
+            cursor.execute(f"SELECT {', '.join(kinds)} FROM {table}")
+            for row in cursor:
+                exporter.add(row)
+        finally:
+            cursor.close()
+        replaced += exporter.close()
+        logger.info(f"Exported {table}: {exporter.appended} new rows, {exporter.updated} updated rows")
+    for name, dictionary in dictionaries.items():
+        dictionary.save()
+    manifest["dictionaries"] = {name: len(dictionary) for name, dictionary in dictionaries.items()}
+    _write_json(os.path.join(directory, "manifest.json"), manifest)
+    for part_directory in replaced:
+        shutil.rmtree(part_directory, ignore_errors=True)
+
+
+class Snapshot:
+    def __init__(self, directory: str):
+        """
+        Reads a snapshot written by export_snapshot. Columns are memory-mapped, so they are only read from disk
+        when accessed and take no memory of their own.
+        Args:
+            directory (str): snapshot directory
+        """
+        self.directory = directory
+        self.manifest = _read_manifest(directory)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No snapshot in {directory}")
+        self._dictionaries = {}
+
+    @property
+    def tables(self):
+        return list(self.manifest["tables"])
+
+    def rows(self, table: str):
+        return sum(part["rows"] for part in self.manifest["tables"][table]["parts"])
+
+    def parts(self, table: str, column: str):
+        """
+        Columns of each part of a table, memory-mapped
+        Returns:
+            list: np.memmap of each part
+        """
+        return [np.load(os.path.join(self.directory, table, part["name"], f"{column}.npy"), mmap_mode="r")
+                for part in self.manifest["tables"][table]["parts"]]
+
+    def column(self, table: str, column: str):
+        """
+        Whole column of a table: float values, or dictionary codes for the other kinds (see decode)
+        A table exported in one go is a single part, whose column is returned without any copy.
+        Returns:
+            np.ndarray
+        """
+        parts = self.parts(table, column)
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return np.empty(0, np.float64 if SNAPSHOT_TABLES[table][column] == "float" else np.int32)
+        return np.concatenate(parts)
+
+    def dictionary(self, table: str, column: str):
+        """
+        Values of the dictionary of an encoded column, indexed by code
+        Returns:
+            np.ndarray: str objects
+        """
+        name = _dictionary_name(table, column)
+        if name not in self._dictionaries:
+            size = self.manifest["dictionaries"].get(name, 0)
+            self._dictionaries[name] = np.array(_Dictionary(self.directory, name).values[:size], dtype=object)
+        return self._dictionaries[name]
+
+    def decode(self, table: str, column: str):
+        """
+        Values of an encoded column
+        Returns:
+            np.ndarray: str objects, None for NULL
+        """
+        codes = self.column(table, column)
+        values = np.append(self.dictionary(table, column), None)  # code -1 gives the last item, None
+        return values[codes]
+
+
+class _TableExporter:
+    def __init__(self, directory: str, table: str, kinds: dict, table_manifest: dict, dictionaries: dict,
+                 part_rows: int):
+        """Appends the new rows of a table to a snapshot, and copies the parts whose rows changed"""
+        self.directory = directory
+        self.table = table
+        self.kinds = kinds
+        self.manifest = table_manifest
+        self.part_rows = part_rows
+        self.columns = list(kinds)
+        self.dictionaries = [dictionaries.setdefault(_dictionary_name(table, column),
+                                                     _Dictionary(directory, _dictionary_name(table, column)))
+                             if kind != "float" else None for column, kind in kinds.items()]
+        self.key_size = len(DatabaseManager.KEY_COLUMNS[table])
+        self.appended = self.updated = 0
+        self._buffers = self._new_buffers()
+
+        # Rows already exported, by key codes
+        parts = [self._load_part(part, "r") for part in self.manifest["parts"]]
+        key_columns = [np.concatenate([part[column] for part in parts]) if parts else np.empty(0, np.int32)
+                       for column in self.columns[:self.key_size]]
+        if self.key_size == 1:
+            # Global row index of each key code, to find the row to update
+            self._positions = dict(zip(key_columns[0].tolist(), range(len(key_columns[0]))))
+            self._part_starts = np.cumsum([0] + [part["rows"] for part in self.manifest["parts"]])
+            self._parts = parts
+            self._copies = {}  # part index -> in memory copy of the part, with the updates
+        else:  # join table, rows are only added
+            self._positions = set(zip(*(column.tolist() for column in key_columns)))
+
+    def add(self, row: tuple):
+        """Adds a row read from the database"""
+        encoded = [self._encode(i, value) for i, value in enumerate(row)]
+        if self.key_size == 1:
+            position = self._positions.get(encoded[0])
+            if position is not None:
+                self._update(position, encoded)
+                return
+        else:
+            key = tuple(encoded)
+            if key in self._positions:
+                return
+            self._positions.add(key)
+        for buffer, value in zip(self._buffers, encoded):
+            buffer.append(value)
+        self.appended += 1
+        if len(self._buffers[0]) >= self.part_rows:
+            self._write_part()
+
+    def close(self):
+        """
+        Writes the last new rows and the updated parts, under new names referenced by the manifest only
+        Returns:
+            list: directories of the parts replaced, to delete once the manifest is written
+        """
+        if len(self._buffers[0]):
+            self._write_part()
+        replaced = []
+        for part_index, columns in sorted(getattr(self, "_copies", {}).items()):
+            part = self.manifest["parts"][part_index]
+            base, _, generation = part["name"].partition(".")
+            name = f"{base}.{int(generation or 0) + 1}"
+            part_directory = os.path.join(self.directory, self.table, name)
+            os.makedirs(part_directory, exist_ok=True)
+            for column, values in columns.items():
+                np.save(os.path.join(part_directory, f"{column}.npy"), values)
+            replaced.append(os.path.join(self.directory, self.table, part["name"]))
+            part["name"] = name
+        return replaced
+
+    def _encode(self, i: int, value):
+        if self.dictionaries[i] is None:
+            return float("nan") if value is None else float(value)
+        if isinstance(value, bytes):  # ids are stored in their hex form
+            value = id_to_hex(value)
+        return NULL_CODE if value is None else self.dictionaries[i].encode(value)
+
+    def _update(self, position: int, encoded: list):
+        """Updates an exported row whose values changed, in a copy of its part"""
+        part_index = int(np.searchsorted(self._part_starts, position, side="right")) - 1
+        index = position - self._part_starts[part_index]
+        part = self._copies.get(part_index, self._parts[part_index])
+        changed = False
+        for column, value in zip(self.columns[1:], encoded[1:]):
+            stored = part[column][index]
+            if stored != value and not (value != value and stored != stored):  # NaN are equal here
+                if part_index not in self._copies:
+                    part = self._copies[part_index] = {name: np.array(values) for name, values in part.items()}
+                part[column][index] = value
+                changed = True
+        self.updated += changed
+
+    def _new_buffers(self):
+        return [array("d") if dictionary is None else array("i") for dictionary in self.dictionaries]
+
+    def _write_part(self):
+        name = f"part-{len(self.manifest['parts']):05d}"
+        part_directory = os.path.join(self.directory, self.table, name)
+        os.makedirs(part_directory, exist_ok=True)
+        for column, buffer in zip(self.columns, self._buffers):
+            dtype = np.float64 if buffer.typecode == "d" else np.int32
+            np.save(os.path.join(part_directory, f"{column}.npy"), np.frombuffer(buffer, dtype=dtype))
+        self.manifest["parts"].append({"name": name, "rows": len(self._buffers[0])})
+        self._buffers = self._new_buffers()
+
+    def _load_part(self, part: dict, mode: str):
+        return {column: np.load(os.path.join(self.directory, self.table, part["name"], f"{column}.npy"),
+                                mmap_mode=mode)
+                for column in self.columns}
+
+
+class _Dictionary:
+    def __init__(self, directory: str, name: str):
+        """
+        Append-only dictionary of strings, the code of a string being its index.
+        Stored as the concatenated utf-8 bytes of the strings and their offsets, two .npy files.
+        """
+        self.path = os.path.join(directory, "dictionaries", name)
+        self.values = []
+        if os.path.exists(self.path + ".offsets.npy"):
+            data = np.load(self.path + ".bytes.npy", mmap_mode="r")
+            offsets = np.load(self.path + ".offsets.npy")
+            data = data.tobytes()
+            self.values = [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        self._codes = None
+        self._saved = len(self.values)
+
+    def encode(self, value: str):
+        if self._codes is None:
+            self._codes = {value: code for code, value in enumerate(self.values)}
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def save(self):
+        if len(self.values) == self._saved:
+            return
+        encoded = [value.encode("utf-8") for value in self.values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _save_atomic(self.path + ".bytes.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        _save_atomic(self.path + ".offsets.npy", offsets)
+        self._saved = len(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def _dictionary_name(table: str, column: str):
+    kind = SNAPSHOT_TABLES[table][column]
+    return kind if kind != "text" else f"{table}.{column}"
+
+
+def _read_manifest(directory: str):
+    path = os.path.join(directory, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest['version']}")
+    return manifest
+
+
+def _save_atomic(path: str, values: np.ndarray):
+    """Writes a .npy file through a temporary file, readers never see a partial file"""
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, values)
+    os.replace(path + ".tmp", path)
+
+
+def _write_json(path: str, data: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    # Summary of a snapshot: python -m sql.snapshot snapshot_dir
+    import sys
+
+    snapshot = Snapshot(sys.argv[1])
+    for snapshot_table in snapshot.tables:
+        print(f"{snapshot_table:<12}{snapshot.rows(snapshot_table):>10} rows"
+              f"{len(snapshot.manifest['tables'][snapshot_table]['parts']):>4} parts")
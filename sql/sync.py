@@ -0,0 +1,49 @@
+import argparse
+import logging
+
+from .aggregates import rebuild_stats
+from .backends import MySQLBackend, SQLiteBackend
+from .database_manager import DatabaseManager
+
+
+def sync(source: DatabaseManager, target: DatabaseManager, batch_size: int = 5000):
+    """
+    Copies the rows of the source database that are missing from the target, e.g. from a local SQLite file
+    filled by a scrape to the MySQL server. Rows already in the target are left as they are,
+    and the target's stats tables are rebuilt.
+    Args:
+        source (DatabaseManager): database to read
+        target (DatabaseManager): database to complete
+        batch_size (int): rows written per transaction
+    """
+    logger = logging.getLogger(__name__)
+    for table in DatabaseManager.BULK_COLUMNS:  # parents first, for the foreign keys
+        columns = source.backend.table_columns(source.cursor, table)
+        query = target.backend.insert_ignore(table, columns)
+        cursor = source.stream_cursor()
+        count = 0
+        try:
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            while rows := cursor.fetchmany(batch_size):
+                target.cursor.executemany(query, rows)
+                target.connection.commit()
+                count += len(rows)
+        finally:
+            cursor.close()
+        logger.info(f"Synced {count} rows of {table}")
+    if target.stats_enabled:  # the copied tracks are not in the target's stats yet
+        rebuild_stats(target)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copies a local SQLite music database to the MySQL server")
+    parser.add_argument("path", help="SQLite database file")
+    parser.add_argument("-b", "--batch-size", type=int, default=5000, help="rows per transaction (default: 5000)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    sqlite_db, mysql_db = DatabaseManager(SQLiteBackend(args.path)), DatabaseManager(MySQLBackend())
+    try:
+        sync(sqlite_db, mysql_db, args.batch_size)
+    finally:
+        sqlite_db.close()
+        mysql_db.close()
@@ -0,0 +1,59 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .connection_pool import ConnectionPool
+from .db_objects import DbAlbum
+
+
+class ParallelWriter:
+    def __init__(self, n_workers: int = 4, pool: ConnectionPool = None):
+        """
+        Saves albums on several connections at once, so that the database saving is not bound by the latency
+        of a single connection.
+
+        Each batch is split by album id into n_workers partitions written concurrently, each on its own connection
+        and in its own transaction. An album is always in a single partition, so two transactions never insert
+        the same album and tracks; their shared artists and genres are inserted in key order, which avoids deadlocks.
+        Args:
+            n_workers (int): concurrent transactions
+            pool (ConnectionPool): connections to use, a pool of n_workers connections by default
+        """
+        self.logger = logging.getLogger(__name__)
+        self.n_workers = n_workers
+        self.pool = pool or ConnectionPool(n_workers)
+        self._owns_pool = pool is None
+        self._executor = ThreadPoolExecutor(n_workers, thread_name_prefix="db-writer")
+
+    def insert_albums(self, albums: list):
+        """
+        Inserts albums, returning once every partition is committed, like DatabaseManager.insert_albums
+        Args:
+            albums (list): scraping.records.ScrapedAlbum to insert
+        """
+        partitions = [[] for _ in range(self.n_workers)]
+        for album in albums:
+            partitions[self._partition(album)].append(album)
+        futures = [self._executor.submit(self._write, partition) for partition in partitions if partition]
+        errors = [future.exception() for future in futures]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise errors[0]
+
+    def _partition(self, album):
+        album_id = DbAlbum(album.name, album.year, album.artist_name, len(album.tracks)).id
+        return int.from_bytes(album_id[:4], "big") % self.n_workers
+
+    def _write(self, albums: list):
+        with self.pool.connection() as dbmanager:
+            dbmanager.insert_albums(albums)
+
+    def close(self):
+        self._executor.shutdown()
+        if self._owns_pool:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,30 @@
+import glob
+import os
+
+import pytest
+
+from scraping.parsers import Bs4Parser, LxmlParser
+
+pytest.importorskip("lxml")
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures", "*.html")))
+
+
+def _parse(parser, path: str):
+    """Parses a fixture with the parse method of its kind of page: search_*.html or master_*.html"""
+    with open(path, encoding="utf-8") as f:
+        page = f.read()
+    if os.path.basename(path).startswith("search"):
+        return parser.parse_albums_page(page)
+    return parser.parse_album_page(page)
+
+
+def test_fixtures_found():
+    assert FIXTURES
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_backends_parity(path):
+    bs4_result = _parse(Bs4Parser(), path)
+    assert bs4_result  # an empty result would make the comparison pointless
+    assert _parse(LxmlParser(), path) == bs4_result
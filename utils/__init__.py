@@ -1,2 +1,4 @@
 from .timeconvertor import minutes_sec_2_sec
 from .hashing import hash_tuple
+from .known_set import SortedHashSet
+from .ids import make_id, track_ids, id_to_hex, id_from_hex
@@ -3,6 +3,7 @@ from hashlib import md5
 
 
 def hash_tuple(t):
-    bytez = pickle.dumps(t)
+    # the protocol is pinned so that ids don't change with python's default protocol, see utils.ids
+    bytez = pickle.dumps(t, protocol=4)
     hashed = md5(bytez)
     return hashed.hexdigest()
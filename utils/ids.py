@@ -0,0 +1,110 @@
+import os
+import pickle
+import struct
+from functools import lru_cache
+from hashlib import blake2b, md5
+
+COMPAT = "compat"  # md5 of the pickled key, the ids of the existing databases
+FAST = "fast"  # blake2b of a canonical encoding of the key
+
+# Protocol 4 was the default when the existing ids were generated, it is pinned so that they don't change with
+# python versions whose default protocol differs
+PICKLE_PROTOCOL = 4
+
+_NONE, _INT, _STR = b"N", b"I", b"S"
+_pack_int = struct.Struct("<cq").pack  # tag and value
+_pack_str_header = struct.Struct("<cI").pack  # tag and length of the utf-8 bytes
+
+
+@lru_cache(maxsize=None)
+def id_scheme():
+    """
+    Id scheme set by the ID_SCHEME environment variable, "compat" by default.
+    Both schemes give 16 bytes ids, but different ones: a database must keep the scheme it was filled with.
+    """
+    scheme = os.environ.get("ID_SCHEME", COMPAT)
+    if scheme not in (COMPAT, FAST):
+        raise ValueError(f"Unknown ID_SCHEME '{scheme}', expected '{COMPAT}' or '{FAST}'")
+    return scheme
+
+
+def encode_key(key):
+    """
+    Canonical byte encoding of a key: every field is type tagged and strings are length prefixed,
+    so that two different keys can't have the same encoding and it doesn't depend on the python version.
+    Args:
+        key: str, int or None, or tuple of them
+    """
+    fields = key if isinstance(key, tuple) else (key,)
+    return b"".join(_encode_field(field) for field in fields)
+
+
+def _encode_field(field):
+    if field is None:
+        return _NONE
+    if isinstance(field, int):
+        return _pack_int(_INT, field)
+    if isinstance(field, str):
+        encoded = field.encode("utf-8")
+        return _pack_str_header(_STR, len(encoded)) + encoded
+    raise TypeError(f"Id keys can only contain str, int or None, not {type(field).__name__}")
+
+
+def compat_id(key):
+    """Id of a key as generated by hash_tuple with pickle protocol 4, as raw bytes"""
+    return md5(pickle.dumps(key, protocol=PICKLE_PROTOCOL)).digest()
+
+
+def fast_id(key):
+    """Id of a key from its canonical encoding"""
+    return blake2b(encode_key(key), digest_size=16).digest()
+
+
+def make_id(key):
+    """
+    Id of a key with the configured scheme
+    Args:
+        key: str, int or None, or tuple of them
+
+    Returns:
+        bytes: 16 bytes id, stored as BINARY(16)
+    """
+    return fast_id(key) if id_scheme() == FAST else compat_id(key)
+
+
+def id_to_hex(id_: bytes):
+    """32 characters hex form of an id, for display and for the ids of databases created before binary ids"""
+    return id_.hex()
+
+
+def id_from_hex(hex_id: str):
+    """16 bytes id of its 32 characters hex form, e.g. an id read from a database created before binary ids"""
+    return bytes.fromhex(hex_id)
+
+
+def track_ids(tracks, album_id: bytes):
+    """
+    Ids of the tracks of an album, computed in one call.
+    The compat scheme hashes (title, duration, album_id) like hash_tuple. The fast scheme hashes
+    (album_id, title, duration): the hash state of the album id is computed once and copied for every track.
+    Both hash the hex form of the album id, which ids were computed from before they were stored as bytes.
+    Args:
+        tracks: iterable of (lowercase title, duration) tuples
+        album_id (bytes): id of the album
+
+    Returns:
+        list: ids of the tracks, in the same order
+    """
+    album_id = id_to_hex(album_id)
+    if id_scheme() != FAST:
+        return [md5(pickle.dumps((title, duration, album_id), protocol=PICKLE_PROTOCOL)).digest()
+                for title, duration in tracks]
+    album_hash = blake2b(encode_key(album_id), digest_size=16)
+    ids = []
+    for title, duration in tracks:
+        # encode_key((title, duration)) inlined, this is the hot loop of the database saving
+        encoded = title.encode("utf-8")
+        track_hash = album_hash.copy()
+        track_hash.update(_pack_str_header(_STR, len(encoded)) + encoded + _encode_field(duration))
+        ids.append(track_hash.digest())
+    return ids
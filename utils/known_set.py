@@ -0,0 +1,33 @@
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+
+import numpy as np
+
+
+class SortedHashSet:
+    def __init__(self, items=()):
+        """
+        Compact, read-only set of strings.
+        Only a sorted array of their 64 bits hashes is kept, 8 bytes per item, and lookups use binary search.
+        False positives are possible but negligible (about n / 2^64).
+        Args:
+            items: iterable of strings, it can be a generator streaming rows from the database
+        """
+        # Sorted in place and no Python int is kept, the peak memory is about 16 bytes per item
+        hashes = np.fromiter((self._hash(item) for item in items), dtype=np.uint64)
+        hashes.sort()
+        self._hashes = array("Q")
+        self._hashes.frombytes(hashes.view(np.uint8))  # bisect is faster on an array than on a numpy array
+
+    def __contains__(self, item: str):
+        hashed = self._hash(item)
+        i = bisect_left(self._hashes, hashed)
+        return i < len(self._hashes) and self._hashes[i] == hashed
+
+    def __len__(self):
+        return len(self._hashes)
+
+    @staticmethod
+    def _hash(item: str):
+        return int.from_bytes(blake2b(item.encode("utf-8"), digest_size=8).digest(), "little")